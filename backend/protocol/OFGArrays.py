@@ -0,0 +1,542 @@
+"""Bulk NumPy decoding and encoding of fixed-size OFG topology records.
+
+NodesAdd, NodesDel, LinksAdd and LinksDel bodies are an xid followed by an
+array of fixed-size Node, LinkSpec or Link records.  The classes here decode
+such a body with a single numpy.frombuffer() call into a big-endian
+structured array (one column per wire field) and encode it back with a single
+buffer copy.  The usual object API remains available through a lazy
+RecordView which only builds Node/Link objects for the elements accessed.
+
+TopologyColumns keeps a whole topology in this columnar form so that a
+snapshot NodesAdd/LinksAdd can be packed straight from its columns (see
+OFGTopology.TopologyStore, which can keep one up to date).
+
+This module requires NumPy; the rest of the protocol does not.  Use
+OFG_ARRAY_PROTOCOL (e.g. create_ofg_server(port, cb, OFG_ARRAY_PROTOCOL)) to
+receive these messages in array form.
+"""
+
+import numpy
+
+from OFGMessage import OFG_MESSAGES, OFGMessage, OFGProtocol, Node, Link, LinkSpec, Request, \
+                       NodesAdd, NodesDel, LinksAdd, LinksDel
+
+NODE_DTYPE = numpy.dtype([('node_type', '>u2'), ('id', '>u8')])
+
+LINK_DTYPE = numpy.dtype([('link_type', '>u2'),
+                          ('src_type', '>u2'), ('src_id', '>u8'), ('src_port', '>u2'),
+                          ('dst_type', '>u2'), ('dst_id', '>u8'), ('dst_port', '>u2')])
+
+LINKSPEC_DTYPE = numpy.dtype(LINK_DTYPE.descr + [('capacity_bps', '>u8')])
+
+assert NODE_DTYPE.itemsize == Node.SIZE
+assert LINK_DTYPE.itemsize == Link.SIZE
+assert LINKSPEC_DTYPE.itemsize == LinkSpec.SIZE
+
+def record_to_node(r):
+    return Node(r[0], r[1])
+
+def record_to_link(r):
+    return Link(int(r[0]), Node(r[1], r[2]), int(r[3]), Node(r[4], r[5]), int(r[6]))
+
+def record_to_linkspec(r):
+    return LinkSpec(int(r[0]), Node(r[1], r[2]), int(r[3]), Node(r[4], r[5]), int(r[6]), r[7])
+
+def nodes_to_array(nodes):
+    """Returns a NODE_DTYPE array holding the specified Node objects."""
+    return numpy.array([(n.node_type, n.id) for n in nodes], dtype=NODE_DTYPE)
+
+def links_to_array(links, dtype=LINKSPEC_DTYPE):
+    """Returns a LINK_DTYPE or LINKSPEC_DTYPE array holding the specified links."""
+    if dtype is LINKSPEC_DTYPE:
+        recs = [(l.link_type, l.src_node.node_type, l.src_node.id, l.src_port,
+                 l.dst_node.node_type, l.dst_node.id, l.dst_port, l.capacity_bps) for l in links]
+    else:
+        recs = [(l.link_type, l.src_node.node_type, l.src_node.id, l.src_port,
+                 l.dst_node.node_type, l.dst_node.id, l.dst_port) for l in links]
+    return numpy.array(recs, dtype=dtype)
+
+class RecordView:
+    """A read-only sequence of protocol objects which are built on demand from
+    the rows of a structured array."""
+    def __init__(self, arr, to_obj):
+        self.array = arr
+        self.to_obj = to_obj
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return RecordView(self.array[i], self.to_obj)
+        return self.to_obj(self.array[i])
+
+    def __iter__(self):
+        to_obj = self.to_obj
+        for r in self.array:
+            yield to_obj(r)
+
+def unpack_array(body, dtype):
+    """Returns the xid and the array of dtype records which follow it in body."""
+    xid = OFGMessage.FMT.unpack_from(body)[0]
+    count = (len(body) - OFGMessage.SIZE) / dtype.itemsize
+    return xid, numpy.frombuffer(body, dtype, count, OFGMessage.SIZE)
+
+def pack_array(xid, arr, dtype):
+    """Packs an xid and an array of records (converted to dtype if needed)."""
+    return OFGMessage.FMT.pack(xid) + arr.astype(dtype, copy=False).tostring()
+
+class NodesAddArray(NodesAdd):
+    __slots__ = ('array',)
+
+    def __init__(self, arr, xid=0):
+        if isinstance(arr, RecordView):
+            arr = arr.array  # e.g. a slice of another message's records
+        NodesAdd.__init__(self, RecordView(arr, record_to_node), xid)
+        self.array = arr
+
+    def length(self):
+        return OFGMessage.SIZE + len(self.array) * Node.SIZE
+
+    def pack(self):
+        return pack_array(self.xid, self.array, NODE_DTYPE)
+
+    def merge(self, other):
+        return NodesAddArray(numpy.concatenate((self.array, other.array)), self.xid)
+
+    @staticmethod
+    def unpack(body):
+        xid, arr = unpack_array(body, NODE_DTYPE)
+        return NodesAddArray(arr, xid)
+
+class NodesDelArray(NodesDel):
+    __slots__ = ('array',)
+
+    def __init__(self, arr, xid=0):
+        if isinstance(arr, RecordView):
+            arr = arr.array  # e.g. a slice of another message's records
+        NodesDel.__init__(self, RecordView(arr, record_to_node), xid)
+        self.array = arr
+
+    def length(self):
+        return OFGMessage.SIZE + len(self.array) * Node.SIZE
+
+    def pack(self):
+        return pack_array(self.xid, self.array, NODE_DTYPE)
+
+    def merge(self, other):
+        return NodesDelArray(numpy.concatenate((self.array, other.array)), self.xid)
+
+    @staticmethod
+    def unpack(body):
+        xid, arr = unpack_array(body, NODE_DTYPE)
+        return NodesDelArray(arr, xid)
+
+class LinksAddArray(LinksAdd):
+    __slots__ = ('array',)
+
+    def __init__(self, arr, xid=0):
+        if isinstance(arr, RecordView):
+            arr = arr.array  # e.g. a slice of another message's records
+        LinksAdd.__init__(self, RecordView(arr, record_to_linkspec), xid)
+        self.array = arr
+
+    def length(self):
+        return OFGMessage.SIZE + len(self.array) * LinkSpec.SIZE
+
+    def pack(self):
+        return pack_array(self.xid, self.array, LINKSPEC_DTYPE)
+
+    def merge(self, other):
+        return LinksAddArray(numpy.concatenate((self.array, other.array)), self.xid)
+
+    @staticmethod
+    def unpack(body):
+        xid, arr = unpack_array(body, LINKSPEC_DTYPE)
+        return LinksAddArray(arr, xid)
+
+class LinksDelArray(LinksDel):
+    __slots__ = ('array',)
+
+    def __init__(self, arr, xid=0):
+        if isinstance(arr, RecordView):
+            arr = arr.array  # e.g. a slice of another message's records
+        LinksDel.__init__(self, RecordView(arr, record_to_link), xid)
+        self.array = arr
+
+    def length(self):
+        return OFGMessage.SIZE + len(self.array) * Link.SIZE
+
+    def pack(self):
+        return pack_array(self.xid, self.array, LINK_DTYPE)
+
+    def merge(self, other):
+        return LinksDelArray(numpy.concatenate((self.array, other.array)), self.xid)
+
+    @staticmethod
+    def unpack(body):
+        xid, arr = unpack_array(body, LINK_DTYPE)
+        return LinksDelArray(arr, xid)
+
+# the OFG protocol with the topology list messages decoded into arrays
+_ARRAY_VERSIONS = dict((c.get_type(), c) for c in (NodesAddArray, NodesDelArray,
+                                                    LinksAddArray, LinksDelArray))
+OFG_ARRAY_MESSAGES = [_ARRAY_VERSIONS.get(m.get_type(), m) for m in OFG_MESSAGES]
+OFG_ARRAY_PROTOCOL = OFGProtocol(OFG_ARRAY_MESSAGES, 'H', 'B')
+
+
+class RowIndex:
+    """An open-addressing hash table (with linear probing) which maps keys to
+    the rows of a table of columns.  Only the row numbers are stored, in a
+    NumPy array; key_of(row) returns a row's key from the columns themselves.
+    So the index costs a few bytes per row rather than a key tuple and a
+    dictionary entry per row."""
+    EMPTY = -1
+    MULTIPLIER = 0x9E3779B97F4A7C15  # 2**64 divided by the golden ratio
+
+    def __init__(self, key_of, size=2048):
+        self.key_of = key_of
+        self.count = 0
+        self._alloc(size)
+
+    def _alloc(self, size):
+        """Replaces the slots with size (a power of 2) empty ones."""
+        self.slots = numpy.empty(size, numpy.int32)
+        self.slots.fill(RowIndex.EMPTY)
+        self.shift = 64 - (size.bit_length() - 1)
+
+    def _home(self, key):
+        """Returns the first slot key's row may be in.  The key's hash is
+        spread over the slot bits (Fibonacci hashing) since tuples of nearby
+        integers have hashes with similar low bits."""
+        return ((hash(key) * RowIndex.MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> self.shift
+
+    def _find(self, key):
+        """Returns the slot holding key's row, or else the empty slot where it
+        would go."""
+        slots = self.slots
+        mask = len(slots) - 1
+        s = self._home(key)
+        r = slots[s]
+        while r != RowIndex.EMPTY:
+            if self.key_of(r) == key:
+                return s
+            s = (s + 1) & mask
+            r = slots[s]
+        return s
+
+    def get(self, key):
+        """Returns key's row, or None if it is not present."""
+        r = self.slots[self._find(key)]
+        if r == RowIndex.EMPTY:
+            return None
+        return int(r)
+
+    def setdefault(self, key, row):
+        """Returns key's row if it is present.  Otherwise maps key to row
+        (whose key must be in the columns before the index is used again) and
+        returns None."""
+        if 2 * (self.count + 1) > len(self.slots):
+            self._resize(2 * len(self.slots))
+        s = self._find(key)
+        r = self.slots[s]
+        if r != RowIndex.EMPTY:
+            return int(r)
+        self.slots[s] = row
+        self.count += 1
+        return None
+
+    def move(self, key, row):
+        """Maps key (which must be present) to row instead, e.g. once the
+        row's contents were moved there."""
+        self.slots[self._find(key)] = row
+
+    def remove(self, key):
+        """Unmaps key, which must be present.  The rows after it in its probe
+        sequence are shifted back so that no tombstones are needed."""
+        slots = self.slots
+        mask = len(slots) - 1
+        hole = s = self._find(key)
+        while True:
+            s = (s + 1) & mask
+            r = slots[s]
+            if r == RowIndex.EMPTY:
+                break
+            home = self._home(self.key_of(r))
+            if (s - home) & mask >= (s - hole) & mask:  # the hole is on r's probe sequence
+                slots[hole] = r
+                hole = s
+        slots[hole] = RowIndex.EMPTY
+        self.count -= 1
+
+    def _resize(self, size):
+        rows = self.slots[self.slots != RowIndex.EMPTY]
+        self._alloc(size)
+        slots = self.slots
+        mask = size - 1
+        for r in rows:
+            s = self._home(self.key_of(r))
+            while slots[s] != RowIndex.EMPTY:
+                s = (s + 1) & mask
+            slots[s] = r
+
+    def nbytes(self):
+        return self.slots.nbytes
+
+class TopologyColumns:
+    """A compact struct-of-arrays store of nodes and links.
+
+    Each node is a row in the node_type, node_id, listed and degree columns,
+    where degree is the number of links to or from it.  Nodes only added as
+    the endpoints of links are not listed (i.e. not included in
+    nodes_array()) and are removed along with their last link.  Each link is
+    a row in the link_type, src, src_port, dst, dst_port and capacity_bps
+    columns, where src and dst are row indices into the node columns.  Only
+    the first num_nodes and num_links rows of each column are in use; the
+    columns grow by doubling.  A removed row is filled by moving the last row
+    into it, so the rows stay packed (and their order is not preserved).
+
+    Nodes are found by (node_type, node_id) and links by link_key() through
+    a RowIndex over each table, so apart from the columns each row only
+    costs a few bytes of index.  Other queries (e.g. the links from a node)
+    scan the columns with vectorized comparisons.
+    """
+    def __init__(self, capacity=1024):
+        self.num_nodes = 0
+        self.num_links = 0
+
+        self.node_type = numpy.zeros(capacity, numpy.uint16)
+        self.node_id = numpy.zeros(capacity, numpy.uint64)
+        self.listed = numpy.zeros(capacity, numpy.bool_)
+        self.degree = numpy.zeros(capacity, numpy.uint32)
+
+        self.link_type = numpy.zeros(capacity, numpy.uint16)
+        self.src = numpy.zeros(capacity, numpy.uint32)
+        self.src_port = numpy.zeros(capacity, numpy.uint16)
+        self.dst = numpy.zeros(capacity, numpy.uint32)
+        self.dst_port = numpy.zeros(capacity, numpy.uint16)
+        self.capacity_bps = numpy.zeros(capacity, numpy.uint64)
+
+        self.node_index = RowIndex(self.node_key, 2 * capacity)
+        self.link_index = RowIndex(self.row_link_key, 2 * capacity)
+
+    @staticmethod
+    def _grow(cols, n):
+        """Returns cols (a list of equal-length columns) grown to hold n rows."""
+        if n <= len(cols[0]):
+            return cols
+        sz = max(n, 2 * len(cols[0]))
+        ret = []
+        for c in cols:
+            g = numpy.zeros(sz, c.dtype)
+            g[:len(c)] = c
+            ret.append(g)
+        return ret
+
+    def node_key(self, i):
+        """Returns the (node_type, node_id) key of node row i."""
+        return (int(self.node_type[i]), int(self.node_id[i]))
+
+    def node_row(self, node_type, node_id):
+        """Returns the row of a node, or None if it is not present."""
+        return self.node_index.get((node_type, node_id))
+
+    def add_node(self, node_type, node_id, listed=True):
+        """Adds a node (if it is not already present) and returns its row."""
+        i = self.num_nodes
+        row = self.node_index.setdefault((node_type, node_id), i)
+        if row is not None:
+            if listed:
+                self.listed[row] = True
+            return row
+
+        self.node_type, self.node_id, self.listed, self.degree = TopologyColumns._grow(
+            [self.node_type, self.node_id, self.listed, self.degree], i + 1)
+        self.node_type[i] = node_type
+        self.node_id[i] = node_id
+        self.listed[i] = listed
+        self.degree[i] = 0
+        self.num_nodes = i + 1
+        return i
+
+    def remove_node(self, node_type, node_id):
+        """Removes a node and the links to or from it.  Returns False if it
+        was not present."""
+        i = self.node_index.get((node_type, node_id))
+        if i is None:
+            return False
+
+        attached = self.attached_rows(i)
+        ends = set([self.node_key(i)])
+        for row in attached:
+            ends.add(self.node_key(self.src[row]))
+            ends.add(self.node_key(self.dst[row]))
+        self.listed[i] = False
+        for row in attached[::-1]:  # highest first, so the other rows do not move
+            self._remove_link_row(int(row))
+        self._release(ends)
+        return True
+
+    def _release(self, keys):
+        """Removes those of the specified nodes which are neither listed nor
+        the endpoint of any link."""
+        for k in keys:
+            i = self.node_index.get(k)
+            if i is not None and not self.listed[i] and not self.degree[i]:
+                self._remove_node_row(i)
+
+    def _remove_node_row(self, i):
+        self.node_index.remove(self.node_key(i))
+        last = self.num_nodes - 1
+        if i != last:
+            last_key = self.node_key(last)
+            for c in (self.node_type, self.node_id, self.listed, self.degree):
+                c[i] = c[last]
+            self.node_index.move(last_key, i)
+            n = self.num_links
+            self.src[:n][self.src[:n] == last] = i
+            self.dst[:n][self.dst[:n] == last] = i
+        self.num_nodes = last
+
+    def link_key(self, src, src_port, dst, dst_port):
+        """Returns the key of a link between two node rows (the same as
+        OFGTopology.link_key() returns for the equivalent Link)."""
+        return self.node_key(src) + (int(src_port),) + self.node_key(dst) + (int(dst_port),)
+
+    def row_link_key(self, i):
+        """Returns the key of link row i."""
+        return self.link_key(self.src[i], self.src_port[i], self.dst[i], self.dst_port[i])
+
+    def link_row(self, l):
+        """Returns the row of the link between l's ports, or None."""
+        return self.link_index.get((l.src_node.node_type, l.src_node.id, l.src_port,
+                                    l.dst_node.node_type, l.dst_node.id, l.dst_port))
+
+    def add_link(self, link_type, src, src_port, dst, dst_port, capacity_bps):
+        """Adds a link between two node rows (or replaces the link between the
+        same ports) and returns the link's row."""
+        i = self.link_index.setdefault(self.link_key(src, src_port, dst, dst_port), self.num_links)
+        if i is None:
+            i = self.num_links
+            cols = [self.link_type, self.src, self.src_port, self.dst, self.dst_port, self.capacity_bps]
+            (self.link_type, self.src, self.src_port,
+             self.dst, self.dst_port, self.capacity_bps) = TopologyColumns._grow(cols, i + 1)
+            self.src[i] = src
+            self.src_port[i] = src_port
+            self.dst[i] = dst
+            self.dst_port[i] = dst_port
+            self.degree[src] += 1
+            self.degree[dst] += 1
+            self.num_links = i + 1
+        self.link_type[i] = link_type
+        self.capacity_bps[i] = capacity_bps
+        return i
+
+    def add_linkspec(self, ls):
+        """Adds a LinkSpec object (and its endpoints) and returns the link's row."""
+        src = self.add_node(ls.src_node.node_type, ls.src_node.id, listed=False)
+        dst = self.add_node(ls.dst_node.node_type, ls.dst_node.id, listed=False)
+        return self.add_link(ls.link_type, src, ls.src_port, dst, ls.dst_port, ls.capacity_bps)
+
+    def remove_link(self, l):
+        """Removes the link between l's ports.  Returns False if there was none."""
+        i = self.link_row(l)
+        if i is None:
+            return False
+        ends = (self.node_key(self.src[i]), self.node_key(self.dst[i]))
+        self._remove_link_row(i)
+        self._release(ends)
+        return True
+
+    def _remove_link_row(self, i):
+        self.link_index.remove(self.row_link_key(i))
+        self.degree[self.src[i]] -= 1
+        self.degree[self.dst[i]] -= 1
+        last = self.num_links - 1
+        if i != last:
+            last_key = self.row_link_key(last)
+            for c in (self.link_type, self.src, self.src_port, self.dst, self.dst_port, self.capacity_bps):
+                c[i] = c[last]
+            self.link_index.move(last_key, i)
+        self.num_links = last
+
+    def node_rows(self, node_type=Request.ANY_TYPE):
+        """Returns the rows of the listed nodes of the specified type (default: all)."""
+        n = self.num_nodes
+        mask = self.listed[:n]
+        if node_type != Request.ANY_TYPE:
+            mask = mask & (self.node_type[:n] == node_type)
+        return numpy.flatnonzero(mask)
+
+    def link_rows(self, link_type=Request.ANY_TYPE, src=None, dst=None):
+        """Returns the rows of the links of the specified type (default: all),
+        only those from node row src and to node row dst if they are given."""
+        n = self.num_links
+        mask = numpy.ones(n, numpy.bool_)
+        if link_type != Request.ANY_TYPE:
+            mask &= self.link_type[:n] == link_type
+        if src is not None:
+            mask &= self.src[:n] == src
+        if dst is not None:
+            mask &= self.dst[:n] == dst
+        return numpy.flatnonzero(mask)
+
+    def attached_rows(self, i):
+        """Returns the rows of the links to or from node row i."""
+        n = self.num_links
+        return numpy.flatnonzero((self.src[:n] == i) | (self.dst[:n] == i))
+
+    def nodes_array(self, rows=None):
+        """Returns the nodes in the specified rows (default: the listed nodes)
+        as a NODE_DTYPE array (i.e., in wire format)."""
+        if rows is None:
+            rows = self.node_rows()
+        arr = numpy.empty(len(rows), NODE_DTYPE)
+        arr['node_type'] = self.node_type[rows]
+        arr['id'] = self.node_id[rows]
+        return arr
+
+    def links_array(self, rows=None):
+        """Returns the links in the specified rows (default: every link) as a
+        LINKSPEC_DTYPE array (i.e., in wire format)."""
+        if rows is None:
+            rows = slice(0, self.num_links)
+        src = self.src[rows]
+        dst = self.dst[rows]
+        arr = numpy.empty(len(src), LINKSPEC_DTYPE)
+        arr['link_type'] = self.link_type[rows]
+        arr['src_type'] = self.node_type[src]
+        arr['src_id'] = self.node_id[src]
+        arr['src_port'] = self.src_port[rows]
+        arr['dst_type'] = self.node_type[dst]
+        arr['dst_id'] = self.node_id[dst]
+        arr['dst_port'] = self.dst_port[rows]
+        arr['capacity_bps'] = self.capacity_bps[rows]
+        return arr
+
+    def nodes(self, rows=None):
+        """Returns a list of Node objects for the nodes in the specified rows
+        (default: the listed nodes)."""
+        return list(RecordView(self.nodes_array(rows), record_to_node))
+
+    def linkspecs(self, rows=None):
+        """Returns a list of LinkSpec objects for the links in the specified
+        rows (default: every link)."""
+        return list(RecordView(self.links_array(rows), record_to_linkspec))
+
+    def nodes_add(self, xid=0, rows=None):
+        """Returns a NodesAdd message containing the nodes in the specified
+        rows (default: the listed nodes)."""
+        return NodesAddArray(self.nodes_array(rows), xid)
+
+    def links_add(self, xid=0, rows=None):
+        """Returns a LinksAdd message containing the links in the specified
+        rows (default: every link)."""
+        return LinksAddArray(self.links_array(rows), xid)
+
+    def nbytes(self):
+        """Returns the number of bytes allocated for the columns (including
+        their spare rows) and the indexes."""
+        cols = (self.node_type, self.node_id, self.listed, self.degree,
+                self.link_type, self.src, self.src_port, self.dst, self.dst_port, self.capacity_bps)
+        return sum(c.nbytes for c in cols) + self.node_index.nbytes() + self.link_index.nbytes()
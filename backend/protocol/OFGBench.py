@@ -0,0 +1,803 @@
+"""Micro-benchmarks for the OpenFlow GUI protocol codecs."""
+
+import array
+import struct
+import sys
+import time
+from timeit import Timer
+
+from OFGMessage import DPIDSTR_CACHE_SIZE, OFG_MESSAGES, OFG_PROTOCOL, AuthReply, AuthRequest, \
+                       AuthStatus, Batch, Compressed, Disconnect, EchoReply, EchoRequest, Flow, \
+                       FlowHop, FlowsAdd, FlowsDel, FlowsRequest, Link, LinkSpec, LinksAdd, \
+                       LinksDel, LinksRequest, Node, NodesAdd, NodesDel, NodesRequest, \
+                       PollInterval, PollStart, PollStop, Request, StatsHeader, StatsReply, \
+                       StatsRequest, array_to_octstr, dpidstr, sha1, str_to_dpid
+
+def make_sample_messages():
+    """Returns a dictionary mapping a name to a representative instance of
+    each OFG message and wire record type."""
+    n1 = Node(Node.TYPE_OPENFLOW_SWITCH, 0x0000001122334455)
+    n2 = Node(Node.TYPE_OPENFLOW_SWITCH, 0x0000001122334466)
+    n3 = Node(Node.TYPE_HOST, 0x0000001122334477)
+    link = Link(Link.TYPE_WIRE, n1, 1, n2, 2)
+    lspec = LinkSpec(Link.TYPE_WIRE, n1, 1, n2, 2, 1000*1000*1000)
+    hop = FlowHop(1, n2, 2)
+    flow = Flow(Flow.TYPE_UNKNOWN, 44, n1, 0, n3, 1, [hop, FlowHop(3, n3, 4)])
+    return {
+        'Node'         : n1,
+        'Link'         : link,
+        'LinkSpec'     : lspec,
+        'FlowHop'      : hop,
+        'Flow'         : flow,
+        'EchoRequest'  : EchoRequest(7),
+        'AuthRequest'  : AuthRequest('s' * 20, 1),
+        'AuthReply'    : AuthReply('dgu', sha1('envi'), 1),
+        'AuthStatus'   : AuthStatus(True, 'login ok', 1),
+        'PollStart'    : PollStart(10, NodesRequest(Request.TYPE_ONETIME, Node.TYPE_OPENFLOW_SWITCH, 2), 3),
+        'PollStop'     : PollStop(3, 4),
+        'PollInterval' : PollInterval(3, 20, 12),
+        'NodesAdd'     : NodesAdd([n1, n2, n3], 5),
+        'LinksAdd'     : LinksAdd([lspec, lspec], 6),
+        'LinksDel'     : LinksDel([link, link], 6),
+        'FlowsAdd'     : FlowsAdd([flow, flow], 8),
+        'NodesRequest' : NodesRequest(Request.TYPE_ONETIME, Node.TYPE_OPENFLOW_SWITCH, 9),
+        'LinksRequest' : LinksRequest(Request.TYPE_SUBSCRIBE, Link.TYPE_WIRE, n1, 10),
+        'FlowsRequest' : FlowsRequest(Request.TYPE_ONETIME, Flow.TYPE_UNKNOWN, 11),
+    }
+
+def time_per_call(fn, number):
+    """Returns the best-of-three time (in microseconds) for one call to fn."""
+    return min(Timer(fn).repeat(3, number)) * 1e6 / number
+
+# The original decoders of each type's fixed fields: a struct.unpack() with a
+# format string per field (or small group of fields), re-slicing the buffer
+# after each one.  Each returns the decoded fields.
+def legacy_node(buf):
+    t = struct.unpack('> HQ', buf[:Node.SIZE])
+    return t[0], t[1]
+
+def legacy_link(buf):
+    link_type = struct.unpack('> H', buf[:2])[0]
+    buf = buf[2:]
+    src_node = legacy_node(buf[:Node.SIZE])
+    buf = buf[Node.SIZE:]
+    src_port = struct.unpack('> H', buf[:2])[0]
+    buf = buf[2:]
+    dst_node = legacy_node(buf[:Node.SIZE])
+    buf = buf[Node.SIZE:]
+    dst_port = struct.unpack('> H', buf[:2])[0]
+    return link_type, src_node, src_port, dst_node, dst_port
+
+def legacy_linkspec(buf):
+    link = legacy_link(buf)
+    buf = buf[Link.SIZE:]
+    capacity_bps = struct.unpack('> Q', buf)[0]
+    return link + (capacity_bps,)
+
+def legacy_flowhop(buf):
+    inport = struct.unpack('> H', buf[:2])[0]
+    buf = buf[2:]
+    node = legacy_node(buf[:Node.SIZE])
+    buf = buf[Node.SIZE:]
+    outport = struct.unpack('> H', buf[:2])[0]
+    return inport, node, outport
+
+def legacy_flow(buf):
+    flow_type, flow_id = struct.unpack('> H I', buf[:6])
+    buf = buf[6:]
+    src_node = legacy_node(buf[:Node.SIZE])
+    buf = buf[Node.SIZE:]
+    src_port = struct.unpack('> H', buf[:2])[0]
+    buf = buf[2:]
+    dst_node = legacy_node(buf[:Node.SIZE])
+    buf = buf[Node.SIZE:]
+    dst_port = struct.unpack('> H', buf[:2])[0]
+    buf = buf[2:]
+    num_hops = struct.unpack('> H', buf[:2])[0]
+    return flow_type, flow_id, src_node, src_port, dst_node, dst_port, num_hops
+
+def legacy_xid(body):
+    return struct.unpack('> I', body[:4])[0]
+
+def legacy_auth_reply(body):
+    return struct.unpack('> 2I', body[:8])
+
+def legacy_auth_status(body):
+    return struct.unpack('> IB', body[:5])
+
+def legacy_poll_start(body):
+    xid = struct.unpack('> I', body[:4])[0]
+    body = body[4:]
+    interval = struct.unpack('> H', body[:2])[0]
+    body = body[2:]
+    inner_len = struct.unpack('> H', body[:2])[0]
+    body = body[2:]
+    type_val = struct.unpack('> B', body[:1])[0]
+    return xid, interval, inner_len, type_val
+
+def legacy_poll_stop(body):
+    xid = struct.unpack('> I', body[:4])[0]
+    body = body[4:]
+    xid_to_stop_polling = struct.unpack('> I', body[:4])[0]
+    return xid, xid_to_stop_polling
+
+def legacy_flows_list(body):
+    xid = struct.unpack('> I', body[:4])[0]
+    body = body[4:]
+    num_flows = struct.unpack('> I', body[:4])[0]
+    return xid, num_flows
+
+def legacy_request(body):
+    xid = struct.unpack('> I', body[:4])[0]
+    body = body[4:]
+    t = struct.unpack('> BH', body[:3])
+    return xid, t[0], t[1]
+
+def legacy_links_request(body):
+    xid = struct.unpack('> I', body[:4])[0]
+    body = body[4:]
+    t = struct.unpack('> BH', body[:3])
+    body = body[3:]
+    src_node = legacy_node(body)
+    return xid, t[0], t[1], src_node
+
+# the original fixed-field decoder of each sample type which had one
+LEGACY_FIXED_DECODERS = {
+    'Node'         : legacy_node,
+    'Link'         : legacy_link,
+    'LinkSpec'     : legacy_linkspec,
+    'FlowHop'      : legacy_flowhop,
+    'Flow'         : legacy_flow,
+    'EchoRequest'  : legacy_xid,
+    'AuthRequest'  : legacy_xid,
+    'AuthReply'    : legacy_auth_reply,
+    'AuthStatus'   : legacy_auth_status,
+    'PollStart'    : legacy_poll_start,
+    'PollStop'     : legacy_poll_stop,
+    'NodesAdd'     : legacy_xid,
+    'LinksAdd'     : legacy_xid,
+    'LinksDel'     : legacy_xid,
+    'FlowsAdd'     : legacy_flows_list,
+    'NodesRequest' : legacy_request,
+    'LinksRequest' : legacy_links_request,
+    'FlowsRequest' : legacy_request,
+}
+
+def bench_fixed_headers(number=100000, out=sys.stdout):
+    """Compares decoding each type's fixed fields with its original
+    decoder (one format-string struct.unpack() per field and a re-slice of
+    the buffer after each) against one call to its precompiled
+    struct.Struct."""
+    print >> out, '%-14s %12s %12s %8s' % ('type', 'legacy (us)', 'Struct (us)', 'speedup')
+    samples = make_sample_messages()
+    for name in sorted(LEGACY_FIXED_DECODERS.keys()):
+        obj = samples[name]
+        codec = obj.FMT
+        buf = obj.pack()
+        legacy = LEGACY_FIXED_DECODERS[name]
+        t_legacy = time_per_call(lambda: legacy(buf), number)
+        t_st = time_per_call(lambda: codec.unpack_from(buf), number)
+        print >> out, '%-14s %12.3f %12.3f %7.2fx' % (name, t_legacy, t_st, t_legacy / t_st)
+
+def bench_codecs(number=20000, out=sys.stdout):
+    """Times a full pack() and unpack() of each sample message."""
+    print >> out, '%-14s %10s %10s' % ('type', 'pack (us)', 'unpack (us)')
+    samples = make_sample_messages()
+    for name in sorted(samples.keys()):
+        obj = samples[name]
+        buf = obj.pack()
+        unpack = obj.__class__.unpack
+        t_pack = time_per_call(obj.pack, number)
+        t_unpack = time_per_call(lambda: unpack(buf), number)
+        print >> out, '%-14s %10.3f %10.3f' % (name, t_pack, t_unpack)
+
+def bench_list_scaling(sizes=(1000, 10000, 100000), out=sys.stdout):
+    """Times decoding of LinksAdd and FlowsAdd messages of increasing size.
+    The per-element cost should stay flat if decoding is linear."""
+    print >> out, '%-10s %8s %12s %14s' % ('type', 'elements', 'unpack (ms)', 'per elem (us)')
+    for sz in sizes:
+        nodes = [Node(Node.TYPE_OPENFLOW_SWITCH, i) for i in xrange(sz + 1)]
+        links = [LinkSpec(Link.TYPE_WIRE, nodes[i], 1, nodes[i+1], 2, 1000) for i in xrange(sz)]
+        flows = [Flow(Flow.TYPE_UNKNOWN, i, nodes[i], 0, nodes[i+1], 1, [FlowHop(0, nodes[i], 1)])
+                 for i in xrange(sz)]
+        for msg in (LinksAdd(links), FlowsAdd(flows)):
+            buf = msg.pack()
+            unpack = msg.__class__.unpack
+            t = min(Timer(lambda: unpack(buf)).repeat(3, 1))
+            print >> out, '%-10s %8u %12.2f %14.3f' % (msg.__class__.__name__, sz, t * 1e3, t * 1e6 / sz)
+
+# element counts and flow path lengths swept by bench_codec_sweep()
+SWEEP_SIZES = (1, 10, 100, 1000, 10000, 100000)
+SWEEP_HOPS = (1, 2, 4, 8, 16, 32, 64)
+
+def make_sweep_cases(sizes=SWEEP_SIZES, hops=SWEEP_HOPS, num_flows=1000):
+    """Returns a list of (name, elements, hops, obj, pack) tuples covering
+    every class in OFG_MESSAGES and each wire record type.  List messages
+    and envelopes are swept over sizes, and Flow and FlowsAdd (of num_flows
+    flows) over path lengths.  pack packs obj; for envelopes, which cache
+    their encoding, it packs a new envelope each time."""
+    max_sz = max(sizes)
+    nodes = [Node(Node.TYPE_OPENFLOW_SWITCH, 0x000000123400 + i) for i in xrange(max_sz + max(hops) + 1)]
+    specs = [LinkSpec(Link.TYPE_WIRE, nodes[i], 1, nodes[i+1], 2, 1000*1000*1000) for i in xrange(max_sz)]
+    links = [Link(Link.TYPE_WIRE, nodes[i], 1, nodes[i+1], 2) for i in xrange(max_sz)]
+    def flow(i, num_hops):
+        return Flow(Flow.TYPE_UNKNOWN, i, nodes[i], 0, nodes[i+num_hops+1], 1,
+                    [FlowHop(1, nodes[i+j+1], 2) for j in xrange(num_hops)])
+    flows = [flow(i, 4) for i in xrange(max_sz)]
+    stop = PollStop(3, 4)
+
+    sized = {'NodesAdd' : lambda n: NodesAdd(nodes[:n], 5),
+             'NodesDel' : lambda n: NodesDel(nodes[:n], 5),
+             'LinksAdd' : lambda n: LinksAdd(specs[:n], 6),
+             'LinksDel' : lambda n: LinksDel(links[:n], 6),
+             'FlowsAdd' : lambda n: FlowsAdd(flows[:n], 8),
+             'FlowsDel' : lambda n: FlowsDel(flows[:n], 8),
+             'Batch' : lambda n: Batch([stop] * n, 12),
+             'Compressed' : lambda n: Compressed.wrap([NodesAdd(nodes[:n], 5)], 13)}
+    fixed = make_sample_messages()
+    fixed.update({'Disconnect' : Disconnect(1),
+                  'EchoReply' : EchoReply(7),
+                  'StatsRequest' : StatsRequest(0x1122334455, StatsHeader.TYPE_DESC, 0, '', 14),
+                  'StatsReply' : StatsReply(0x1122334455, StatsHeader.TYPE_PORT, 0, 'x' * 104, 14)})
+
+    cases = []
+    for cls in OFG_MESSAGES:
+        name = cls.__name__
+        if name in sized:
+            for n in sizes:
+                obj = sized[name](n)
+                if name == 'Batch':
+                    pack = lambda n=n: Batch([stop] * n, 12).pack()
+                elif name == 'Compressed':
+                    pack = lambda obj=obj: Compressed(obj.frames, xid=obj.xid).pack()
+                else:
+                    pack = obj.pack
+                cases.append((name, n, 0, obj, pack))
+        else:
+            cases.append((name, 1, 0, fixed[name], fixed[name].pack))
+    for name in ('Node', 'Link', 'LinkSpec', 'FlowHop'):
+        cases.append((name, 1, 0, fixed[name], fixed[name].pack))
+    for h in hops:
+        f = flow(0, h)
+        cases.append(('Flow', 1, h, f, f.pack))
+        msg = FlowsAdd([flow(i, h) for i in xrange(num_flows)], 8)
+        cases.append(('FlowsAdd', num_flows, h, msg, msg.pack))
+    return cases
+
+def time_adaptive(fn, min_time=0.02):
+    """Returns the best-of-three time (in microseconds) for one call to fn,
+    calling it often enough that each of the three runs takes at least
+    min_time seconds."""
+    number = 1
+    while True:
+        t = Timer(fn).timeit(number)
+        if t >= min_time:
+            break
+        number *= 10 if t < min_time / 10 else 2
+    return min([t] + Timer(fn).repeat(2, number)) * 1e6 / number
+
+def bench_codec_sweep(sizes=SWEEP_SIZES, hops=SWEEP_HOPS, min_time=0.02, out=sys.stdout):
+    """Times pack(), unpack() and length() for each case from
+    make_sweep_cases() and returns a list of result dictionaries.  Records
+    with a fixed size have no length() (their SIZE is a constant)."""
+    print >> out, '%-12s %8s %4s %10s %12s %12s %12s' % ('type', 'elements', 'hops', 'bytes',
+                                                          'pack (us)', 'unpack (us)', 'length (us)')
+    results = []
+    for name, n, h, obj, pack in make_sweep_cases(sizes, hops):
+        buf = pack()
+        unpack = obj.__class__.unpack
+        r = {'name' : name,
+             'elements' : n,
+             'hops' : h,
+             'bytes' : len(buf),
+             'pack_us' : time_adaptive(pack, min_time),
+             'unpack_us' : time_adaptive(lambda: unpack(buf), min_time),
+             'length_us' : time_adaptive(obj.length, min_time) if hasattr(obj, 'length') else None}
+        results.append(r)
+        length = '%12.3f' % r['length_us'] if r['length_us'] is not None else '%12s' % '-'
+        print >> out, '%-12s %8u %4u %10u %12.3f %12.3f %s' % (name, n, h, r['bytes'], r['pack_us'],
+                                                               r['unpack_us'], length)
+    return results
+
+def write_results(path, results):
+    """Writes sweep results as JSON along with where they were measured."""
+    import json
+    import platform
+    import subprocess
+    try:
+        commit = subprocess.Popen(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE).communicate()[0].strip() or None
+    except OSError:
+        commit = None
+    meta = {'commit' : commit,
+            'python' : platform.python_version(),
+            'platform' : platform.platform(),
+            'time' : time.strftime('%Y-%m-%dT%H:%M:%S')}
+    f = open(path, 'w')
+    try:
+        json.dump({'meta' : meta, 'results' : results}, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+
+def compare_results(old_path, results, threshold=0.10, out=sys.stdout):
+    """Compares sweep results against those saved in old_path and prints
+    every timing which changed by more than threshold (as a fraction).
+    Returns the number which got slower by more than that."""
+    import json
+    f = open(old_path)
+    try:
+        old = json.load(f)
+    finally:
+        f.close()
+    before = dict([((r['name'], r['elements'], r['hops']), r) for r in old['results']])
+
+    print >> out, 'compared with %s (commit %s)' % (old_path, old['meta'].get('commit'))
+    print >> out, '%-12s %8s %4s %-10s %12s %12s %8s' % ('type', 'elements', 'hops', 'op',
+                                                          'old (us)', 'new (us)', 'change')
+    slower = 0
+    for r in results:
+        o = before.get((r['name'], r['elements'], r['hops']))
+        if o is None:
+            continue
+        for op in ('pack_us', 'unpack_us', 'length_us'):
+            if r[op] is None or o.get(op) is None or not o[op]:
+                continue
+            change = r[op] / o[op] - 1
+            if abs(change) <= threshold:
+                continue
+            if change > 0:
+                slower += 1
+            print >> out, '%-12s %8u %4u %-10s %12.3f %12.3f %+7.1f%%' % (r['name'], r['elements'], r['hops'],
+                                                                         op[:-3], o[op], r[op], change * 100)
+    print >> out, '%u timings more than %.0f%% slower' % (slower, threshold * 100)
+    return slower
+
+def deep_sizeof(obj, seen=None):
+    """Returns the approximate number of bytes used by obj and every object it
+    references (each object is only counted once)."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    sz = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        sz += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        sz += sum(deep_sizeof(x, seen) for x in obj)
+    else:
+        if hasattr(obj, '__dict__'):
+            sz += deep_sizeof(obj.__dict__, seen)
+        for c in getattr(obj.__class__, '__mro__', ()):
+            for s in c.__dict__.get('__slots__', ()):
+                if hasattr(obj, s):
+                    sz += deep_sizeof(getattr(obj, s), seen)
+    return sz
+
+def make_linkspecs(num_links):
+    """Returns a list of num_links LinkSpecs in a chain, each with its own
+    pair of Node objects as a decoded LinksAdd would have."""
+    return [LinkSpec(Link.TYPE_WIRE,
+                     Node(Node.TYPE_OPENFLOW_SWITCH, i), 1,
+                     Node(Node.TYPE_OPENFLOW_SWITCH, i + 1), 2,
+                     1000*1000*1000) for i in xrange(num_links)]
+
+def bench_columns(num_links=100000, out=sys.stdout):
+    """Compares memory use and snapshot packing time of LinkSpec objects
+    against the same topology held in OFGArrays.TopologyColumns, and of a
+    TopologyStore holding it as objects or in columns."""
+    from OFGArrays import TopologyColumns
+    from OFGTopology import TopologyStore
+
+    links = make_linkspecs(num_links)
+    cols = TopologyColumns()
+    for ls in links:
+        cols.add_linkspec(ls)
+    stores = []
+    for columns in (False, True):
+        store = TopologyStore(columns)
+        for ls in links:
+            store.add_link(ls)
+        stores.append(store)
+
+    obj_bytes = deep_sizeof(links)
+    col_bytes = cols.nbytes()  # the columns' capacity and their indexes
+    t_obj = min(Timer(lambda: LinksAdd(links).pack()).repeat(3, 1))
+    t_col = min(Timer(lambda: cols.links_add().pack()).repeat(3, 1))
+    print >> out, '%-19s %14s %14s' % ('representation', 'bytes/link', 'pack (ms)')
+    print >> out, '%-19s %14.1f %14.2f' % ('LinkSpec objects', float(obj_bytes) / num_links, t_obj * 1e3)
+    print >> out, '%-19s %14.1f %14.2f' % ('TopologyColumns', float(col_bytes) / num_links, t_col * 1e3)
+    for name, store in zip(('TopologyStore', 'TopologyStore -C'), stores):
+        req = LinksRequest(Request.TYPE_ONETIME, Request.ANY_TYPE, Node(Request.ANY_TYPE, 0))
+        t = min(Timer(lambda: store.answer(req).pack()).repeat(3, 1))
+        print >> out, '%-19s %14.1f %14.2f' % (name, float(deep_sizeof(store)) / num_links, t * 1e3)
+
+class _DictBacked(object):
+    """A plain object with a per-instance __dict__, used as the "before"
+    layout when measuring the slot-based protocol types."""
+    pass
+
+def dict_backed_sizeof(obj):
+    """Returns the shallow size obj would have with its attributes in a
+    per-instance __dict__ rather than in slots."""
+    d = _DictBacked()
+    for c in obj.__class__.__mro__:
+        for s in c.__dict__.get('__slots__', ()):
+            setattr(d, s, getattr(obj, s))
+    return sys.getsizeof(d) + sys.getsizeof(d.__dict__)
+
+def bench_memory(num_flows=100000, hops_per_flow=8, out=sys.stdout):
+    """Reports bytes per object, with __dict__ and with __slots__, for the
+    objects in a synthetic topology of num_flows flows of hops_per_flow hops."""
+    nodes = [Node(Node.TYPE_OPENFLOW_SWITCH, i) for i in xrange(hops_per_flow + 2)]
+    links = [LinkSpec(Link.TYPE_WIRE, nodes[i], 1, nodes[i+1], 2, 1000) for i in xrange(hops_per_flow + 1)]
+    flows = []
+    for i in xrange(num_flows):
+        path = [FlowHop(1, nodes[j+1], 2) for j in xrange(hops_per_flow)]
+        flows.append(Flow(Flow.TYPE_UNKNOWN, i, nodes[0], 0, nodes[-1], 1, path))
+    samples = [nodes[0], links[0], flows[0].path[0], flows[0], FlowsAdd(flows), NodesAdd(nodes)]
+    counts = {Node : len(nodes), LinkSpec : len(links), FlowHop : num_flows * hops_per_flow,
+              Flow : num_flows, FlowsAdd : 1, NodesAdd : 1}
+
+    print >> out, '%-10s %10s %12s %12s' % ('type', 'objects', '__dict__ (B)', '__slots__ (B)')
+    tot_before = tot_after = 0
+    for obj in samples:
+        before = dict_backed_sizeof(obj)
+        after = sys.getsizeof(obj)
+        n = counts[obj.__class__]
+        tot_before += before * n
+        tot_after += after * n
+        print >> out, '%-10s %10u %12u %12u' % (obj.__class__.__name__, n, before, after)
+    print >> out, 'total object overhead: %.1fMB with __dict__, %.1fMB with __slots__' % \
+        (tot_before / 1e6, tot_after / 1e6)
+
+def bench_interning(num_links=10000, hops_per_flow=8, num_switches=100, out=sys.stdout):
+    """Compares decoding a LinksAdd and a FlowsAdd (which makes a new Node for
+    every reference) with also interning their nodes as a TopologyStore
+    does, and the memory held by the decoded elements each way (including
+    the intern table's entries)."""
+    from OFGMessage import NODE_TABLE
+    from OFGTopology import intern_flow, intern_link
+
+    nodes = [Node(Node.TYPE_OPENFLOW_SWITCH, i) for i in xrange(num_links + 1)]
+    links = [LinkSpec(Link.TYPE_WIRE, nodes[i], 1, nodes[i+1], 2, 1000) for i in xrange(num_links)]
+    flows = [Flow(Flow.TYPE_UNKNOWN, i, nodes[0], 0, nodes[1], 1,
+                  [FlowHop(1, nodes[(i + j) % num_switches], 2) for j in xrange(hops_per_flow)])
+             for i in xrange(num_links / hops_per_flow)]
+    tests = [('LinksAdd', LinksAdd(links), lambda m: m.links, intern_link),
+             ('FlowsAdd', FlowsAdd(flows), lambda m: m.flows, intern_flow)]
+
+    print >> out, '%-10s %8s %12s %12s %10s %10s' % ('type', 'elements', 'decode (ms)', '+intern (ms)',
+                                                     'B/elem', 'interned')
+    for name, msg, elems, intern in tests:
+        buf = msg.pack()
+        unpack = msg.__class__.unpack
+        NODE_TABLE.nodes.clear()
+        interned = [intern(e) for e in elems(unpack(buf))]  # a long-lived store's table is warm
+        t_decode = min(Timer(lambda: unpack(buf)).repeat(3, 1))
+        t_intern = min(Timer(lambda: [intern(e) for e in elems(unpack(buf))]).repeat(3, 1))
+        n = len(interned)
+        plain_bytes = deep_sizeof(elems(unpack(buf)))
+        interned_bytes = deep_sizeof((interned, NODE_TABLE.nodes))
+        print >> out, '%-10s %8u %12.2f %12.2f %10.1f %10.1f' % (name, n, t_decode * 1e3, t_intern * 1e3,
+                                                                float(plain_bytes) / n, float(interned_bytes) / n)
+    NODE_TABLE.nodes.clear()
+
+def legacy_array_to_octstr(arr):
+    """The original per-byte += implementation of array_to_octstr."""
+    bstr = ''
+    for byte in arr:
+        if bstr != '':
+            bstr += ':%02x' % (byte,)
+        else:
+            bstr += '%02x' %(byte,)
+    return bstr
+
+def legacy_dpidstr(ll):
+    """The original implementation of dpidstr."""
+    return legacy_array_to_octstr(array.array('B', struct.pack('!Q', ll))).replace('00:', '')
+
+def legacy_str_to_dpid(s):
+    """A straightforward port of DPIDUtil.hexToDPID() from the GUI."""
+    ret = 0
+    shift = 0
+    for term in reversed(s.split(':')):
+        ret += int(term, 16) << shift
+        shift += 8
+    return ret
+
+def bench_dpid_strings(number=100000, out=sys.stdout):
+    """Compares the table-driven, cached DPID formatting and parsing against
+    the original implementations."""
+    dpid = 0x0000001122334455
+    arr = array.array('B', struct.pack('!Q', dpid))
+    s = dpidstr(dpid)
+    assert legacy_dpidstr(dpid) == s and array_to_octstr(arr) == legacy_array_to_octstr(arr)
+    assert str_to_dpid(s) == legacy_str_to_dpid(s) == dpid
+
+    many = range(DPIDSTR_CACHE_SIZE * 4)
+    many_dpidstr = lambda: [dpidstr(d) for d in many]
+    many_legacy = lambda: [legacy_dpidstr(d) for d in many]
+    tests = [('array_to_octstr', lambda: legacy_array_to_octstr(arr), lambda: array_to_octstr(arr), number),
+             ('dpidstr (hit)', lambda: legacy_dpidstr(dpid), lambda: dpidstr(dpid), number),
+             ('dpidstr (miss)', many_legacy, many_dpidstr, 1),
+             ('str_to_dpid', lambda: legacy_str_to_dpid(s), lambda: str_to_dpid(s), number)]
+
+    print >> out, '%-16s %12s %12s %8s' % ('function', 'legacy (us)', 'new (us)', 'speedup')
+    for name, legacy, new, n in tests:
+        calls = n if n > 1 else len(many)
+        t_legacy = min(Timer(legacy).repeat(3, n)) * 1e6 / calls
+        t_new = min(Timer(new).repeat(3, n)) * 1e6 / calls
+        print >> out, '%-16s %12.3f %12.3f %7.2fx' % (name, t_legacy, t_new, t_legacy / t_new)
+
+def bench_compression(num_elements=10000, out=sys.stdout):
+    """Reports the compression ratio and the time to compress and decompress
+    (see OFGProtocol.compress_frames()) snapshots of num_elements nodes,
+    links and 4-hop flows."""
+    nodes = [Node(Node.TYPE_OPENFLOW_SWITCH, 0x000000123400 + i) for i in xrange(num_elements + 4)]
+    links = make_linkspecs(num_elements)
+    flows = [Flow(Flow.TYPE_UNKNOWN, i, nodes[i], 0, nodes[i+4], 1,
+                  [FlowHop(1, nodes[i+j], 2) for j in xrange(4)]) for i in xrange(num_elements)]
+
+    print >> out, '%-10s %10s %10s %7s %14s %16s' % ('type', 'raw (B)', 'zlib (B)', 'ratio',
+                                                       'compress (ms)', 'decompress (ms)')
+    for ltm in (NodesAdd(nodes[:num_elements]), LinksAdd(links), FlowsAdd(flows)):
+        frames = OFG_PROTOCOL.pack_frames(ltm)
+        cframes = OFG_PROTOCOL.compress_frames(frames)
+        bodies = [b for f in cframes for _, b, _ in OFG_PROTOCOL.iter_frames(f)]
+        raw_len = sum([len(f) for f in frames])
+        z_len = sum([len(f) for f in cframes])
+        t_z = min(Timer(lambda: OFG_PROTOCOL.compress_frames(frames)).repeat(3, 1))
+        t_unz = min(Timer(lambda: [Compressed.unpack(b) for b in bodies]).repeat(3, 1))
+        print >> out, '%-10s %10u %10u %6.2fx %14.2f %16.2f' % (ltm.__class__.__name__, raw_len, z_len,
+                                                                 float(raw_len) / z_len, t_z * 1e3, t_unz * 1e3)
+
+def bench_batch(num_msgs=1000, out=sys.stdout):
+    """Compares sending a burst of num_msgs single-element updates as separate
+    frames against sending them in Batch frames."""
+    msgs = [LinksDel([Link(Link.TYPE_WIRE, Node(Node.TYPE_OPENFLOW_SWITCH, i), 1,
+                           Node(Node.TYPE_OPENFLOW_SWITCH, i + 1), 2)], i) for i in xrange(num_msgs)]
+    separate = lambda: [f for m in msgs for f in OFG_PROTOCOL.pack_frames(m)]
+    batched = lambda: OFG_PROTOCOL.pack_frames(Batch(msgs))
+
+    print >> out, '%-10s %8s %10s %10s' % ('framing', 'frames', 'bytes', 'pack (ms)')
+    for name, fn in (('separate', separate), ('batched', batched)):
+        frames = fn()
+        t = min(Timer(fn).repeat(3, 1))
+        print >> out, '%-10s %8u %10u %10.2f' % (name, len(frames), sum([len(f) for f in frames]), t * 1e3)
+
+class _NullTransport:
+    """A transport which discards what is written to it."""
+    def write(self, data):
+        pass
+
+    def writeSequence(self, seq):
+        pass
+
+def bench_fanout(num_clients=50, num_nodes=100000, out=sys.stdout):
+    """Compares packing a NodesAdd snapshot separately for each of
+    num_clients clients against OFGServer's encode-once fan-out."""
+    from OFGServer import OFGServer, OFGServerProtocol
+
+    server = OFGServer(OFG_PROTOCOL, None, verbose=False)
+    for _ in xrange(num_clients):
+        conn = OFGServerProtocol(False)
+        conn.transport = _NullTransport()
+        server.connections.append(conn)
+
+    ltm = NodesAdd([Node(Node.TYPE_OPENFLOW_SWITCH, i) for i in xrange(num_nodes)])
+    def per_client():
+        for conn in server.connections:
+            conn.transport.writeSequence(OFG_PROTOCOL.pack_frames(ltm))
+
+    t_each = min(Timer(per_client).repeat(3, 1))
+    t_once = min(Timer(lambda: server.send(ltm)).repeat(3, 1))
+    stats = server.fanout_stats()
+    print >> out, '%-16s %10s' % ('fan-out', 'send (ms)')
+    print >> out, '%-16s %10.1f' % ('pack per client', t_each * 1e3)
+    print >> out, '%-16s %10.1f' % ('encode once', t_once * 1e3)
+    print >> out, 'encode once: %(encodes)u encodes for %(writes)u writes' % stats
+
+def bench_metrics(number=1000, out=sys.stdout):
+    """Measures the cost per message of OFGServer's per type metrics when
+    sending small messages and receiving a buffer of them."""
+    from OFGServer import OFGServer, OFGServerProtocol
+
+    server = OFGServer(OFG_PROTOCOL, lambda conn, ltm: None, verbose=False)
+    conn = OFGServerProtocol(False)
+    conn.transport = _NullTransport()
+    conn.factory = server
+    server.connections.append(conn)
+    msg = PollStop(3, 4)
+    buf = OFG_PROTOCOL.pack_with_header(msg) * number
+
+    print >> out, '%-16s %10s %10s' % ('metrics', 'send (us)', 'recv (us)')
+    for name, enabled in (('off', False), ('on', True)):
+        server.metrics.enabled = enabled
+        t_send = time_per_call(lambda: server.send_msg_to_client(conn, msg), number)
+        t_recv = time_per_call(lambda: conn.dataReceived(buf), 1) / number
+        print >> out, '%-16s %10.3f %10.3f' % (name, t_send, t_recv)
+
+def bench_topology(num_links=100000, number=1000, out=sys.stdout):
+    """Compares answering a LinksRequest for one source node from a
+    TopologyStore against scanning every link."""
+    from OFGTopology import TopologyStore
+
+    links = make_linkspecs(num_links)
+    store = TopologyStore()
+    for ls in links:
+        store.add_node(ls.src_node)
+        store.add_node(ls.dst_node)
+        store.add_link(ls)
+
+    src = links[num_links / 2].src_node
+    req = LinksRequest(Request.TYPE_ONETIME, Request.ANY_TYPE, src)
+    scan = lambda: LinksAdd([l for l in links if l.src_node.node_type == src.node_type
+                                               and l.src_node.id == src.id], req.xid)
+    assert len(scan().links) == len(store.answer(req).links) == 1
+
+    t_scan = min(Timer(scan).repeat(3, 1)) * 1e6
+    t_index = min(Timer(lambda: store.answer(req)).repeat(3, number)) * 1e6 / number
+    print >> out, '%-22s %12s' % ('LinksRequest for 1 src', 'time (us)')
+    print >> out, '%-22s %12.1f' % ('scan %u links' % num_links, t_scan)
+    print >> out, '%-22s %12.1f' % ('TopologyStore', t_index)
+
+def bench_poll_scheduler(num_polls=10000, num_clients=100, seconds=60, out=sys.stdout):
+    """Measures OFGPoll.PollScheduler's overhead for num_polls polls (with
+    intervals of 0.5s to 10s) spread over num_clients clients, run for the
+    specified number of simulated seconds."""
+    from twisted.internet.task import Clock
+    from OFGPoll import PollScheduler
+
+    intervals = (5, 10, 20, 50, 100)
+    fired = [0]
+    def count(interval, polls):
+        fired[0] += len(polls)
+
+    clock = Clock()
+    sched = PollScheduler(count, clock=clock)
+    req = NodesRequest(Request.TYPE_ONETIME, Request.ANY_TYPE)
+    start = time.time()
+    for i in xrange(num_polls):
+        sched.add(i % num_clients, i, intervals[i % len(intervals)], req)
+    t_add = time.time() - start
+
+    ticks = int(seconds / PollScheduler.TICK)
+    start = time.time()
+    for _ in xrange(ticks):
+        clock.advance(PollScheduler.TICK)
+    t_run = time.time() - start
+
+    start = time.time()
+    for i in xrange(num_clients):
+        sched.remove_conn(i)
+    t_cancel = time.time() - start
+
+    per_10k = 10000.0 / num_polls
+    print >> out, '%u polls for %us: %u fired in %u groups' % (num_polls, seconds, fired[0],
+                                                              sched.groups_fired)
+    print >> out, '%-24s %10.2f' % ('add (ms per 10k polls)', t_add * 1e3 * per_10k)
+    print >> out, '%-24s %10.2f' % ('tick (us per 10k polls)', t_run * 1e6 / ticks * per_10k)
+    print >> out, '%-24s %10.3f' % ('fire (us per poll)', t_run * 1e6 / fired[0])
+    print >> out, '%-24s %10.2f' % ('cancel (ms per 10k)', t_cancel * 1e3 * per_10k)
+
+def bench_poll_phases(num_polls=10000, interval=10, out=sys.stdout):
+    """Compares the most polls fired on one tick when num_polls polls with the
+    same interval start together, with and without spreading them across
+    phases."""
+    from twisted.internet.task import Clock
+    from OFGPoll import PollScheduler
+
+    req = NodesRequest(Request.TYPE_ONETIME, Request.ANY_TYPE)
+    print >> out, '%-22s %10s' % ('%u polls' % num_polls, 'peak/tick')
+    for name, max_phases in (('one phase', 1), ('spread', 64)):
+        fired = {}
+        def count(period, polls):
+            fired[sched.now] = fired.get(sched.now, 0) + len(polls)
+
+        clock = Clock()
+        sched = PollScheduler(count, clock=clock, max_phases=max_phases)
+        for i in xrange(num_polls):
+            sched.add(i, i, interval, req)
+        for _ in xrange(interval * 2):
+            clock.advance(PollScheduler.TICK)
+        print >> out, '%-22s %10u' % (name, max(fired.values()))
+
+def bench_poll_cache(num_clients=30, num_nodes=10000, ticks=50, out=sys.stdout):
+    """Compares answering num_clients clients polling the same NodesRequest
+    every tick with and without OFGPoll.PollEngine's shared reply cache."""
+    from twisted.internet.task import Clock
+    from OFGPoll import PollEngine, PollScheduler
+    from OFGServer import OFGServer, OFGServerProtocol
+
+    nodes = [Node(Node.TYPE_OPENFLOW_SWITCH, i) for i in xrange(num_nodes)]
+    compute = lambda msg: NodesAdd(list(nodes), msg.xid)
+    server = OFGServer(OFG_PROTOCOL, None, verbose=False)
+    clock = Clock()
+    engine = PollEngine(server, compute, clock)
+    for i in xrange(num_clients):
+        conn = OFGServerProtocol(False)
+        conn.transport = _NullTransport()
+        engine.handle(conn, PollStart(1, NodesRequest(Request.TYPE_ONETIME, Request.ANY_TYPE, i), i))
+
+    def uncached():
+        for p in engine.scheduler.polls.itervalues():
+            server.send_msg_to_client(p.conn, compute(p.msg))
+
+    t_uncached = min(Timer(uncached).repeat(3, 1))
+    start = time.time()
+    for _ in xrange(ticks):
+        clock.advance(PollScheduler.TICK)
+    t_cached = (time.time() - start) / ticks
+    print >> out, '%-22s %10s' % ('%u pollers' % num_clients, 'tick (ms)')
+    print >> out, '%-22s %10.2f' % ('compute per poller', t_uncached * 1e3)
+    print >> out, '%-22s %10.2f' % ('shared reply cache', t_cached * 1e3)
+    print >> out, 'cache hit ratio: %.3f' % engine.stats()['cache_hit_ratio']
+
+def main(argv=sys.argv[1:]):
+    from optparse import OptionParser
+    usage = 'usage: OFGBench [options]'
+    parser = OptionParser(usage)
+    parser.add_option("-n", "--number",
+                      type="int", default=20000,
+                      help="number of calls to time per measurement [default: %default]")
+    parser.add_option("-s", "--sweep",
+                      action="store_true", default=False,
+                      help="only run the codec sweep over every message type and size")
+    parser.add_option("-o", "--output",
+                      default=None,
+                      help="write the codec sweep's results to this JSON file (implies -s)")
+    parser.add_option("-c", "--compare",
+                      default=None,
+                      help="compare the codec sweep's results with this JSON file (implies -s)")
+    parser.add_option("-t", "--threshold",
+                      type="float", default=0.10,
+                      help="fractional change reported by --compare [default: %default]")
+
+    (options, args) = parser.parse_args(argv)
+    if len(args) > 0:
+        parser.error("too many arguments")
+
+    if options.sweep or options.output or options.compare:
+        results = bench_codec_sweep()
+        if options.output:
+            write_results(options.output, results)
+        if options.compare:
+            print
+            if compare_results(options.compare, results, options.threshold):
+                sys.exit(1)
+        return
+
+    bench_fixed_headers(options.number)
+    print
+    bench_codecs(options.number)
+    print
+    bench_list_scaling()
+    print
+    bench_memory()
+    print
+    bench_interning()
+    print
+    bench_columns()
+    print
+    bench_dpid_strings(options.number)
+    print
+    bench_compression()
+    print
+    bench_batch()
+    print
+    bench_fanout()
+    print
+    bench_metrics()
+    print
+    bench_topology()
+    print
+    bench_poll_scheduler()
+    print
+    bench_poll_phases()
+    print
+    bench_poll_cache()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Round-trip time measurement for OFG connections.
+
+EchoMonitor sends each of a server's clients an EchoRequest every interval
+seconds and matches the EchoReplies by xid.  Echoes are written straight to
+the client's transport, bypassing its backlog and coalescing queue, so their
+round-trip times measure the network (and the GUI) rather than how far
+behind the backend is.  How late the monitor's own timer fires is recorded
+separately (loop_lag): if clients' RTTs are low while the loop lags, the
+backend is the slow part.  Clients which leave max_missed echoes in a row
+unanswered are disconnected.
+"""
+
+import math
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+from OFGMessage import EchoReply, EchoRequest
+
+class LatencyHistogram(object):
+    """A histogram of latencies with logarithmic buckets: each power of two
+    microseconds is split into SUB_BUCKETS linear buckets, so a latency is
+    recorded to within 1/SUB_BUCKETS of its magnitude in a small, fixed
+    number of buckets (like a low precision HdrHistogram)."""
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+    SUB_BUCKETS = 8
+    NUM_BUCKETS = 40 * SUB_BUCKETS  # covers up to 2**39us (about six days)
+
+    def __init__(self):
+        self.counts = [0] * LatencyHistogram.NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def bucket(seconds):
+        """Returns the index of the bucket a latency belongs in."""
+        us = seconds * 1e6
+        if us < 1:
+            return 0
+        m, e = math.frexp(us)  # us = m * 2**e where 0.5 <= m < 1
+        i = e * LatencyHistogram.SUB_BUCKETS + int((2 * m - 1) * LatencyHistogram.SUB_BUCKETS)
+        return min(i, LatencyHistogram.NUM_BUCKETS - 1)
+
+    @staticmethod
+    def bucket_limit(i):
+        """Returns the upper bound (in seconds) of the latencies in bucket i."""
+        if i == 0:
+            return 1e-6  # everything under 1us
+        e, sub = divmod(i, LatencyHistogram.SUB_BUCKETS)
+        return math.ldexp(1 + float(sub + 1) / LatencyHistogram.SUB_BUCKETS, e - 1) / 1e6
+
+    def record(self, seconds):
+        self.counts[LatencyHistogram.bucket(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Returns (an upper bound on) the latency p percent of those recorded
+        are no more than, or None if none have been recorded."""
+        if not self.count:
+            return None
+        want = max(1, int(math.ceil(self.count * p / 100.0)))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= want:
+                return min(self.max, LatencyHistogram.bucket_limit(i))
+        return self.max
+
+    def buckets(self):
+        """Returns a list of (upper bound in seconds, count) for each non-empty
+        bucket."""
+        return [(LatencyHistogram.bucket_limit(i), n) for i, n in enumerate(self.counts) if n]
+
+    def summary(self):
+        """Returns a dictionary with the number of latencies recorded and
+        their min, mean, median, 90th and 99th percentiles and max (in
+        seconds)."""
+        return {'count' : self.count,
+                'min' : self.min,
+                'mean' : (self.total / self.count) if self.count else None,
+                'p50' : self.percentile(50),
+                'p90' : self.percentile(90),
+                'p99' : self.percentile(99),
+                'max' : self.max}
+
+class EchoMonitor:
+    """Measures the round-trip time to each of server's clients every
+    interval seconds (see the module documentation).  Each client
+    connection's RTTs are recorded in its rtt histogram and its unanswered
+    echoes in its echoes dictionary (xid -> when sent).  EchoRequests from
+    clients are answered too.
+    """
+    def __init__(self, server, interval, max_missed=3, clock=reactor):
+        self.server = server
+        self.interval = interval
+        self.max_missed = max_missed
+        self.clock = clock
+        self.next_xid = 1
+        self.loop_lag = LatencyHistogram()
+        self.echoes_sent = 0
+        self.replies = 0
+        self.late_replies = 0  # replies to echoes already counted as missed
+        self.reaped = 0
+
+        self.call = LoopingCall(self.run)
+        self.call.clock = clock
+        self.due = clock.seconds() + interval  # when the next round should run
+        self.call.start(interval, now=False)
+
+    def stop(self):
+        if self.call.running:
+            self.call.stop()
+
+    def wrap(self, recv_callback):
+        """Returns a receive callback which handles echo messages and passes
+        everything else on to recv_callback."""
+        def recv(conn, ltm):
+            if not self.handle(conn, ltm):
+                recv_callback(conn, ltm)
+        return recv
+
+    def handle(self, conn, ltm):
+        """Handles ltm if it is an EchoRequest or EchoReply.  Returns False
+        for other messages."""
+        if ltm is None:
+            return False
+        t = ltm.get_type()
+        if t == EchoReply.get_type():
+            sent = conn.echoes.pop(ltm.xid, None)
+            if sent is None:
+                self.late_replies += 1
+                return True
+            self.replies += 1
+            conn.rtt.record(self.clock.seconds() - sent)
+
+            # an older echo still unanswered was lost (or overtaken)
+            for xid in [x for x in conn.echoes if x < ltm.xid]:
+                del conn.echoes[xid]
+        elif t == EchoRequest.get_type():
+            self.server.send_msg_to_client(conn, EchoReply(ltm.xid))
+        else:
+            return False
+        return True
+
+    def run(self):
+        """Reaps clients which missed too many echoes and sends the rest a
+        new one."""
+        now = self.clock.seconds()
+        self.loop_lag.record(max(0.0, now - self.due))
+        self.due = now + self.interval
+
+        for conn in list(self.server.connections):
+            if self.max_missed is not None and len(conn.echoes) >= self.max_missed:
+                self.reap(conn)
+                continue
+            xid = self.next_xid
+            self.next_xid = (self.next_xid + 1) & 0xFFFFFFFF or 1
+            conn.echoes[xid] = now
+            pm = self.server.pack(EchoRequest(xid))
+            conn.transport.writeSequence(pm.frames)
+            self.echoes_sent += 1
+            metrics = getattr(self.server, 'metrics', None)
+            if metrics is not None and metrics.enabled:
+                metrics.wrote(pm.length)
+
+    def reap(self, conn):
+        """Disconnects conn, which stopped answering echoes."""
+        self.reaped += 1
+        conn.echoes.clear()
+        abort = getattr(conn.transport, 'abortConnection', conn.transport.loseConnection)
+        abort()
+
+    def stats(self):
+        """Returns a dictionary with the echo counters, the monitor's loop lag
+        and, for each client (keyed by its peer address), a summary of its
+        RTTs and its number of unanswered echoes."""
+        clients = {}
+        for conn in self.server.connections:
+            rtt = conn.rtt.summary()
+            rtt['unanswered'] = len(conn.echoes)
+            clients[str(conn)] = rtt
+        return {'echoes_sent' : self.echoes_sent,
+                'replies' : self.replies,
+                'late_replies' : self.late_replies,
+                'reaped' : self.reaped,
+                'loop_lag' : self.loop_lag.summary(),
+                'clients' : clients}
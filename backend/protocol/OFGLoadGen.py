@@ -0,0 +1,465 @@
+"""Load generator for OFG servers.
+
+LoadGenerator opens many simulated GUI connections to an OFG server (e.g.
+the test server: OFGMessage.py -a -e 1) and drives them like real GUIs.
+Each client authenticates (answering the server's AuthRequest with an
+AuthReply salted as the server expects), then sends one-time
+NodesRequests, LinksRequests and FlowsRequests and EchoRequests at the
+configured rates, and keeps some polls running.  It answers the server's
+own EchoRequests, so it is not reaped.
+
+The time taken to connect, to authenticate and to answer each kind of
+request are recorded in LatencyHistograms, along with the gaps between
+replies to each poll and the throughput in messages and bytes.  Rates are
+per client; the generator spreads the total evenly over its ready clients
+on every tick.  How late its own ticks fire is recorded too (loop_lag): if
+that is high, the generator rather than the server is the bottleneck, and
+the load should be split across several processes.
+
+Thousands of connections need as many file descriptors, in the generator
+and in the server; main() raises its own soft limit as far as it may.
+"""
+
+import json
+import sys
+import time
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+from OFGEcho import LatencyHistogram
+from OFGMessage import OFG_DEFAULT_PORT, OFG_PROTOCOL, AuthReply, AuthRequest, AuthStatus, \
+                       EchoReply, EchoRequest, FlowsRequest, LinksRequest, Node, NodesRequest, \
+                       PollInterval, PollStart, PollStop, Request, sha1
+from OFGServer import OFGClient, OFGClientProtocol
+
+# the kinds of request each client sends, in turn
+REQUEST_KINDS = ('nodes', 'links', 'flows')
+
+ANY_NODE = Node(Request.ANY_TYPE, 0)
+
+def make_request(kind, request_type, xid):
+    """Returns a request for all nodes, links or flows (kind)."""
+    if kind == 'nodes':
+        return NodesRequest(request_type, Request.ANY_TYPE, xid)
+    elif kind == 'links':
+        return LinksRequest(request_type, Request.ANY_TYPE, ANY_NODE, xid)
+    return FlowsRequest(request_type, Request.ANY_TYPE, xid)
+
+COUNTERS = ('connects', 'connect_failures', 'auth_ok', 'auth_failed', 'lost',
+            'msgs_out', 'bytes_out', 'msgs_in', 'bytes_in', 'requests', 'replies', 'timeouts',
+            'echoes', 'echo_replies', 'server_echoes', 'polls_started', 'poll_replies',
+            'poll_intervals', 'unmatched')
+
+class LoadStats:
+    """Counters and latency histograms shared by all of a generator's
+    clients, both since the start and since the last interval() call."""
+    def __init__(self):
+        self.started = time.time()
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.latency = {}  # name -> LatencyHistogram
+        self.interval_started = self.started
+        self.interval_counts = dict.fromkeys(COUNTERS, 0)
+        self.interval_latency = {}
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+        self.interval_counts[name] += n
+
+    def record(self, name, seconds):
+        for hists in (self.latency, self.interval_latency):
+            h = hists.get(name)
+            if h is None:
+                h = hists[name] = LatencyHistogram()
+            h.record(seconds)
+
+    @staticmethod
+    def summarize(since, counts, latency):
+        secs = max(1e-9, time.time() - since)
+        return {'seconds' : secs,
+                'counts' : dict(counts),
+                'rates' : dict([(k, v / secs) for k, v in counts.iteritems()]),
+                'latency' : dict([(k, h.summary()) for k, h in latency.iteritems()])}
+
+    def snapshot(self):
+        """Returns a dictionary with the counters, the rate of each (per
+        second) and a summary of each latency since the start."""
+        return LoadStats.summarize(self.started, self.counts, self.latency)
+
+    def interval(self):
+        """Returns a snapshot of the stats since the previous call (or the
+        start) and starts a new interval."""
+        snap = LoadStats.summarize(self.interval_started, self.interval_counts, self.interval_latency)
+        self.interval_started = time.time()
+        self.interval_counts = dict.fromkeys(COUNTERS, 0)
+        self.interval_latency = {}
+        return snap
+
+class LoadClientProtocol(OFGClientProtocol):
+    """A client connection which counts the bytes it receives."""
+    def dataReceived(self, data):
+        self.factory.stats.count('bytes_in', len(data))
+        OFGClientProtocol.dataReceived(self, data)
+
+class LoadClient(OFGClient):
+    """One simulated GUI (see the module documentation).  ready is True once
+    it has authenticated (or connected, if auth is None)."""
+    protocol = LoadClientProtocol
+
+    def __init__(self, gen, auth=None):
+        OFGClient.__init__(self, OFG_PROTOCOL, self.recv, self.connected, self.lost, verbose=False)
+        self.gen = gen
+        self.stats = gen.stats
+        self.auth = auth  # (username, password), if the server asks clients to authenticate
+        self.conn = None
+        self.ready = False
+        self.connect_started = None
+        self.auth_sent = None  # when the AuthReply was sent
+        self.next_xid = 1
+        self.pending = {}  # xid -> (kind, when sent) of each unanswered request
+        self.polls = {}  # polled request's xid -> when its last reply arrived (None until the first)
+        self.poll_starts = {}  # polled request's xid -> xid of the PollStart (for PollStop)
+        self.next_kind = 0
+
+    def xid(self):
+        xid = self.next_xid
+        self.next_xid = (self.next_xid + 1) & 0xFFFFFFFF or 1
+        return xid
+
+    def connect(self, ip, port):
+        self.connect_started = time.time()
+        OFGClient.connect(self, ip, port)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.stopTrying()
+        self.stats.count('connect_failures')
+        OFGClient.clientConnectionFailed(self, connector, reason)
+
+    def connected(self, conn):
+        self.stopTrying()  # a lost connection is counted, not retried
+        self.conn = conn
+        self.stats.count('connects')
+        self.stats.record('connect', time.time() - self.connect_started)
+        if self.auth is None:
+            self.set_ready()
+
+    def lost(self, conn):
+        self.conn = None
+        if self.ready:
+            self.ready = False
+            self.gen.client_lost(self)
+        if not self.gen.stopping:
+            self.stats.count('lost')
+
+    def send(self, ltm):
+        data = OFG_PROTOCOL.pack_with_header(ltm)
+        self.stats.count('msgs_out')
+        self.stats.count('bytes_out', len(data))
+        self.conn.transport.write(data)
+
+    def set_ready(self):
+        self.ready = True
+        self.gen.client_ready(self)
+        for i in xrange(self.gen.polls_per_client):
+            self.start_poll(REQUEST_KINDS[i % len(REQUEST_KINDS)])
+
+    def send_request(self):
+        kind = REQUEST_KINDS[self.next_kind]
+        self.next_kind = (self.next_kind + 1) % len(REQUEST_KINDS)
+        xid = self.xid()
+        self.pending[xid] = (kind, time.time())
+        self.stats.count('requests')
+        self.send(make_request(kind, Request.TYPE_ONETIME, xid))
+
+    def send_echo(self):
+        xid = self.xid()
+        self.pending[xid] = ('echo', time.time())
+        self.stats.count('echoes')
+        self.send(EchoRequest(xid))
+
+    def start_poll(self, kind):
+        """Polls for kind every poll_interval; replies carry the polled
+        request's xid, and a PollStop names the PollStart's."""
+        xid = self.xid()
+        start_xid = self.xid()
+        self.polls[xid] = None
+        self.poll_starts[xid] = start_xid
+        self.stats.count('polls_started')
+        interval = max(1, int(round(self.gen.poll_interval * 10)))
+        self.send(PollStart(interval, make_request(kind, Request.TYPE_ONETIME, xid), start_xid))
+
+    def stop_polls(self):
+        for start_xid in self.poll_starts.itervalues():
+            self.send(PollStop(start_xid))
+        self.polls.clear()
+        self.poll_starts.clear()
+
+    def expire(self, now, timeout):
+        """Forgets (and counts) requests unanswered for timeout seconds."""
+        for xid, (kind, sent) in self.pending.items():
+            if now - sent > timeout:
+                del self.pending[xid]
+                self.stats.count('timeouts')
+
+    def recv(self, conn, ltm):
+        stats = self.stats
+        stats.count('msgs_in')
+        if ltm is None:
+            stats.count('unmatched')
+            return
+        now = time.time()
+        t = ltm.get_type()
+        xid = ltm.xid
+        if t == EchoRequest.get_type():
+            # the server numbers its echoes itself, so check for them first
+            stats.count('server_echoes')
+            self.send(EchoReply(xid))
+        elif xid in self.pending:
+            kind, sent = self.pending.pop(xid)
+            stats.record(kind, now - sent)
+            stats.count('echo_replies' if kind == 'echo' else 'replies')
+        elif xid in self.polls:
+            if self.polls[xid] is not None:
+                stats.record('poll_gap', now - self.polls[xid])
+            self.polls[xid] = now
+            stats.count('poll_replies')
+        elif t == PollInterval.get_type():
+            stats.count('poll_intervals')
+        elif t == AuthRequest.get_type() and self.auth is not None:
+            username, pw = self.auth
+            self.auth_sent = now
+            self.send(AuthReply(username, sha1(sha1(pw) + ltm.salt), xid))
+        elif t == AuthStatus.get_type() and self.auth_sent is not None and not self.ready:
+            stats.record('auth', now - self.auth_sent)
+            if ltm.auth_ok:
+                stats.count('auth_ok')
+                self.set_ready()
+            else:
+                stats.count('auth_failed')
+                conn.transport.loseConnection()
+        else:
+            stats.count('unmatched')  # e.g. the flows the test server sends with nodes
+
+class LoadGenerator:
+    """Connects num_clients LoadClients to ip:port, connect_rate per second,
+    and drives their traffic (see the module documentation).  Rates are per
+    client per second."""
+    TICK = 0.01  # seconds between sends
+    REPORT_HEADER = '%6s %6s %6s %9s %9s %9s %7s %7s %7s %7s %7s' % (
+        'conns', 'ready', 'failed', 'msgs out/s', 'msgs in/s', 'KB in/s',
+        'nodes50', 'nodes99', 'echo50', 'echo99', 'lag p99')
+
+    def __init__(self, ip, port, num_clients, connect_rate=100.0, auth=('dgu', 'envi'),
+                 request_rate=1.0, echo_rate=1.0, polls_per_client=1, poll_interval=1.0,
+                 timeout=10.0):
+        self.ip = ip
+        self.port = port
+        self.num_clients = num_clients
+        self.connect_rate = connect_rate
+        self.auth = auth
+        self.rates = {'request' : request_rate, 'echo' : echo_rate}
+        self.polls_per_client = polls_per_client
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+        self.stats = LoadStats()
+        self.clients = []
+        self.ready = []  # clients which may send requests
+        self.credit = dict.fromkeys(self.rates, 0.0)  # sends owed to each kind
+        self.next_client = 0  # round-robin position in ready
+        self.stopping = False
+        self.started = None
+        self.last_tick = None
+        self.due = None  # when the next tick should run
+        self.ticker = LoopingCall(self.tick)
+        self.connector = LoopingCall(self.connect_some)
+
+    def start(self):
+        self.started = self.last_tick = self.due = time.time()
+        self.connector.start(LoadGenerator.TICK)
+        self.ticker.start(LoadGenerator.TICK)
+
+    def connect_some(self):
+        """Connects the clients due by now (given the connect rate)."""
+        elapsed = time.time() - self.started
+        want = self.num_clients if not self.connect_rate else int(elapsed * self.connect_rate) + 1
+        while len(self.clients) < min(want, self.num_clients):
+            c = LoadClient(self, self.auth)
+            self.clients.append(c)
+            c.connect(self.ip, self.port)
+        if len(self.clients) >= self.num_clients:
+            self.connector.stop()
+
+    def client_ready(self, client):
+        self.ready.append(client)
+
+    def client_lost(self, client):
+        self.ready.remove(client)
+
+    def tick(self):
+        now = time.time()
+        self.stats.record('loop_lag', max(0.0, now - self.due))
+        self.due = now + LoadGenerator.TICK
+        dt = now - self.last_tick
+        self.last_tick = now
+        if not self.ready:
+            return
+
+        for kind, rate in self.rates.iteritems():
+            self.credit[kind] += rate * len(self.ready) * dt
+            n = int(self.credit[kind])
+            self.credit[kind] -= n
+            for _ in xrange(n):
+                self.next_client = (self.next_client + 1) % len(self.ready)
+                client = self.ready[self.next_client]
+                if kind == 'request':
+                    client.send_request()
+                else:
+                    client.send_echo()
+
+    def expire(self):
+        now = time.time()
+        for c in self.ready:
+            c.expire(now, self.timeout)
+
+    def stop(self):
+        """Stops sending and closes every connection."""
+        self.stopping = True
+        for call in (self.ticker, self.connector):
+            if call.running:
+                call.stop()
+        for c in self.clients:
+            c.stopTrying()
+            if c.conn is not None:
+                c.stop_polls()
+                c.conn.transport.loseConnection()
+
+    def report(self, out=sys.stdout):
+        """Prints one line with the number of clients and the throughput and
+        latencies since the previous report."""
+        self.expire()
+        snap = self.stats.interval()
+        rates = snap['rates']
+        lat = snap['latency']
+        def ms(name, key):
+            s = lat.get(name)
+            return '%7.1f' % (s[key] * 1000) if s and s[key] is not None else '%7s' % '-'
+        connected = len([c for c in self.clients if c.conn is not None])
+        print >> out, '%6u %6u %6u %9.0f %9.0f %9.1f %s %s %s %s %s' % (
+            connected, len(self.ready), snap['counts']['lost'] + snap['counts']['connect_failures'],
+            rates['msgs_out'], rates['msgs_in'], rates['bytes_in'] / 1024,
+            ms('nodes', 'p50'), ms('nodes', 'p99'), ms('echo', 'p50'), ms('echo', 'p99'),
+            ms('loop_lag', 'p99'))
+
+def print_summary(snap, out=sys.stdout):
+    """Prints the counters, rates and latencies (in ms) of a stats snapshot."""
+    print >> out, 'over %.1f seconds:' % snap['seconds']
+    for name in sorted(snap['counts']):
+        print >> out, '  %-16s %12u %12.1f/s' % (name, snap['counts'][name], snap['rates'][name])
+    print >> out, '%-18s %8s %9s %9s %9s %9s %9s %9s' % ('latency (ms)', 'count', 'min', 'mean',
+                                                        'p50', 'p90', 'p99', 'max')
+    for name, s in sorted(snap['latency'].items()):
+        vals = ['%9.3f' % (s[k] * 1000) for k in ('min', 'mean', 'p50', 'p90', 'p99', 'max')]
+        print >> out, '  %-16s %8u %s' % (name, s['count'], ' '.join(vals))
+
+def raise_fd_limit(want):
+    """Raises the soft limit on open files towards want (up to the hard
+    limit) and returns the new limit."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < want:
+        soft = want if hard == resource.RLIM_INFINITY else min(want, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    return soft
+
+def main(argv=sys.argv[1:]):
+    from optparse import OptionParser
+    usage = 'usage: OFGLoadGen.py [options]'
+    parser = OptionParser(usage)
+    parser.add_option("-a", "--address",
+                      default='127.0.0.1',
+                      help="address of the server [default: %default]")
+    parser.add_option("-p", "--port",
+                      type="int", default=OFG_DEFAULT_PORT,
+                      help="port the server listens on [default: %default]")
+    parser.add_option("-n", "--num-clients",
+                      type="int", default=100,
+                      help="number of simulated clients [default: %default]")
+    parser.add_option("-c", "--connect-rate",
+                      type="float", default=100.0,
+                      help="clients to connect per second (0 for all at once) [default: %default]")
+    parser.add_option("-d", "--duration",
+                      type="float", default=30.0,
+                      help="seconds to run for [default: %default]")
+    parser.add_option("-r", "--request-rate",
+                      type="float", default=1.0,
+                      help="one-time requests per client per second [default: %default]")
+    parser.add_option("-e", "--echo-rate",
+                      type="float", default=1.0,
+                      help="EchoRequests per client per second [default: %default]")
+    parser.add_option("-P", "--polls",
+                      type="int", default=1,
+                      help="polls to keep running per client [default: %default]")
+    parser.add_option("-I", "--poll-interval",
+                      type="float", default=1.0,
+                      help="seconds between replies to each poll [default: %default]")
+    parser.add_option("-u", "--user",
+                      default='dgu',
+                      help="username to authenticate as [default: %default]")
+    parser.add_option("-w", "--password",
+                      default='envi',
+                      help="password to authenticate with [default: %default]")
+    parser.add_option("-N", "--no-auth",
+                      action="store_true", default=False,
+                      help="do not wait for the server to ask clients to authenticate")
+    parser.add_option("-t", "--timeout",
+                      type="float", default=10.0,
+                      help="seconds after which an unanswered request is counted as timed out [default: %default]")
+    parser.add_option("-i", "--report-interval",
+                      type="float", default=1.0,
+                      help="seconds between progress lines [default: %default]")
+    parser.add_option("-o", "--output",
+                      default=None,
+                      help="write the final stats to this JSON file")
+
+    (options, args) = parser.parse_args(argv)
+    if len(args) > 0:
+        parser.error("too many arguments")
+
+    limit = raise_fd_limit(options.num_clients + 64)
+    if limit is not None and limit < options.num_clients + 16:
+        print >> sys.stderr, 'warning: only %u file descriptors may be open' % limit
+
+    gen = LoadGenerator(options.address, options.port, options.num_clients,
+                        connect_rate=options.connect_rate,
+                        auth=None if options.no_auth else (options.user, options.password),
+                        request_rate=options.request_rate,
+                        echo_rate=options.echo_rate,
+                        polls_per_client=options.polls,
+                        poll_interval=options.poll_interval,
+                        timeout=options.timeout)
+
+    def finish():
+        gen.stop()
+        snap = gen.stats.snapshot()
+        print
+        print_summary(snap)
+        if options.output:
+            f = open(options.output, 'w')
+            try:
+                json.dump(snap, f, indent=1, sort_keys=True)
+            finally:
+                f.close()
+        reactor.callLater(0.5, reactor.stop)  # let the PollStops and closes go out
+
+    print LoadGenerator.REPORT_HEADER
+    LoopingCall(gen.report).start(options.report_interval, now=False)
+    reactor.callLater(options.duration, finish)
+    gen.start()
+    reactor.run()
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,95 @@
 """Defines the OpenFlow GUI protocol and some associated helper functions."""
 
-import array
 import hashlib
+import logging
 import struct
 import sys
+import zlib
 from os import urandom
 
 from twisted.internet import reactor
 
-from ltprotocol.ltprotocol import LTMessage, LTProtocol
+from ltprotocol.ltprotocol import LTProtocol
 
 OFG_DEFAULT_PORT = 2503
 
+# logger for OFG message traffic: DEBUG logs full messages, INFO summaries
+OFG_LOG = logging.getLogger('ofg')
+
+# two-digit lowercase hex string for each byte value
+_HEX_OCTETS = tuple(['%02x' % b for b in xrange(256)])
+_DPID_SHIFTS = (56, 48, 40, 32, 24, 16, 8, 0)
+
 def array_to_octstr(arr):
-    bstr = ''
-    for byte in arr:
-        if bstr != '':
-            bstr += ':%02x' % (byte,)
-        else:
-            bstr += '%02x' %(byte,)
-    return bstr
+    return ':'.join([_HEX_OCTETS[byte] for byte in arr])
+
+# recently formatted DPID strings; this approximates an LRU cache with two
+# dicts: hits in the older generation are promoted, and when the recent
+# generation fills up it becomes the older one (dropping the previous older)
+DPIDSTR_CACHE_SIZE = 4096
+_dpidstr_recent = {}
+_dpidstr_older = {}
+
+def _format_dpid(ll):
+    return ':'.join([_HEX_OCTETS[(ll >> shift) & 0xFF] for shift in _DPID_SHIFTS]).replace('00:', '')
 
 def dpidstr(ll):
-    return array_to_octstr(array.array('B',struct.pack('!Q',ll))).replace('00:', '')
+    """Returns the colon-separated hex string of a DPID with all '00:' octets
+    removed (like DPIDUtil.toShortString() in the GUI)."""
+    global _dpidstr_recent, _dpidstr_older
+    s = _dpidstr_recent.get(ll)
+    if s is None:
+        s = _dpidstr_older.get(ll)
+        if s is None:
+            s = _format_dpid(ll)
+        if len(_dpidstr_recent) >= DPIDSTR_CACHE_SIZE:
+            _dpidstr_older = _dpidstr_recent
+            _dpidstr_recent = {}
+        _dpidstr_recent[ll] = s
+    return s
+
+def str_to_dpid(s):
+    """Parses a colon-separated hex DPID string (like DPIDUtil.hexToDPID() in
+    the GUI).  This inverts dpidstr() when the only zero octets in the DPID
+    are leading ones."""
+    if len(s) % 3 == 2:
+        return long(s.replace(':', ''), 16)  # every octet has two digits
+    return long(''.join([t.rjust(2, '0') for t in s.split(':')]), 16)
 
 OFG_MESSAGES = []
 
-class OFGMessage(LTMessage):
+# Messages implement ltprotocol's LTMessage interface (get_type, pack, unpack)
+# without deriving from it: LTMessage is a classic class, and inheriting from it
+# would give every message a per-instance __dict__ in spite of __slots__.
+class OFGMessage(object):
+    __slots__ = ('xid',)
     SIZE = 4
+    FMT = struct.Struct('> I')
 
     def __init__(self, xid=0):
-        LTMessage.__init__(self)
         self.xid = xid
 
     def length(self):
         return self.SIZE
 
     def pack(self):
-        return struct.pack('> I', self.xid)
+        return OFGMessage.FMT.pack(self.xid)
 
     @staticmethod
     def unpack(body):
-        return OFGMessage(struct.unpack('> I', body[:4])[0])
+        return OFGMessage(OFGMessage.FMT.unpack_from(body)[0])
+
+    def summary(self):
+        """Returns a short description of this message (type and xid, plus
+        the number of elements for list messages) which is cheap to build."""
+        return '%s: xid=%u' % (self.__class__.__name__, self.xid)
 
     def __str__(self):
         return 'xid=%u' % self.xid
 
 class Disconnect(OFGMessage):
+    __slots__ = ()
+
     @staticmethod
     def get_type():
         return 0x00
@@ -54,11 +97,17 @@ class Disconnect(OFGMessage):
     def __init__(self, xid=0):
         OFGMessage.__init__(self, xid)
 
+    @staticmethod
+    def unpack(body):
+        return Disconnect(OFGMessage.FMT.unpack_from(body)[0])
+
     def __str__(self):
         return 'DISCONNECT: ' + OFGMessage.__str__(self)
 OFG_MESSAGES.append(Disconnect)
 
 class EchoRequest(OFGMessage):
+    __slots__ = ()
+
     @staticmethod
     def get_type():
         return 0x01
@@ -66,11 +115,17 @@ class EchoRequest(OFGMessage):
     def __init__(self, xid=0):
         OFGMessage.__init__(self, xid)
 
+    @staticmethod
+    def unpack(body):
+        return EchoRequest(OFGMessage.FMT.unpack_from(body)[0])
+
     def __str__(self):
         return 'ECHO_REQUEST: ' + OFGMessage.__str__(self)
 OFG_MESSAGES.append(EchoRequest)
 
 class EchoReply(OFGMessage):
+    __slots__ = ()
+
     @staticmethod
     def get_type():
         return 0x02
@@ -78,11 +133,17 @@ class EchoReply(OFGMessage):
     def __init__(self, xid=0):
         OFGMessage.__init__(self, xid)
 
+    @staticmethod
+    def unpack(body):
+        return EchoReply(OFGMessage.FMT.unpack_from(body)[0])
+
     def __str__(self):
         return 'ECHO_REPLY: ' + OFGMessage.__str__(self)
 OFG_MESSAGES.append(EchoReply)
 
 class AuthRequest(OFGMessage):
+    __slots__ = ('salt',)
+
     @staticmethod
     def get_type():
         return 0x03
@@ -99,8 +160,8 @@ class AuthRequest(OFGMessage):
 
     @staticmethod
     def unpack(body):
-        xid = struct.unpack('> I', body[:4])[0]
-        salt = body[4:]
+        xid = OFGMessage.FMT.unpack_from(body)[0]
+        salt = body[OFGMessage.SIZE:]
         return AuthRequest(salt, xid)
 
     def __str__(self):
@@ -108,6 +169,9 @@ class AuthRequest(OFGMessage):
 OFG_MESSAGES.append(AuthRequest)
 
 class AuthReply(OFGMessage):
+    __slots__ = ('username', 'ssp')
+    FMT = struct.Struct('> 2I')
+
     @staticmethod
     def get_type():
         return 0x04
@@ -118,17 +182,17 @@ class AuthReply(OFGMessage):
         self.ssp = salted_sha1_of_pw
 
     def length(self):
-        return OFGMessage.SIZE + len(self.username) + len(self.ssp)
+        return AuthReply.FMT.size + len(self.username) + len(self.ssp)
 
     def pack(self):
-        return OFGMessage.pack(self) + struct.pack('> I', len(self.username)) + self.username + self.ssp
+        return AuthReply.FMT.pack(self.xid, len(self.username)) + self.username + self.ssp
 
     @staticmethod
     def unpack(body):
-        xid, username_len = struct.unpack('> 2I', body[:8])
-        body = body[8:]
-        username = body[:username_len]
-        ssp = body[username_len:]
+        xid, username_len = AuthReply.FMT.unpack_from(body)
+        off = AuthReply.FMT.size
+        username = body[off:off+username_len]
+        ssp = body[off+username_len:]
         return AuthReply(username, ssp, xid)
 
     def __str__(self):
@@ -136,6 +200,9 @@ class AuthReply(OFGMessage):
 OFG_MESSAGES.append(AuthReply)
 
 class AuthStatus(OFGMessage):
+    __slots__ = ('auth_ok', 'msg')
+    FMT = struct.Struct('> IB')
+
     @staticmethod
     def get_type():
         return 0x05
@@ -149,55 +216,253 @@ class AuthStatus(OFGMessage):
         return OFGMessage.SIZE + 1 + len(self.msg)
 
     def pack(self):
-        return OFGMessage.pack(self) + struct.pack('> B', self.auth_ok) + self.msg
+        return AuthStatus.FMT.pack(self.xid, self.auth_ok) + self.msg
 
     @staticmethod
     def unpack(body):
-        xid, auth_ok = struct.unpack('> IB', body[:5])
-        msg = body[5:]
+        xid, auth_ok = AuthStatus.FMT.unpack_from(body)
+        msg = body[AuthStatus.FMT.size:]
         return AuthStatus(auth_ok, msg, xid)
 
     def __str__(self):
         return 'AUTH_STATUS: ' + OFGMessage.__str__(self) + ' auth_ok=%s msg=%s' % (str(self.auth_ok), self.msg)
 OFG_MESSAGES.append(AuthStatus)
 
+class Compressed(OFGMessage):
+    """An envelope holding the frames of one or more OFG messages compressed
+    together.  A client announces that it can decode these by sending one
+    (which may be empty) to the backend."""
+    __slots__ = ('codec', 'frames', 'zdata')
+    FMT = struct.Struct('> IB')
+
+    CODEC_ZLIB = 0
+    ZLIB_LEVEL = 6
+
+    @staticmethod
+    def get_type():
+        return 0x06
+
+    def __init__(self, frames='', codec=CODEC_ZLIB, xid=0, zdata=None):
+        """frames is the concatenated frames of the inner messages; zdata is
+        their compressed form (computed on demand if None)."""
+        OFGMessage.__init__(self, xid)
+        self.codec = codec
+        self.frames = frames
+        self.zdata = zdata
+
+    @staticmethod
+    def wrap(msgs, xid=0):
+        """Returns an envelope holding the specified messages."""
+        return Compressed(''.join([f for m in msgs for f in OFG_PROTOCOL.pack_frames(m)]), xid=xid)
+
+    def compressed(self):
+        if self.zdata is None:
+            self.zdata = zlib.compress(self.frames, Compressed.ZLIB_LEVEL)
+        return self.zdata
+
+    def messages(self):
+        """Returns a list of the messages in this envelope."""
+        msgs = [OFG_PROTOCOL.unpack_received_msg(t, b) for t, b, _ in OFG_PROTOCOL.iter_frames(self.frames)]
+        return [m for m in msgs if m is not None]
+
+    def length(self):
+        return Compressed.FMT.size + len(self.compressed())
+
+    def pack(self):
+        return Compressed.FMT.pack(self.xid, self.codec) + self.compressed()
+
+    @staticmethod
+    def unpack(body):
+        xid, codec = Compressed.FMT.unpack_from(body)
+        if codec != Compressed.CODEC_ZLIB:
+            raise ValueError('unknown compression codec %u' % codec)
+        zdata = body[Compressed.FMT.size:]
+        return Compressed(zlib.decompress(zdata), codec, xid, zdata)
+
+    def summary(self):
+        return OFGMessage.summary(self) + ' %uB in %uB' % (len(self.frames), len(self.compressed()))
+
+    def __str__(self):
+        fmt = 'COMPRESSED: ' + OFGMessage.__str__(self) + ' %uB compressed to %uB'
+        return fmt % (len(self.frames), len(self.compressed()))
+OFG_MESSAGES.append(Compressed)
+
+class Batch(OFGMessage):
+    """Carries a sequence of messages in one frame.  Each is framed within the
+    body exactly as PollStart frames its inner message (a length which
+    includes the 3-byte header, a type and the message body), so a burst of
+    small updates costs one outer frame and one write."""
+    __slots__ = ('msgs', 'frames')
+
+    @staticmethod
+    def get_type():
+        return 0x07
+
+    def __init__(self, msgs, xid=0):
+        OFGMessage.__init__(self, xid)
+        self.msgs = msgs
+        self.frames = None  # the frames holding each message (built on demand)
+
+    def inner_frames(self):
+        """Returns a list of the frames holding each message in this batch."""
+        if self.frames is None:
+            self.frames = [OFG_PROTOCOL.pack_frames(m) for m in self.msgs]
+        return self.frames
+
+    def messages(self):
+        return self.msgs
+
+    def length(self):
+        return OFGMessage.SIZE + sum([len(f) for fs in self.inner_frames() for f in fs])
+
+    def pack(self):
+        return OFGMessage.FMT.pack(self.xid) + ''.join([f for fs in self.inner_frames() for f in fs])
+
+    @staticmethod
+    def unpack(body):
+        xid = OFGMessage.FMT.unpack_from(body)[0]
+        msgs = []
+        end = OFGMessage.SIZE
+        for t, b, end in OFG_PROTOCOL.iter_frames(body, end):
+            m = OFG_PROTOCOL.unpack_received_msg(t, b)
+            if m is not None:
+                msgs.append(m)
+        if end != len(body):
+            raise ValueError('BATCH has %uB of trailing data' % (len(body) - end))
+        return Batch(msgs, xid)
+
+    def split(self, max_len):
+        """Returns a list of batches, each no more than max_len bytes long,
+        which together hold this batch's messages in order.  A message too
+        long to fit in a batch by itself is returned unbatched."""
+        ret = []
+        cur_msgs = []
+        cur_frames = []
+        cur_len = OFGMessage.SIZE
+        for m, fs in zip(self.msgs, self.inner_frames()):
+            n = sum([len(f) for f in fs])
+            if cur_msgs and cur_len + n > max_len:
+                ret.append(Batch._from_frames(cur_msgs, cur_frames, self.xid))
+                cur_msgs = []
+                cur_frames = []
+                cur_len = OFGMessage.SIZE
+            if OFGMessage.SIZE + n > max_len:
+                ret.append(m)
+            else:
+                cur_msgs.append(m)
+                cur_frames.append(fs)
+                cur_len += n
+        if cur_msgs:
+            ret.append(Batch._from_frames(cur_msgs, cur_frames, self.xid))
+        return ret
+
+    @staticmethod
+    def _from_frames(msgs, frames, xid):
+        b = Batch(msgs, xid)
+        b.frames = frames
+        return b
+
+    def summary(self):
+        return OFGMessage.summary(self) + ' msgs=%u' % len(self.msgs)
+
+    def __str__(self):
+        return 'BATCH: ' + OFGMessage.__str__(self) + ' ' + ', '.join([str(m) for m in self.msgs])
+OFG_MESSAGES.append(Batch)
+
 class PollStart(OFGMessage):
+    __slots__ = ('interval', 'lm', 'max_interval')
+
+    # xid, interval, and the length and type header of the inner message
+    FMT = struct.Struct('> IHHB')
+    INNER_HDR_SIZE = 3
+
+    # optional trailer: the longest interval the backend may stretch the poll to
+    MAX_INTERVAL_FMT = struct.Struct('> H')
+
     @staticmethod
     def get_type():
         return 0x0E
 
-    def __init__(self, interval_in_100ms_units, lm, xid=0):
+    def __init__(self, interval_in_100ms_units, lm, xid=0, max_interval=None):
         OFGMessage.__init__(self, xid)
         self.interval = interval_in_100ms_units
         self.lm = lm
+        self.max_interval = max_interval
 
     def length(self):
-        return OFGMessage.SIZE + 2 + self.lm.length()
+        n = PollStart.FMT.size + self.lm.length()
+        if self.max_interval is not None:
+            n += PollStart.MAX_INTERVAL_FMT.size
+        return n
 
     def pack(self):
-        return OFGMessage.pack(self) + struct.pack('> S', self.interval) + self.lm.pack()
+        inner = self.lm.pack()
+        inner_len = PollStart.INNER_HDR_SIZE + len(inner)
+        ret = PollStart.FMT.pack(self.xid, self.interval, inner_len, self.lm.get_type()) + inner
+        if self.max_interval is not None:
+            ret += PollStart.MAX_INTERVAL_FMT.pack(self.max_interval)
+        return ret
 
     @staticmethod
     def unpack(body):
-        xid = struct.unpack('> I', body[:4])[0]
-        body = body[4:]
-        interval = struct.unpack('> H', body[:2])[0]
-        body = body[2:]
+        xid, interval, inner_len, type_val = PollStart.FMT.unpack_from(body)
+        end = PollStart.FMT.size + inner_len - PollStart.INNER_HDR_SIZE
+        lm = OFG_PROTOCOL.unpack_received_msg(type_val, body[PollStart.FMT.size:end])
 
-        _ = struct.unpack('> H', body[:2])[0]  # inner message length
-        body = body[2:]
-        type_val = struct.unpack('> B', body[:1])[0]
-        body = body[1:]
-        lm = OFG_PROTOCOL.unpack_received_msg(type_val, body)
+        max_interval = None
+        if len(body) >= end + PollStart.MAX_INTERVAL_FMT.size:
+            max_interval = PollStart.MAX_INTERVAL_FMT.unpack_from(body, end)[0]
+        return PollStart(interval, lm, xid, max_interval)
 
-        return PollStart(interval, lm, xid)
+    def summary(self):
+        ret = OFGMessage.summary(self) + ' interval=%u' % self.interval
+        if self.max_interval is not None:
+            ret += ' max_interval=%u' % self.max_interval
+        return ret + ' msg={%s}' % self.lm.summary()
 
     def __str__(self):
         fmt = 'POLL_START: ' + OFGMessage.__str__(self) + ' interval=%.1fsec msg=%s'
-        return fmt % (self.interval * 10.0, str(self.lm))
+        return fmt % (self.interval / 10.0, str(self.lm))
 OFG_MESSAGES.append(PollStart)
 
+class PollInterval(OFGMessage):
+    """Tells a client the interval the backend is actually polling one of its
+    PollStarts at (e.g. because it stretched the poll while under load)."""
+    __slots__ = ('xid_polled', 'interval')
+    FMT = struct.Struct('> 2IH')
+
+    @staticmethod
+    def get_type():
+        return 0x0D
+
+    def __init__(self, xid_polled, interval_in_100ms_units, xid=0):
+        OFGMessage.__init__(self, xid)
+        self.xid_polled = xid_polled
+        self.interval = interval_in_100ms_units
+
+    def length(self):
+        return PollInterval.FMT.size
+
+    def pack(self):
+        return PollInterval.FMT.pack(self.xid, self.xid_polled, self.interval)
+
+    @staticmethod
+    def unpack(body):
+        xid, xid_polled, interval = PollInterval.FMT.unpack_from(body)
+        return PollInterval(xid_polled, interval, xid)
+
+    def summary(self):
+        return OFGMessage.summary(self) + ' xid_polled=%u interval=%u' % (self.xid_polled, self.interval)
+
+    def __str__(self):
+        fmt = 'POLL_INTERVAL: ' + OFGMessage.__str__(self) + ' xid_polled=%u interval=%.1fsec'
+        return fmt % (self.xid_polled, self.interval / 10.0)
+OFG_MESSAGES.append(PollInterval)
+
 class PollStop(OFGMessage):
+    __slots__ = ('xid_to_stop_polling',)
+    FMT = struct.Struct('> 2I')
+
     @staticmethod
     def get_type():
         return 0x0F
@@ -207,24 +472,24 @@ class PollStop(OFGMessage):
         self.xid_to_stop_polling = xid_to_stop_polling
 
     def length(self):
-        return OFGMessage.SIZE + 4
+        return PollStop.FMT.size
 
     def pack(self):
-        return OFGMessage.pack(self) + struct.pack('> I', self.xid_to_stop_polling)
+        return PollStop.FMT.pack(self.xid, self.xid_to_stop_polling)
 
     @staticmethod
     def unpack(body):
-        xid = struct.unpack('> I', body[:4])[0]
-        body = body[4:]
-        xid_to_stop_polling = struct.unpack('> I', body[:4])[0]
+        xid, xid_to_stop_polling = PollStop.FMT.unpack_from(body)
         return PollStop(xid_to_stop_polling, xid)
 
     def __str__(self):
         return 'POLL_STOP: ' + OFGMessage.__str__(self) + ' xid_to_stop_polling=%u' % self.xid_to_stop_polling
 OFG_MESSAGES.append(PollStop)
 
-class Node:
+class Node(object):
+    __slots__ = ('node_type', 'id')
     SIZE = 10
+    FMT = struct.Struct('> HQ')
 
     # default types
     TYPE_UNKNOWN = 0
@@ -236,12 +501,26 @@ class Node:
         self.node_type = int(node_type)
         self.id = long(node_id)
 
+    @staticmethod
+    def intern(node_type, node_id):
+        """Returns the shared Node object for (node_type, node_id) from
+        NODE_TABLE, creating it if needed.  Interned nodes must be treated as
+        immutable.  Decoders do not intern the nodes they decode (a lookup
+        per reference costs more than it saves for a message which is
+        decoded and dropped); long-lived stores such as
+        OFGTopology.TopologyStore intern the nodes they keep instead."""
+        return NODE_TABLE.intern(node_type, node_id)
+
     def pack(self):
-        return struct.pack('> HQ', self.node_type, self.id)
+        return Node.FMT.pack(self.node_type, self.id)
 
     @staticmethod
     def unpack(buf):
-        t = struct.unpack('> HQ', buf[:Node.SIZE])
+        return Node.unpack_from(buf, 0)
+
+    @staticmethod
+    def unpack_from(buf, offset):
+        t = Node.FMT.unpack_from(buf, offset)
         return Node(t[0], t[1])
 
     @staticmethod
@@ -258,7 +537,42 @@ class Node:
     def __str__(self):
         return '%s{%s}' % (Node.type_to_str(self.node_type), dpidstr(self.id))
 
+class NodeTable(object):
+    """Interned Node objects keyed by (node_type, id).  The table is a plain
+    dictionary (a weak one costs several times as much per lookup), so nodes
+    are evicted explicitly with release() (e.g. once a NodesDel removes them)
+    and the whole table is emptied whenever it reaches max_size entries,
+    which bounds it even if nodes are never released.  Nodes interned before
+    and after the table is emptied are equal but not the same object."""
+    __slots__ = ('nodes', 'max_size')
+
+    def __init__(self, max_size=1024*1024):
+        self.nodes = {}
+        self.max_size = max_size
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def intern(self, node_type, node_id):
+        """Returns the interned Node for (node_type, node_id)."""
+        n = self.nodes.get((node_type, node_id))
+        if n is None:
+            if len(self.nodes) >= self.max_size:
+                self.nodes.clear()
+            n = self.nodes[(node_type, node_id)] = Node(node_type, node_id)
+        return n
+
+    def release(self, node_type, node_id):
+        """Evicts the node (if interned) so it can be freed once nothing else
+        refers to it."""
+        self.nodes.pop((node_type, node_id), None)
+
+# the table used by Node.intern()
+NODE_TABLE = NodeTable()
+
 class NodesList(OFGMessage):
+    __slots__ = ('nodes',)
+
     def __init__(self, nodes, xid=0):
         OFGMessage.__init__(self, xid)
         self.nodes = nodes
@@ -271,19 +585,31 @@ class NodesList(OFGMessage):
 
     @staticmethod
     def unpack_child(clz, body):
-        xid = struct.unpack('> I', body[:4])[0]
-        body = body[4:]
-        num_nodes = len(body) / Node.SIZE
-        nodes = []
-        for _ in range(num_nodes):
-            nodes.append(Node.unpack(body[Node.SIZE:]))
-            body = body[:Node.SIZE]
+        xid = OFGMessage.FMT.unpack_from(body)[0]
+        end = len(body) - Node.SIZE + 1
+        nodes = [Node.unpack_from(body, off) for off in xrange(OFGMessage.SIZE, end, Node.SIZE)]
         return clz(nodes, xid)
 
+    def split(self, max_len):
+        """Returns a list of messages like this one (same type and xid), each
+        at most max_len bytes long, which together hold all of its nodes."""
+        per_msg = max(1, (max_len - OFGMessage.SIZE) / Node.SIZE)
+        nodes = self.nodes
+        return [self.__class__(nodes[i:i+per_msg], self.xid) for i in xrange(0, len(nodes), per_msg)]
+
+    def merge(self, other):
+        """Returns a message like this one holding its nodes followed by other's."""
+        return self.__class__(list(self.nodes) + list(other.nodes), self.xid)
+
+    def summary(self):
+        return OFGMessage.summary(self) + ' nodes=%u' % len(self.nodes)
+
     def __str__(self):
         return OFGMessage.__str__(self) + ' nodes=[%s]' % ''.join([str(node) + ',' for node in self.nodes])
 
 class NodesAdd(NodesList):
+    __slots__ = ()
+
     @staticmethod
     def get_type():
         return 0x11
@@ -300,6 +626,8 @@ class NodesAdd(NodesList):
 OFG_MESSAGES.append(NodesAdd)
 
 class NodesDel(NodesList):
+    __slots__ = ()
+
     @staticmethod
     def get_type():
         return 0x12
@@ -315,8 +643,10 @@ class NodesDel(NodesList):
         return 'NODES_DEL: ' + NodesList.__str__(self)
 OFG_MESSAGES.append(NodesDel)
 
-class Link:
+class Link(object):
+    __slots__ = ('link_type', 'src_node', 'src_port', 'dst_node', 'dst_port')
     SIZE = 2 + (2 * (Node.SIZE + 2))
+    FMT = struct.Struct('> H HQH HQH')
 
     TYPE_UNKNOWN = 0
     TYPE_WIRE = 1
@@ -331,22 +661,19 @@ class Link:
         self.dst_port = dst_port
 
     def pack(self):
-        src = self.src_node.pack() + struct.pack('> H', self.src_port)
-        dst = self.dst_node.pack() + struct.pack('> H', self.dst_port)
-        return struct.pack('> H', self.link_type) + src + dst
+        src, dst = self.src_node, self.dst_node
+        return Link.FMT.pack(self.link_type,
+                             src.node_type, src.id, self.src_port,
+                             dst.node_type, dst.id, self.dst_port)
 
     @staticmethod
     def unpack(buf):
-        link_type = struct.unpack('> H', buf[:2])[0]
-        buf = buf[2:]
-        src_node = Node.unpack(buf[:Node.SIZE])
-        buf = buf[Node.SIZE:]
-        src_port = struct.unpack('> H', buf[:2])[0]
-        buf = buf[2:]
-        dst_node = Node.unpack(buf[:Node.SIZE])
-        buf = buf[Node.SIZE:]
-        dst_port = struct.unpack('> H', buf[:2])[0]
-        return Link(link_type, src_node, src_port, dst_node, dst_port)
+        return Link.unpack_from(buf, 0)
+
+    @staticmethod
+    def unpack_from(buf, offset):
+        t = Link.FMT.unpack_from(buf, offset)
+        return Link(t[0], Node(t[1], t[2]), t[3], Node(t[4], t[5]), t[6])
 
     @staticmethod
     def type_to_str(link_type):
@@ -365,32 +692,43 @@ class Link:
                                          str(self.dst_node), self.dst_port)
 
 class LinkSpec(Link):
+    __slots__ = ('capacity_bps',)
     SIZE = Link.SIZE + 8
+    FMT = struct.Struct('> H HQH HQH Q')
 
     def __init__(self, link_type, src_node, src_port, dst_node, dst_port, capacity_bps):
         Link.__init__(self, link_type, src_node, src_port, dst_node, dst_port)
         self.capacity_bps = int(capacity_bps)
 
     def pack(self):
-        return Link.pack(self) + struct.pack('> Q', self.capacity_bps)
+        src, dst = self.src_node, self.dst_node
+        return LinkSpec.FMT.pack(self.link_type,
+                                 src.node_type, src.id, self.src_port,
+                                 dst.node_type, dst.id, self.dst_port,
+                                 self.capacity_bps)
 
     @staticmethod
     def unpack(buf):
-        link = Link.unpack(buf)
-        buf = buf[Link.SIZE:]
-        capacity_bps = struct.unpack('> Q', buf)[0]
-        return LinkSpec(link.link_type, link.src_node, link.src_port, link.dst_node, link.dst_port, capacity_bps)
+        return LinkSpec.unpack_from(buf, 0)
+
+    @staticmethod
+    def unpack_from(buf, offset):
+        t = LinkSpec.FMT.unpack_from(buf, offset)
+        return LinkSpec(t[0], Node(t[1], t[2]), t[3], Node(t[4], t[5]), t[6], t[7])
 
     def __str__(self):
         return Link.__str__(self) + ':' + str(int(self.capacity_bps)/(1000*1000)) + 'Mbps'
 
 class LinksList(OFGMessage):
+    __slots__ = ('links',)
+    LINK_SIZE = Link.SIZE
+
     def __init__(self, links, xid=0):
         OFGMessage.__init__(self, xid)
         self.links = links
 
     def length(self):
-        return OFGMessage.SIZE + len(self.links) * Link.SIZE
+        return OFGMessage.SIZE + len(self.links) * self.LINK_SIZE
 
     def pack(self):
         hdr = OFGMessage.pack(self)
@@ -398,15 +736,26 @@ class LinksList(OFGMessage):
 
     @staticmethod
     def unpack_child(clz, link_clz, body):
-        xid = struct.unpack('> I', body[:4])[0]
-        body = body[4:]
-        num_links = len(body) / Link.SIZE
-        links = []
-        for _ in range(num_links):
-            links.append(link_clz.unpack(body[:link_clz.SIZE]))
-            body = body[link_clz.SIZE:]
+        xid = OFGMessage.FMT.unpack_from(body)[0]
+        end = len(body) - link_clz.SIZE + 1
+        unpack_from = link_clz.unpack_from
+        links = [unpack_from(body, off) for off in xrange(OFGMessage.SIZE, end, link_clz.SIZE)]
         return clz(links, xid)
 
+    def split(self, max_len):
+        """Returns a list of messages like this one (same type and xid), each
+        at most max_len bytes long, which together hold all of its links."""
+        per_msg = max(1, (max_len - OFGMessage.SIZE) / self.LINK_SIZE)
+        links = self.links
+        return [self.__class__(links[i:i+per_msg], self.xid) for i in xrange(0, len(links), per_msg)]
+
+    def merge(self, other):
+        """Returns a message like this one holding its links followed by other's."""
+        return self.__class__(list(self.links) + list(other.links), self.xid)
+
+    def summary(self):
+        return OFGMessage.summary(self) + ' links=%u' % len(self.links)
+
     def links_to_string(self):
         return '[' + ', '.join([str(l) for l in self.links]) + ']'
 
@@ -414,13 +763,15 @@ class LinksList(OFGMessage):
         return OFGMessage.__str__(self) + ' links=%s' % str(self.links_to_string())
 
 class LinkSpecsList(LinksList):
+    __slots__ = ()
+    LINK_SIZE = LinkSpec.SIZE
+
     def __init__(self, links, xid=0):
         LinksList.__init__(self, links, xid)
 
-    def length(self):
-        return OFGMessage.SIZE + len(self.links) * LinkSpec.SIZE
-
 class LinksAdd(LinkSpecsList):
+    __slots__ = ()
+
     @staticmethod
     def get_type():
         return 0x14
@@ -437,6 +788,8 @@ class LinksAdd(LinkSpecsList):
 OFG_MESSAGES.append(LinksAdd)
 
 class LinksDel(LinksList):
+    __slots__ = ()
+
     @staticmethod
     def get_type():
         return 0x15
@@ -452,8 +805,10 @@ class LinksDel(LinksList):
         return 'LINKS_DEL: ' + LinksList.__str__(self)
 OFG_MESSAGES.append(LinksDel)
 
-class FlowHop:
+class FlowHop(object):
+    __slots__ = ('inport', 'node', 'outport')
     SIZE = 2 + Node.SIZE + 2
+    FMT = struct.Struct('> H HQ H')
 
     def __init__(self, inport, node, outport):
         self.inport = int(inport)
@@ -461,21 +816,26 @@ class FlowHop:
         self.outport = int(outport)
 
     def pack(self):
-        return struct.pack('> H', self.inport) + self.node.pack() + struct.pack('> H', self.outport)
+        return FlowHop.FMT.pack(self.inport, self.node.node_type, self.node.id, self.outport)
 
     @staticmethod
     def unpack(buf):
-        inport = struct.unpack('> H', buf[:2])[0]
-        buf = buf[2:]
-        node = Node.unpack(buf[:Node.SIZE])
-        buf = buf[Node.SIZE:]
-        outport = struct.unpack('> H', buf[:2])[0]
-        return FlowHop(inport, node, outport)
+        return FlowHop.unpack_from(buf, 0)
+
+    @staticmethod
+    def unpack_from(buf, offset):
+        t = FlowHop.FMT.unpack_from(buf, offset)
+        return FlowHop(t[0], Node(t[1], t[2]), t[3])
 
     def __str__(self):
         return '%s:%u:%u' % (str(self.node), self.inport, self.outport)
 
-class Flow:
+class Flow(object):
+    __slots__ = ('flow_type', 'flow_id', 'src_node', 'src_port', 'dst_node', 'dst_port', 'path')
+
+    # flow type, flow id, source, destination, and the number of hops
+    FMT = struct.Struct('> HI HQH HQH H')
+
     TYPE_UNKNOWN = 0
 
     def __init__(self, flow_type, flow_id, src_node, src_port, dst_node, dst_port, path):
@@ -488,35 +848,28 @@ class Flow:
         self.path = path
 
     def pack(self):
-        src = self.src_node.pack() + struct.pack('> H', self.src_port)
-        dst = self.dst_node.pack() + struct.pack('> H', self.dst_port)
-        header = struct.pack('> H I', self.flow_type, self.flow_id) + src + dst + struct.pack('> H', len(self.path))
+        src, dst = self.src_node, self.dst_node
+        header = Flow.FMT.pack(self.flow_type, self.flow_id,
+                               src.node_type, src.id, self.src_port,
+                               dst.node_type, dst.id, self.dst_port,
+                               len(self.path))
         body = ''.join(hop.pack() for hop in self.path)
         return header + body
 
     @staticmethod
     def unpack(buf):
-        flow_type, flow_id = struct.unpack('> H I', buf[:6])
-        buf = buf[6:]
-        src_node = Node.unpack(buf[:Node.SIZE])
-        buf = buf[Node.SIZE:]
-        src_port = struct.unpack('> H', buf[:2])[0]
-        buf = buf[2:]
-        dst_node = Node.unpack(buf[:Node.SIZE])
-        dst_port = struct.unpack('> H', buf[:2])[0]
-        buf = buf[2:]
-        num_hops = struct.unpack('> H', buf[:2])[0]
-        buf = buf[2:]
-
-        path = []
-        for _ in range(num_hops):
-            path.append(FlowHop.unpack(buf[:FlowHop.SIZE]))
-            buf = buf[FlowHop.SIZE:]
-
-        return Flow(flow_type, flow_id, src_node, src_port, dst_node, dst_port, path)
+        return Flow.unpack_from(buf, 0)
+
+    @staticmethod
+    def unpack_from(buf, offset):
+        t = Flow.FMT.unpack_from(buf, offset)
+        start = offset + Flow.FMT.size
+        end = start + t[8] * FlowHop.SIZE
+        path = [FlowHop.unpack_from(buf, off) for off in xrange(start, end, FlowHop.SIZE)]
+        return Flow(t[0], t[1], Node(t[2], t[3]), t[4], Node(t[5], t[6]), t[7], path)
 
     def length(self):
-        return 8 + 2*(2+Node.SIZE) + FlowHop.SIZE * len(self.path)
+        return Flow.FMT.size + FlowHop.SIZE * len(self.path)
 
     @staticmethod
     def type_to_str(flow_type):
@@ -529,30 +882,56 @@ class Flow:
                                                       str(self.dst_node), self.dst_port)
 
 class FlowsList(OFGMessage):
+    __slots__ = ('flows',)
+    FMT = struct.Struct('> 2I')
+
     def __init__(self, flows, xid=0):
         OFGMessage.__init__(self, xid)
         self.flows = flows
 
     def length(self):
-        return OFGMessage.SIZE + 4 + sum(flow.length() for flow in self.flows)
+        return FlowsList.FMT.size + sum(flow.length() for flow in self.flows)
 
     def pack(self):
-        hdr = OFGMessage.pack(self) + struct.pack('> I', len(self.flows))
+        hdr = FlowsList.FMT.pack(self.xid, len(self.flows))
         return hdr + ''.join([flow.pack() for flow in self.flows])
 
     @staticmethod
     def unpack_child(clz, body):
-        xid = struct.unpack('> I', body[:4])[0]
-        body = body[4:]
-        num_flows = struct.unpack('> I', body)[0]
-        body = body[4:]
+        xid, num_flows = FlowsList.FMT.unpack_from(body)
+        off = FlowsList.FMT.size
         flows = []
-        for _ in range(num_flows):
-            f = Flow.unpack(body)
+        for _ in xrange(num_flows):
+            f = Flow.unpack_from(body, off)
             flows.append(f)
-            body = body[f.length():]
+            off += f.length()
         return clz(flows, xid)
 
+    def split(self, max_len):
+        """Returns a list of messages like this one (same type and xid), each
+        at most max_len bytes long (unless a single flow is longer), which
+        together hold all of its flows."""
+        parts = []
+        cur = []
+        cur_len = FlowsList.FMT.size
+        for f in self.flows:
+            flen = f.length()
+            if cur and cur_len + flen > max_len:
+                parts.append(self.__class__(cur, self.xid))
+                cur = []
+                cur_len = FlowsList.FMT.size
+            cur.append(f)
+            cur_len += flen
+        parts.append(self.__class__(cur, self.xid))
+        return parts
+
+    def merge(self, other):
+        """Returns a message like this one holding its flows followed by other's."""
+        return self.__class__(list(self.flows) + list(other.flows), self.xid)
+
+    def summary(self):
+        return OFGMessage.summary(self) + ' flows=%u' % len(self.flows)
+
     def flows_to_string(self):
         return '[' + ', '.join([str(f) for f in self.flows]) + ']'
 
@@ -560,6 +939,8 @@ class FlowsList(OFGMessage):
         return OFGMessage.__str__(self) + ' flows=%s' % str(self.flows_to_string())
 
 class FlowsAdd(FlowsList):
+    __slots__ = ()
+
     @staticmethod
     def get_type():
         return 0x17
@@ -576,6 +957,8 @@ class FlowsAdd(FlowsList):
 OFG_MESSAGES.append(FlowsAdd)
 
 class FlowsDel(FlowsList):
+    __slots__ = ()
+
     @staticmethod
     def get_type():
         return 0x18
@@ -592,28 +975,32 @@ class FlowsDel(FlowsList):
 OFG_MESSAGES.append(FlowsDel)
 
 class Request(OFGMessage):
+    __slots__ = ('request_type', 'type')
+    FMT = struct.Struct('> IBH')
+
     TYPE_UNKNOWN = 0
     TYPE_ONETIME = 1
     TYPE_SUBSCRIBE = 2
     TYPE_UNSUBSCRIBE = 3
 
+    # the node, link or flow type which matches any type
+    ANY_TYPE = 0
+
     def __init__(self, request_type, otype, xid=0):
         OFGMessage.__init__(self, xid)
         self.request_type = request_type
         self.type = otype
 
     def length(self):
-        return OFGMessage.SIZE + 3
+        return Request.FMT.size
 
     def pack(self):
-        return OFGMessage.pack(self) + struct.pack('> 2H', self.request_type, self.type)
+        return Request.FMT.pack(self.xid, self.request_type, self.type)
 
     @staticmethod
     def unpack_child(clz, body):
-        xid = struct.unpack('> I', body[:4])[0]
-        body = body[4:]
-        t = struct.unpack('> BH', body)
-        return clz(t[0], t[1], xid)
+        t = Request.FMT.unpack_from(body)
+        return clz(t[1], t[2], t[0])
 
     @staticmethod
     def type_to_str(request_type):
@@ -635,6 +1022,8 @@ class Request(OFGMessage):
         return OFGMessage.__str__(self) + ' %s %s' % (rstr, ostr)
 
 class NodesRequest(Request):
+    __slots__ = ()
+
     @staticmethod
     def get_type():
         return 0x10
@@ -654,6 +1043,9 @@ class NodesRequest(Request):
 OFG_MESSAGES.append(NodesRequest)
 
 class LinksRequest(Request):
+    __slots__ = ('src_node',)
+    FMT = struct.Struct('> IBH HQ')
+
     @staticmethod
     def get_type():
         return 0x13
@@ -662,17 +1054,17 @@ class LinksRequest(Request):
         Request.__init__(self, request_type, link_type, xid)
         self.src_node = src_node
 
+    def length(self):
+        return LinksRequest.FMT.size
+
     def pack(self):
-        return Request.pack(self) + self.src_node.pack()
+        return LinksRequest.FMT.pack(self.xid, self.request_type, self.type,
+                                     self.src_node.node_type, self.src_node.id)
 
     @staticmethod
     def unpack(body):
-        xid = struct.unpack('> I', body[:4])[0]
-        body = body[4:]
-        t = struct.unpack('> BH', body[:3])
-        body = body[3:]
-        src_node = Node.unpack(body)
-        return LinksRequest(t[0], t[1], src_node, xid)
+        t = LinksRequest.FMT.unpack_from(body)
+        return LinksRequest(t[1], t[2], Node(t[3], t[4]), t[0])
 
     def otype_to_str(self, otype):
         return Link.type_to_str(otype)
@@ -682,6 +1074,8 @@ class LinksRequest(Request):
 OFG_MESSAGES.append(LinksRequest)
 
 class FlowsRequest(Request):
+    __slots__ = ()
+
     @staticmethod
     def get_type():
         return 0x16
@@ -700,28 +1094,311 @@ class FlowsRequest(Request):
         return 'REQUEST for Flows: ' + Request.__str__(self)
 OFG_MESSAGES.append(FlowsRequest)
 
-OFG_PROTOCOL = LTProtocol(OFG_MESSAGES, 'H', 'B')
+class StatsHeader(OFGMessage):
+    """A stats request or reply about a switch.  body holds the rest of the
+    message, i.e. the OpenFlow ofp_stats_request or ofp_stats_reply body."""
+    __slots__ = ('dpid', 'stats_type', 'flags', 'body')
+    FMT = struct.Struct('> IQHH')
+
+    TYPE_DESC = 0x0000
+    TYPE_FLOW = 0x0001
+    TYPE_AGGREGATE = 0x0002
+    TYPE_TABLE = 0x0003
+    TYPE_PORT = 0x0004
+    TYPE_VENDOR = 0xFFFF
+
+    def __init__(self, dpid, stats_type, flags, body='', xid=0):
+        OFGMessage.__init__(self, xid)
+        self.dpid = long(dpid)
+        self.stats_type = int(stats_type)
+        self.flags = int(flags)
+        self.body = body
+
+    def length(self):
+        return StatsHeader.FMT.size + len(self.body)
+
+    def pack(self):
+        return StatsHeader.FMT.pack(self.xid, self.dpid, self.stats_type, self.flags) + self.body
+
+    @staticmethod
+    def unpack_child(clz, body):
+        t = StatsHeader.FMT.unpack_from(body)
+        return clz(t[1], t[2], t[3], body[StatsHeader.FMT.size:], t[0])
+
+    def __str__(self):
+        fmt = OFGMessage.__str__(self) + ' type=%u switch=%s flags=%u body length=%uB'
+        return fmt % (self.stats_type, dpidstr(self.dpid), self.flags, len(self.body))
+
+class StatsRequest(StatsHeader):
+    __slots__ = ()
+
+    @staticmethod
+    def get_type():
+        return 0x20
+
+    def __init__(self, dpid, stats_type, flags, body='', xid=0):
+        StatsHeader.__init__(self, dpid, stats_type, flags, body, xid)
+
+    @staticmethod
+    def unpack(body):
+        return StatsHeader.unpack_child(StatsRequest, body)
+
+    def __str__(self):
+        return 'STAT_REQUEST: ' + StatsHeader.__str__(self)
+OFG_MESSAGES.append(StatsRequest)
+
+class StatsReply(StatsHeader):
+    __slots__ = ()
+
+    @staticmethod
+    def get_type():
+        return 0x21
+
+    def __init__(self, dpid, stats_type, flags, body='', xid=0):
+        StatsHeader.__init__(self, dpid, stats_type, flags, body, xid)
+
+    @staticmethod
+    def unpack(body):
+        return StatsHeader.unpack_child(StatsReply, body)
 
-def create_ofg_server(port, recv_callback):
+    def __str__(self):
+        return 'STAT_REPLY: ' + StatsHeader.__str__(self)
+OFG_MESSAGES.append(StatsReply)
+
+class OFGProtocol(LTProtocol):
+    """An LTProtocol which decodes through a flat table indexed by the type
+    value (built once, so dispatch cost does not depend on the number of
+    message types) and counts how many messages of each type it decodes.
+    Like LTProtocol, it decodes a message of an unknown type (e.g. from a
+    newer peer) as None; it also counts them and logs the first of each type.
+
+    Messages too long for the length field are either split into several
+    frames or, if the peer supports them, sent as one extended frame: a
+    frame whose length field is zero, followed by a 4-byte length (which
+    counts the whole frame) and then the usual type and body.
+    """
+    def __init__(self, msg_types, len_type='H', type_type='B'):
+        LTProtocol.__init__(self, msg_types, len_type, type_type)
+        self.frame_hdr = struct.Struct('> ' + len_type + type_type)
+        self.ext_frame_hdr = struct.Struct('> ' + len_type + 'I' + type_type)
+        self.max_body_len = (1 << (8 * struct.calcsize('> ' + len_type))) - 1 - self.frame_hdr.size
+        num_type_vals = 1 << (8 * struct.calcsize('> ' + type_type))
+        self.decoders = [None] * num_type_vals
+        for type_val, ltm in self.msg_types.iteritems():
+            self.decoders[type_val] = ltm.unpack
+        self.decode_counts = [0] * num_type_vals
+        self.unknown_counts = [0] * num_type_vals
+
+    def iter_frames(self, buf, off=0):
+        """Yields a (type_val, body, next_off) tuple for each complete frame in
+        buf, starting at offset off, where next_off is the offset just past
+        the frame.  Stops at the first incomplete frame."""
+        hdr = self.frame_hdr
+        ext_hdr = self.ext_frame_hdr
+        end = len(buf)
+        while end - off >= hdr.size:
+            frame_len, type_val = hdr.unpack_from(buf, off)
+            body_off = hdr.size
+            if frame_len == 0:
+                if end - off < ext_hdr.size:
+                    return
+                _, frame_len, type_val = ext_hdr.unpack_from(buf, off)
+                body_off = ext_hdr.size
+            if frame_len < body_off:
+                raise ValueError('invalid OFG frame length %u' % frame_len)
+            if end - off < frame_len:
+                return  # not enough bytes for a full frame yet
+
+            next_off = off + frame_len
+            yield type_val, buf[off+body_off:next_off], next_off
+            off = next_off
+
+    def compress_frames(self, frames, extended=False):
+        """Returns a list of frames which carry the specified frames in
+        Compressed envelopes.  Unless extended frames are allowed, the frames
+        are grouped so that each envelope fits in an ordinary frame; a group
+        which does not compress is passed through unchanged."""
+        if extended:
+            groups = [frames]
+        else:
+            groups = []
+            cur = []
+            cur_len = 0
+            for f in frames:
+                if cur and cur_len + len(f) > self.max_body_len:
+                    groups.append(cur)
+                    cur = []
+                    cur_len = 0
+                cur.append(f)
+                cur_len += len(f)
+            groups.append(cur)
+
+        ret = []
+        for group in groups:
+            env = Compressed(''.join(group))
+            if env.length() < len(env.frames):
+                ret.extend(self.pack_frames(env, extended))
+            else:
+                ret.extend(group)
+        return ret
+
+    def unpack_received_msg(self, type_val, body):
+        """Returns the message of type type_val whose body is body, or None if
+        the type is unknown."""
+        unpack = self.decoders[type_val]
+        if unpack is None:
+            self.unknown_counts[type_val] += 1
+            if self.unknown_counts[type_val] == 1:
+                OFG_LOG.warning('ignoring OFG message of unknown type 0x%02x (%uB body)' % (type_val, len(body)))
+            return None
+        self.decode_counts[type_val] += 1
+        return unpack(body)
+
+    def pack_with_header(self, ltm):
+        """Returns a frame (header and body) holding ltm."""
+        body = ltm.pack()
+        return self.frame_hdr.pack(self.frame_hdr.size + len(body), ltm.get_type()) + body
+
+    def pack_extended(self, ltm):
+        """Returns an extended frame holding ltm."""
+        body = ltm.pack()
+        return self.ext_frame_hdr.pack(0, self.ext_frame_hdr.size + len(body), ltm.get_type()) + body
+
+    def pack_frames(self, ltm, extended=False):
+        """Returns a list of frames which carry ltm.  If ltm is too long for
+        one frame, then it is sent as one extended frame if extended is True,
+        or else split (see NodesList.split()) into several messages which each
+        fit in an ordinary frame."""
+        if ltm.length() <= self.max_body_len:
+            return [self.pack_with_header(ltm)]
+        elif extended:
+            return [self.pack_extended(ltm)]
+
+        split = getattr(ltm, 'split', None)
+        parts = split(self.max_body_len) if split is not None else [ltm]
+        if len(parts) == 1:
+            raise ValueError('%s is too long for a frame' % ltm.summary())
+        return [f for part in parts for f in self.pack_frames(part)]
+
+    def set_frame_xid(self, frame, xid):
+        """Returns a copy of a packed frame (standard or extended) with its
+        message's xid replaced by xid."""
+        off = self.frame_hdr.size
+        if self.frame_hdr.unpack_from(frame)[0] == 0:
+            off = self.ext_frame_hdr.size
+        return frame[:off] + OFGMessage.FMT.pack(xid) + frame[off+OFGMessage.SIZE:]
+
+    def decode_stats(self):
+        """Returns a dictionary mapping message class names to the number of
+        messages of that type decoded so far."""
+        return dict((self.msg_types[t].__name__, n) for t, n in enumerate(self.decode_counts) if n)
+
+OFG_PROTOCOL = OFGProtocol(OFG_MESSAGES, 'H', 'B')
+
+# the exceptions raised by decoding a malformed message (or envelope)
+DECODE_ERRORS = (struct.error, ValueError, zlib.error)
+
+class MsgText(object):
+    """Defers rendering an OFG message as text until str() is called on it,
+    i.e. until a logging handler actually formats a record which refers to
+    it.  If full is False, the message's summary() is used instead of its
+    complete text."""
+    __slots__ = ('ltm', 'full')
+
+    def __init__(self, ltm, full=True):
+        self.ltm = ltm
+        self.full = full
+
+    def __str__(self):
+        if self.ltm is None:
+            return 'unknown message'
+        elif self.full:
+            return str(self.ltm)
+        else:
+            return self.ltm.summary()
+
+def log_msg(what, ltm, logger=OFG_LOG):
+    """Logs a message's full text at DEBUG or else its summary at INFO.  The
+    message is not rendered at all unless one of those levels is enabled."""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('%s %s', what, MsgText(ltm, True))
+    elif logger.isEnabledFor(logging.INFO):
+        logger.info('%s %s', what, MsgText(ltm, False))
+
+def create_ofg_server(port, recv_callback, lt_protocol=OFG_PROTOCOL, extended_frames=False,
+                      compress_threshold=None, coalesce_max_delay=None, coalesce_max_bytes=65536,
+                      max_queue_bytes=None, slow_policy='drop', snapshot_callback=None,
+                      echo_interval=None, echo_max_missed=3,
+                      metrics_enabled=True, metrics_port=None, profile_dir=None):
     """Starts a server which listens for OFG clients on the specified port.
 
     @param port  the port to listen on
     @param recv_callback  the function to call with received message content
                          (takes two arguments: transport, msg)
-
-    @return returns the new LTTwistedServer
+    @param lt_protocol  the protocol to decode messages with (e.g.
+                        OFGArrays.OFG_ARRAY_PROTOCOL)
+    @param extended_frames  whether to send messages too long for a normal
+                            frame as one extended frame (all clients must
+                            support them) rather than splitting them
+    @param compress_threshold  if not None, messages of at least this many
+                               bytes are sent compressed to clients which
+                               support Compressed envelopes
+    @param coalesce_max_delay  if not None, messages sent to a client are
+                               queued and written together at most this many
+                               seconds later (0 means at the end of the
+                               current reactor iteration)
+    @param coalesce_max_bytes  when coalescing, a client's queue is written
+                               as soon as it holds this many bytes
+    @param max_queue_bytes  if not None, the most bytes of messages which may
+                            wait for a slow client before slow_policy applies
+    @param slow_policy  'drop', 'coalesce' or 'snapshot' (see OFGServer)
+    @param snapshot_callback  for the 'snapshot' policy, called with a client
+                              connection to get the messages to send it
+    @param echo_interval  if not None, how often (in seconds) to send each
+                          client an EchoRequest to measure its round-trip time
+    @param echo_max_missed  how many echoes in a row a client may leave
+                            unanswered before it is disconnected
+    @param metrics_enabled  whether to collect per message type metrics
+                            (see OFGMetrics; server.metrics.enabled switches
+                            them on and off later)
+    @param metrics_port  if not None, the local port to serve the metrics on
+                         over HTTP (/metrics and /metrics.json)
+    @param profile_dir  if not None, profiling can be started and stopped at
+                        runtime (see OFGProfiler) with SIGUSR1 (cProfile),
+                        SIGUSR2 (memory snapshot) or, if metrics_port is not
+                        None, by POSTing to /admin/...; output is written to
+                        this directory
+
+    @return returns the new OFGServer (an LTTwistedServer)
     """
-    from ltprotocol.ltprotocol import LTTwistedServer
-    server = LTTwistedServer(OFG_PROTOCOL, recv_callback)
+    from OFGServer import OFGServer
+    server = OFGServer(lt_protocol, recv_callback, extended_frames=extended_frames,
+                       compress_threshold=compress_threshold,
+                       coalesce_max_delay=coalesce_max_delay,
+                       coalesce_max_bytes=coalesce_max_bytes,
+                       max_queue_bytes=max_queue_bytes,
+                       slow_policy=slow_policy,
+                       snapshot_callback=snapshot_callback,
+                       echo_interval=echo_interval,
+                       echo_max_missed=echo_max_missed,
+                       metrics_enabled=metrics_enabled)
     server.listen(port)
+    if profile_dir is not None:
+        from OFGProfiler import Profiler
+        server.profiler = Profiler(profile_dir)
+        server.profiler.install_signals()
+    if metrics_port is not None:
+        from OFGMetrics import serve_metrics
+        serve_metrics(server.metrics, metrics_port, profiler=server.profiler)
     return server
 
-def run_ofg_server(port, recv_callback):
-    """Creates (see create_ofg_server()) and runs a OFG server.
+def run_ofg_server(port, recv_callback, **kwargs):
+    """Creates (see create_ofg_server(), which is also passed any keyword
+    arguments) and runs a OFG server.
 
     @return this method does not return until the server shuts down (e.g. ctrl-c)
     """
-    create_ofg_server(port, recv_callback)
+    create_ofg_server(port, recv_callback, **kwargs)
     reactor.run()
 
 def sha1(s):
@@ -732,10 +1409,11 @@ def sha1(s):
 
 class _Test():
     """A simple test server for the OFG protocol"""
-    def __init__(self, num_nodes, test_auth, test_bicast):
+    def __init__(self, num_nodes, test_auth, test_bicast, columns=False):
         self.num_nodes = num_nodes
         self.test_auth = test_auth
         self.test_bicast = test_bicast
+        self.columns = columns
         self.server = None
 
         # make sure the bicast test option is compatible with the number of nodes
@@ -747,6 +1425,10 @@ class _Test():
                 print >> sys.stderr, 'warning: not enough nodes for the bicast test'
 
         self.test_flow = (self.num_nodes >= 4)
+        self.topology = self.make_topology()
+        self.subs = None  # a SubscriptionManager, once the server is running
+        self.polls = None  # a PollEngine, once the server is running
+        self.flapped = None  # the link removed by flap_link(), if any
 
         # create some simple data structures for basic authentication support
         self.salt_id_on = 1
@@ -757,64 +1439,105 @@ class _Test():
         """Adds a user to the database"""
         self.user_db[username] = sha1(pw)
 
-    # test: simply print out all received messages
-    def print_ltm(self, _, ltm):
+    def make_topology(self):
+        """Returns a TopologyStore holding the test topology."""
+        from OFGTopology import TopologyStore
+        topo = TopologyStore(columns=self.columns)
+        nodes = [Node.intern(Node.TYPE_OPENFLOW_SWITCH, i+1) for i in range(self.num_nodes)]
+        c = 1000*1000*1000
+        links = [LinkSpec(i % 2 + 1, nodes[i], 0, nodes[i+1], 1, c) for i in range(self.num_nodes-1)]
+
+        # add a second path from 2 to 3 via two additional nodes
+        if self.test_bicast:
+            nodes.append(Node.intern(Node.TYPE_OPENFLOW_SWITCH, 10000))
+            nodes.append(Node.intern(Node.TYPE_OPENFLOW_SWITCH, 10001))
+            n = self.num_nodes
+            links.append(LinkSpec(0, nodes[1], 2, nodes[n], 3, c))  # 2 to 10000
+            links.append(LinkSpec(0, nodes[n], 2, nodes[n+1], 3, c))  # 10000 to 10001
+            links.append(LinkSpec(0, nodes[n+1], 2, nodes[2], 3, c))  # 10001 to 3
+
+        for node in nodes:
+            topo.add_node(node)
+        for link in links:
+            topo.add_link(link)
+
+        if self.test_flow:
+            hops = [FlowHop(0, nodes[i+1], 1) for i in range(2)]
+            flow_type = 3
+            flow_id = 44
+            topo.add_flow(Flow(flow_type, flow_id, nodes[0], 0, nodes[3], 1, hops))
+
+        # add another flow which simulates bicast of the original flow
+        if self.test_bicast:
+            hops = [FlowHop(0, nodes[1], 2),
+                    FlowHop(3, nodes[n], 2),
+                    FlowHop(3, nodes[n+1], 2),
+                    FlowHop(3, nodes[2], 1)]
+            topo.add_flow(Flow(flow_type, flow_id, nodes[0], 0, nodes[3], 1, hops))
+
+        return topo
+
+    # test: print out all received messages and answer requests from the test topology
+    def print_ltm(self, conn, ltm):
+        if ltm is not None:
+            log_msg('recv:', ltm)
+            self.process(conn, ltm)
+
+    def answer(self, msg):
+        """Returns the reply to a polled message."""
+        if msg.get_type() in (NodesRequest.get_type(), LinksRequest.get_type(), FlowsRequest.get_type()):
+            return self.topology.answer(msg)
+        return None
+
+    def process(self, conn, ltm):
         if ltm is not None:
-            print 'recv: %s' % str(ltm)
-            if ltm.get_type() == NodesRequest.get_type() and ltm.request_type == Request.TYPE_ONETIME:
-                nodes = [Node(Node.TYPE_OPENFLOW_SWITCH, i+1) for i in range(self.num_nodes)]
-                c = 1000*1000*1000
-                links = [LinkSpec(i % 2 + 1, nodes[i], 0, nodes[i+1], 1, c) for i in range(self.num_nodes-1)]
-
-                # add a second path from 2 to 3 via two additional nodes
-                if self.test_bicast:
-                    nodes.append(Node(Node.TYPE_OPENFLOW_SWITCH, 10000))
-                    nodes.append(Node(Node.TYPE_OPENFLOW_SWITCH, 10001))
-                    n = self.num_nodes
-                    links.append(LinkSpec(0, nodes[1], 2, nodes[n], 3, c))  # 2 to 10000
-                    links.append(LinkSpec(0, nodes[n], 2, nodes[n+1], 3, c))  # 10000 to 10001
-                    links.append(LinkSpec(0, nodes[n+1], 2, nodes[2], 3, c))  # 10001 to 3
-
-                self.server.send(NodesAdd(nodes))
-                self.server.send(LinksAdd(links))
-
-                if self.test_flow:
-                    hops = [FlowHop(0, nodes[i+1], 1) for i in range(2)]
-                    flow_type = 3
-                    flow_id = 44
-                    f = Flow(flow_type, flow_id, nodes[0], 0, nodes[3], 1, hops)
-                    flows = [f]
-
-                # add another flow which simulates bicast of the original flow
-                if self.test_bicast:
-                    hops = [FlowHop(0, nodes[1], 2),
-                            FlowHop(3, nodes[n], 2),
-                            FlowHop(3, nodes[n+1], 2),
-                            FlowHop(3, nodes[2], 1)]
-                    f = Flow(flow_type, flow_id, nodes[0], 0, nodes[3], 1, hops)
-                    flows.append(f)
-
-                if self.test_flow:
-                    self.server.send(FlowsAdd(flows))
-            elif ltm.get_type() == AuthReply.get_type():
+            t = ltm.get_type()
+            if self.polls.handle(conn, ltm):
+                pass
+            elif t in (NodesRequest.get_type(), LinksRequest.get_type(), FlowsRequest.get_type()):
+                if ltm.request_type == Request.TYPE_ONETIME:
+                    self.server.send_msg_to_client(conn, self.topology.answer(ltm))
+
+                    # the GUI never asks for flows, so send them with the nodes
+                    if t == NodesRequest.get_type() and self.test_flow:
+                        self.server.send_msg_to_client(conn, FlowsAdd(self.topology.get_flows()))
+                else:
+                    self.subs.handle_request(conn, ltm)
+            elif t == AuthReply.get_type():
                 # get the salt associated with this transaction
                 if not self.salt_db.has_key(ltm.xid):
                     print 'unknown xid in auth reply: %u' % ltm.xid
                     return
-                salt = self.salt_db[ltm.xid]
+                salt = self.salt_db.pop(ltm.xid)
 
                 # check the username's validity
                 if not self.user_db.has_key(ltm.username):
-                    self.server.send(AuthStatus(False, 'Unknown username', ltm.xid))
+                    self.server.send_msg_to_client(conn, AuthStatus(False, 'Unknown username', ltm.xid))
                     return
 
                 # check the password
                 sha1pw = self.user_db[ltm.username]
                 shouldbe = sha1(sha1pw + salt)
                 if shouldbe != ltm.ssp:
-                    self.server.send(AuthStatus(False, 'Invalid password', ltm.xid))
+                    self.server.send_msg_to_client(conn, AuthStatus(False, 'Invalid password', ltm.xid))
                 else:
-                    self.server.send(AuthStatus(True, 'login as %s successful' % ltm.username, ltm.xid))
+                    self.server.send_msg_to_client(conn, AuthStatus(True, 'login as %s successful' % ltm.username, ltm.xid))
+
+    def lost_conn_callback(self, conn):
+        self.subs.remove_conn(conn)
+        self.polls.remove_conn(conn)
+
+    def flap_link(self):
+        """Removes the first link in the test topology or, if it was removed by
+        the previous call, puts it back; subscribers are sent the change."""
+        if self.flapped is None:
+            from OFGTopology import as_link
+            l = self.topology.get_links()[0]
+            self.flapped = l
+            self.subs.update(LinksDel([as_link(l)]))
+        else:
+            self.subs.update(LinksAdd([self.flapped]))
+            self.flapped = None
 
     # when the gui connects, ask it to authenticate
     def new_conn_callback(self, conn):
@@ -834,22 +1557,64 @@ def test(argv=sys.argv[1:]):
     parser.add_option("-b", "--bicast-test-off",
                       action="store_true", default=False,
                       help="do not include nodes and flows to test bicast")
+    parser.add_option("-m", "--metrics-port",
+                      type="int", default=None,
+                      help="serve metrics over HTTP on this local port")
     parser.add_option("-n", "--num-nodes",
                       type="int", default=6,
                       help="number of nodes to put in the topology [default: %default]")
     parser.add_option("-p", "--port",
                       type="int", default=OFG_DEFAULT_PORT,
                       help="port number to listen on [default: %default]")
+    parser.add_option("-x", "--extended-frames",
+                      action="store_true", default=False,
+                      help="send long messages in extended frames rather than splitting them")
+    parser.add_option("-z", "--compress-threshold",
+                      type="int", default=None,
+                      help="compress messages of at least this many bytes for clients which support it")
+    parser.add_option("-C", "--columns",
+                      action="store_true", default=False,
+                      help="keep the nodes and links in NumPy columns rather than objects")
+    parser.add_option("-c", "--coalesce-delay",
+                      type="float", default=None,
+                      help="coalesce writes to each client, delaying them at most this many seconds")
+    parser.add_option("-e", "--echo-interval",
+                      type="float", default=None,
+                      help="measure each client's round-trip time every this many seconds")
+    parser.add_option("-f", "--flap-interval",
+                      type="float", default=None,
+                      help="remove or restore a link every this many seconds (sent to subscribers)")
+    parser.add_option("-P", "--profile-dir",
+                      default=None,
+                      help="allow profiling at runtime, writing profiles to this directory")
+    parser.add_option("-v", "--verbose",
+                      action="store_true", default=False,
+                      help="log the full text of each message rather than a summary")
 
     (options, args) = parser.parse_args(argv)
     if len(args) > 1:
         parser.error("too many arguments")
 
-    t = _Test(options.num_nodes, options.auth_test, not options.bicast_test_off)
+    logging.basicConfig(level=logging.DEBUG if options.verbose else logging.INFO)
+    t = _Test(options.num_nodes, options.auth_test, not options.bicast_test_off, options.columns)
     t.add_user('dgu', 'envi')
-    server = create_ofg_server(options.port, lambda a,b : t.print_ltm(a,b))
+    server = create_ofg_server(options.port, lambda a,b : t.print_ltm(a,b),
+                               extended_frames=options.extended_frames,
+                               compress_threshold=options.compress_threshold,
+                               coalesce_max_delay=options.coalesce_delay,
+                               echo_interval=options.echo_interval,
+                               metrics_port=options.metrics_port,
+                               profile_dir=options.profile_dir)
     server.new_conn_callback = lambda a : t.new_conn_callback(a)
+    server.lost_conn_callback = lambda a : t.lost_conn_callback(a)
     t.server = server
+    from OFGTopology import SubscriptionManager
+    t.subs = SubscriptionManager(server, t.topology)
+    from OFGPoll import PollEngine
+    t.polls = PollEngine(server, t.answer)
+    if options.flap_interval is not None:
+        from twisted.internet.task import LoopingCall
+        LoopingCall(t.flap_link).start(options.flap_interval, now=False)
     reactor.run()
 
 if __name__ == "__main__":
@@ -0,0 +1,209 @@
+"""Per message type counters and timings for an OFG server.
+
+Metrics counts the messages and bytes received and sent for each message
+type (bytes sent are counted as packed, before any compression or coalescing)
+and the bytes actually written to clients' transports, and records how long packing, unpacking and the receive callback take
+in LatencyHistograms.  It is cheap enough to leave on (a few increments and
+time.time() calls per message) and can be switched off at any time by
+clearing its enabled flag.
+
+snapshot() returns everything as a dictionary (along with the stats of any
+sources added with add_source(), e.g. the server's fanout_stats()), and
+serve_metrics() serves it over HTTP on a local port: /metrics in the
+Prometheus text format and /metrics.json as JSON.  The same port can also
+serve a profiler's admin commands (see OFGProfiler).
+"""
+
+import json
+import time
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from OFGEcho import LatencyHistogram
+
+class TypeMetrics(object):
+    """Counters and timings for one message type."""
+    __slots__ = ('msgs_in', 'bytes_in', 'bad_in', 'msgs_out', 'bytes_out', 'pack', 'unpack', 'callback')
+
+    def __init__(self):
+        self.msgs_in = 0
+        self.bytes_in = 0
+        self.bad_in = 0  # malformed frames dropped
+        self.msgs_out = 0
+        self.bytes_out = 0
+        self.pack = LatencyHistogram()
+        self.unpack = LatencyHistogram()
+        self.callback = LatencyHistogram()
+
+    def snapshot(self):
+        return {'msgs_in' : self.msgs_in,
+                'bytes_in' : self.bytes_in,
+                'bad_in' : self.bad_in,
+                'msgs_out' : self.msgs_out,
+                'bytes_out' : self.bytes_out,
+                'pack' : self.pack.summary(),
+                'unpack' : self.unpack.summary(),
+                'callback' : self.callback.summary()}
+
+class Metrics:
+    """Collects TypeMetrics for each type of message in lt_protocol (see the
+    module documentation).  Bytes are counted per frame, so a message sent
+    to n clients counts n times, before any compression.  wire_bytes_out
+    counts what was written after compression (in wire_writes writes)."""
+    def __init__(self, lt_protocol, enabled=True):
+        self.enabled = enabled
+        self.names = dict([(t, cls.__name__) for t, cls in lt_protocol.msg_types.iteritems()])
+        self.types = {}  # type value -> TypeMetrics
+        self.sources = []  # (name, function which returns a dictionary of stats)
+        self.wire_writes = 0
+        self.wire_bytes_out = 0
+        self.bad_frames = 0  # malformed frames whose length (and so type) was invalid
+        self.since = time.time()
+
+    def for_type(self, type_val):
+        """Returns the TypeMetrics for the specified type value."""
+        m = self.types.get(type_val)
+        if m is None:
+            m = self.types[type_val] = TypeMetrics()
+        return m
+
+    def type_name(self, type_val):
+        return self.names.get(type_val) or ('type_0x%02x' % type_val)
+
+    def received(self, type_val, num_bytes, unpack_time, callback_time):
+        """Records a received frame and how long it took to unpack and to handle."""
+        m = self.for_type(type_val)
+        m.msgs_in += 1
+        m.bytes_in += num_bytes
+        m.unpack.record(unpack_time)
+        m.callback.record(callback_time)
+
+    def bad(self, type_val, num_bytes):
+        """Records a malformed frame which was dropped (type_val is None if
+        its length was invalid)."""
+        if type_val is None:
+            self.bad_frames += 1
+            return
+        m = self.for_type(type_val)
+        m.bad_in += 1
+        m.bytes_in += num_bytes
+
+    def packed(self, type_val, pack_time):
+        m = self.for_type(type_val)
+        m.pack.record(pack_time)
+
+    def sent(self, type_val, num_msgs, num_bytes):
+        m = self.for_type(type_val)
+        m.msgs_out += num_msgs
+        m.bytes_out += num_bytes
+
+    def wrote(self, num_bytes):
+        """Records one write of num_bytes to a client's transport."""
+        self.wire_writes += 1
+        self.wire_bytes_out += num_bytes
+
+    def add_source(self, name, stats):
+        """Includes the dictionary returned by stats() in snapshots as name."""
+        self.sources.append((name, stats))
+
+    def reset(self):
+        """Forgets everything counted so far."""
+        self.types = {}
+        self.wire_writes = 0
+        self.wire_bytes_out = 0
+        self.bad_frames = 0
+        self.since = time.time()
+
+    def snapshot(self):
+        """Returns a dictionary with the metrics for each message type (keyed
+        by type name) and the stats from each source."""
+        ret = {'enabled' : self.enabled,
+               'seconds' : time.time() - self.since,
+               'wire_writes' : self.wire_writes,
+               'wire_bytes_out' : self.wire_bytes_out,
+               'bad_frames' : self.bad_frames,
+               'types' : dict([(self.type_name(t), m.snapshot()) for t, m in self.types.iteritems()])}
+        for name, stats in self.sources:
+            ret[name] = stats()
+        return ret
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format.
+        Timings are exported as summaries and sources' top-level numbers as
+        gauges."""
+        snap = self.snapshot()
+        types = sorted(snap['types'].items())
+        lines = []
+        for field, name, doc in (('msgs_in', 'ofg_messages_received_total', 'messages received'),
+                                 ('bytes_in', 'ofg_bytes_received_total', 'bytes received'),
+                                 ('bad_in', 'ofg_malformed_messages_received_total',
+                                  'malformed messages received (and dropped)'),
+                                 ('msgs_out', 'ofg_messages_sent_total', 'messages sent'),
+                                 ('bytes_out', 'ofg_bytes_sent_total', 'bytes sent (before compression)')):
+            lines.append('# HELP %s OFG %s by message type' % (name, doc))
+            lines.append('# TYPE %s counter' % name)
+            for t, m in types:
+                lines.append('%s{type="%s"} %d' % (name, t, m[field]))
+
+        for field, name, doc in (('wire_writes', 'ofg_writes_total', 'writes to clients'),
+                                 ('wire_bytes_out', 'ofg_wire_bytes_sent_total',
+                                  'bytes written to clients (after compression)'),
+                                 ('bad_frames', 'ofg_malformed_frames_received_total',
+                                  'frames received with an invalid length (and dropped with the connection)')):
+            lines.append('# HELP %s OFG %s' % (name, doc))
+            lines.append('# TYPE %s counter' % name)
+            lines.append('%s %d' % (name, snap[field]))
+
+        for field, name, doc in (('pack', 'ofg_pack_seconds', 'time to pack a message'),
+                                 ('unpack', 'ofg_unpack_seconds', 'time to unpack a message'),
+                                 ('callback', 'ofg_callback_seconds', 'time to handle a received message')):
+            lines.append('# HELP %s OFG %s by message type' % (name, doc))
+            lines.append('# TYPE %s summary' % name)
+            for t, m in types:
+                s = m[field]
+                if not s['count']:
+                    continue
+                for q, key in (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99')):
+                    lines.append('%s{type="%s",quantile="%s"} %.9f' % (name, t, q, s[key]))
+                lines.append('%s_sum{type="%s"} %.9f' % (name, t, s['mean'] * s['count']))
+                lines.append('%s_count{type="%s"} %d' % (name, t, s['count']))
+
+        for source, _ in self.sources:
+            for key, value in sorted(snap[source].items()):
+                if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+                    lines.append('ofg_%s_%s %r' % (source, key, float(value)))
+        return '\n'.join(lines) + '\n'
+
+class MetricsResource(Resource):
+    """Serves a Metrics' snapshot: as JSON if the path ends with .json, else
+    in the Prometheus text format."""
+    isLeaf = True
+
+    def __init__(self, metrics):
+        Resource.__init__(self)
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        if request.path.endswith('.json'):
+            request.setHeader('Content-Type', 'application/json')
+            return self.metrics.to_json()
+        request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+        return self.metrics.to_prometheus()
+
+def serve_metrics(metrics, port, interface='127.0.0.1', profiler=None):
+    """Serves metrics over HTTP on the specified port (only to the local host
+    by default) at /metrics and /metrics.json, and profiler's admin commands
+    under /admin if profiler is not None.  Returns the listening port."""
+    root = Resource()
+    resource = MetricsResource(metrics)
+    root.putChild('metrics', resource)
+    root.putChild('metrics.json', resource)
+    if profiler is not None:
+        from OFGProfiler import AdminResource
+        root.putChild('admin', AdminResource(profiler))
+    return reactor.listenTCP(port, Site(root), interface=interface)
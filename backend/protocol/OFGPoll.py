@@ -0,0 +1,399 @@
+"""Scheduling of the messages clients ask the backend to poll.
+
+A PollStart asks the backend to process its inner message every interval
+(in units of 100ms) until a PollStop names the PollStart's xid.  An
+interval of 0 asks for the message to be processed just once, right away.
+PollScheduler keeps the active polls in a hashed timer wheel driven by the
+reactor: the wheel has one slot per tick (modulo its size) and each slot
+maps a due tick to the polls due then, grouped by interval.  Adding,
+rescheduling and cancelling a poll are O(1), and each tick only touches the
+polls which are due.
+
+Polls due on the same tick with the same period are handed to the poll
+callback together as one group.  A new poll is given the least loaded of up
+to max_phases phases spread evenly across its interval, so that polls which
+start together (e.g. when GUIs reconnect after a backend restart) do not all
+fire on the same tick.  Polls of the same message share a phase though, so
+their replies can still be shared.
+
+A PollStart may declare a max_interval.  While the backend is overloaded
+(the reactor runs ticks late, or the load callback reports clients' send
+queues backing up) the scheduler stretches every poll's interval by a common
+factor, capped at the poll's max_interval, and shrinks it back once the load
+subsides.  The interval a poll is actually polled at is its period, and the
+interval callback is told whenever polls' periods change so that clients can
+be sent a PollInterval.
+
+PollEngine answers polls through a PollScheduler.  Identical polled
+messages (e.g. the same NodesRequest from many GUIs) are answered once per
+tick and the packed reply is sent to each poller with its xid rewritten.
+"""
+
+from twisted.internet import reactor
+
+from OFGMessage import OFGMessage, PollInterval, PollStart, PollStop
+
+class Poll(object):
+    """An active poll: conn asked for msg to be processed every interval ticks
+    (or as rarely as every max_interval ticks while the backend is loaded)."""
+    __slots__ = ('conn', 'xid', 'interval', 'max_interval', 'period', 'msg', 'group', 'key')
+
+    def __init__(self, conn, xid, interval, msg, max_interval=None, key=None):
+        self.conn = conn
+        self.xid = xid
+        self.interval = interval
+        self.max_interval = max(interval, max_interval or 0)
+        self.period = interval  # the interval it is actually polled at
+        self.msg = msg
+        self.group = None  # the dictionary of polls due with this one
+        self.key = key     # identifies identical polled messages (see PollEngine)
+
+class PollScheduler:
+    """Fires active polls on a hashed timer wheel.
+
+    poll_callback(period, polls) is called once per tick for each period
+    with polls due, with a list of those polls.  interval_callback(polls), if
+    given, is called with the polls whose periods were just changed.
+    load_callback(), if given, returns how loaded the backend is apart from
+    the reactor's lag: 1.0 or more means overloaded.
+    """
+    TICK = 0.1  # seconds per tick (the unit of PollStart.interval)
+    MAX_LAG = 0.05  # smoothed lag (in seconds) of ticks which means overloaded
+    ADAPT_TICKS = 10  # how often (in ticks) the stretch factor is revised
+    MAX_STRETCH = 8.0  # the most intervals are stretched by
+
+    def __init__(self, poll_callback, num_slots=1024, clock=reactor, max_phases=64,
+                 interval_callback=None, load_callback=None):
+        self.poll_callback = poll_callback
+        self.interval_callback = interval_callback
+        self.load_callback = load_callback
+        self.clock = clock
+        self.num_slots = num_slots
+        self.max_phases = max_phases
+        self.slots = [{} for _ in xrange(num_slots)]  # due tick -> {period -> group}
+        self.polls = {}    # (conn, xid) -> Poll
+        self.by_conn = {}  # conn -> set of xids it is polling
+        self.key_phases = {}  # (interval, poll key) -> [phase, number of polls]
+        self.start = clock.seconds()  # when tick 0 began
+        self.now = 0  # the last tick processed
+        self.call = None  # the pending call to process the next tick
+        self.lag = 0.0  # smoothed lag of ticks behind when they were due
+        self.stretch = 1.0  # factor intervals are currently stretched by
+        self.next_adapt = 0  # the tick to next revise the stretch factor at
+        self.num_stretchable = 0  # polls with a max_interval above their interval
+        self.num_stretched = 0  # polls whose period is not their interval
+        self.groups_fired = 0
+        self.polls_fired = 0
+
+    def current_tick(self):
+        return int((self.clock.seconds() - self.start) / PollScheduler.TICK + 1e-9)
+
+    def first_due(self, interval, key=None):
+        """Returns the tick a new poll with the specified interval (and poll
+        key) first fires on: the phase of polls already polling the same key
+        at that interval, or else the least loaded of up to max_phases phases
+        spread evenly across the interval."""
+        if key is not None:
+            phase = self.key_phases.get((interval, key))
+            if phase is not None:
+                return self.now + 1 + (phase[0] - self.now - 1) % interval
+
+        best = best_load = None
+        n = min(interval, self.max_phases)
+        for i in xrange(n):
+            due = self.now + 1 + i * interval // n
+            by_period = self.slots[due % self.num_slots].get(due)
+            load = sum([len(g) for g in by_period.itervalues()]) if by_period else 0
+            if best is None or load < best_load:
+                best, best_load = due, load
+                if not load:
+                    break
+        return best
+
+    def _group(self, due, period):
+        """Returns the group of polls due at tick due with the specified
+        period, creating it if needed."""
+        slot = self.slots[due % self.num_slots]
+        by_period = slot.get(due)
+        if by_period is None:
+            by_period = slot[due] = {}
+        group = by_period.get(period)
+        if group is None:
+            group = by_period[period] = {}
+        return group
+
+    def add(self, conn, xid, interval, msg, max_interval=None, key=None):
+        """Starts polling msg for conn every interval ticks (replacing any
+        poll conn already has with the same xid) and returns the new Poll.
+        The poll may be stretched to as much as max_interval ticks.  key, if
+        given, identifies identical polled messages so they share a phase.
+        An interval of 0 fires the poll once, now, without scheduling it."""
+        if not self.polls:
+            self.now = self.current_tick()  # catch up with the clock while idle
+        pkey = (conn, xid)
+        if pkey in self.polls:
+            self.cancel(conn, xid)
+
+        poll = Poll(conn, xid, interval, msg, max_interval, key)
+        if interval <= 0:
+            self.polls_fired += 1
+            self.poll_callback(0, [poll])
+            return poll
+
+        due = self.first_due(poll.interval, key)
+        poll.group = self._group(due, poll.interval)
+        poll.group[pkey] = poll
+        self.polls[pkey] = poll
+        self.by_conn.setdefault(conn, set()).add(xid)
+        if poll.max_interval > poll.interval:
+            self.num_stretchable += 1
+        if key is not None:
+            phase = self.key_phases.get((poll.interval, key))
+            if phase is None:
+                self.key_phases[(poll.interval, key)] = [due % poll.interval, 1]
+            else:
+                phase[1] += 1
+        self._schedule()
+        return poll
+
+    def cancel(self, conn, xid):
+        """Stops conn's poll with the specified xid.  Returns False if there
+        was no such poll."""
+        poll = self.polls.pop((conn, xid), None)
+        if poll is None:
+            return False
+        del poll.group[(conn, xid)]
+        if poll.max_interval > poll.interval:
+            self.num_stretchable -= 1
+        if poll.period != poll.interval:
+            self.num_stretched -= 1
+        if poll.key is not None:
+            phase = self.key_phases[(poll.interval, poll.key)]
+            phase[1] -= 1
+            if not phase[1]:
+                del self.key_phases[(poll.interval, poll.key)]
+        xids = self.by_conn[conn]
+        xids.discard(xid)
+        if not xids:
+            del self.by_conn[conn]
+        if not self.polls and self.call is not None:
+            self.call.cancel()
+            self.call = None
+        return True
+
+    def remove_conn(self, conn):
+        """Stops all of conn's polls (e.g. when it disconnects)."""
+        for xid in list(self.by_conn.get(conn, ())):
+            self.cancel(conn, xid)
+
+    def handle(self, conn, ltm):
+        """Starts or stops a poll if ltm is a PollStart or PollStop.  Returns
+        False for other messages."""
+        t = ltm.get_type()
+        if t == PollStart.get_type():
+            self.add(conn, ltm.xid, ltm.interval, ltm.lm, ltm.max_interval)
+        elif t == PollStop.get_type():
+            self.cancel(conn, ltm.xid_to_stop_polling)
+        else:
+            return False
+        return True
+
+    def period_for(self, poll):
+        """Returns the interval poll should be polled at with the current
+        stretch factor."""
+        return min(poll.max_interval, int(poll.interval * self.stretch + 0.5))
+
+    def load(self):
+        """Returns how loaded the backend is: the reactor's smoothed lag
+        relative to MAX_LAG, or the load callback's load if that is higher."""
+        load = self.lag / PollScheduler.MAX_LAG
+        if self.load_callback is not None:
+            load = max(load, self.load_callback())
+        return load
+
+    def adapt(self):
+        """Revises the stretch factor: doubles it while overloaded and halves
+        it once the load is well below overloaded."""
+        load = self.load()
+        if load >= 1.0:
+            self.stretch = min(PollScheduler.MAX_STRETCH, self.stretch * 2)
+        elif load < 0.5:
+            self.stretch = max(1.0, self.stretch / 2)
+
+    def run_tick(self, tick):
+        """Fires the polls due at the specified tick and reschedules them."""
+        by_period = self.slots[tick % self.num_slots].pop(tick, None)
+        if by_period is None:
+            return
+        for period, group in by_period.iteritems():
+            if not group:
+                continue  # all of its polls were cancelled
+            self.groups_fired += 1
+            self.polls_fired += len(group)
+            self.poll_callback(period, group.values())
+
+            if self.num_stretched or (self.stretch != 1.0 and self.num_stretchable):
+                self._regroup(tick, group)
+                continue
+
+            # move the whole group to its next due tick
+            due = tick + period
+            by_next = self.slots[due % self.num_slots].setdefault(due, {})
+            other = by_next.get(period)
+            if other is None:
+                by_next[period] = group
+            else:
+                # merge with polls added since which are due then too
+                if len(other) > len(group):
+                    group, other = other, group
+                    by_next[period] = group
+                for key, poll in other.iteritems():
+                    poll.group = group
+                    group[key] = poll
+
+    def _regroup(self, tick, group):
+        """Moves each poll in a group which fired at the specified tick to its
+        next due tick with its current period."""
+        changed = []
+        for key, poll in group.items():
+            period = self.period_for(poll)
+            if period != poll.period:
+                self.num_stretched += (period != poll.interval) - (poll.period != poll.interval)
+                poll.period = period
+                changed.append(poll)
+            poll.group = self._group(tick + period, period)
+            poll.group[key] = poll
+        if changed and self.interval_callback is not None:
+            self.interval_callback(changed)
+
+    def advance(self, tick):
+        """Processes every tick up to and including the specified tick."""
+        while self.now < tick and self.polls:
+            self.now += 1
+            self.run_tick(self.now)
+        self.now = max(self.now, tick)
+
+    def _schedule(self):
+        """Schedules processing of the next tick (if any polls are active)."""
+        if self.call is None and self.polls:
+            delay = self.start + (self.now + 1) * PollScheduler.TICK - self.clock.seconds()
+            self.call = self.clock.callLater(max(0, delay - 1e-9), self._fire)
+
+    def _fire(self):
+        self.call = None
+        late = self.clock.seconds() - (self.start + (self.now + 1) * PollScheduler.TICK)
+        self.lag += (max(0.0, late) - self.lag) / 4
+        tick = self.current_tick()
+        if tick >= self.next_adapt:
+            self.adapt()
+            self.next_adapt = tick + PollScheduler.ADAPT_TICKS
+        self.advance(tick)
+        self._schedule()
+
+    def stats(self):
+        """Returns a dictionary describing the active and fired polls."""
+        return {'active_polls' : len(self.polls),
+                'polling_clients' : len(self.by_conn),
+                'stretched_polls' : self.num_stretched,
+                'stretch' : self.stretch,
+                'lag' : self.lag,
+                'groups_fired' : self.groups_fired,
+                'polls_fired' : self.polls_fired}
+
+class PollEngine:
+    """Answers polls with compute(msg), which returns the reply to a polled
+    message (or None if there is none).  Replies are computed and packed at
+    most once per tick for each distinct polled message, whichever clients
+    poll it and at whatever intervals.  Polled messages are identical if
+    they are packed to the same bytes apart from their xid, and each poller
+    is sent the reply with its own message's xid.  The reply must therefore
+    depend only on the polled message.
+
+    Polls are stretched while the clients' total send backlog exceeds
+    max_backlog_bytes (or the reactor lags), and pollers are sent a
+    PollInterval whenever the interval their poll is polled at changes.
+    """
+    def __init__(self, server, compute, clock=reactor, max_backlog_bytes=1024*1024):
+        self.server = server
+        self.compute = compute
+        self.max_backlog_bytes = max_backlog_bytes
+        self.scheduler = PollScheduler(self.poll, clock=clock,
+                                       interval_callback=self.report_intervals,
+                                       load_callback=self.load)
+        self.cache = {}  # poll key -> {xid -> PackedMessage reply} for cache_tick
+        self.cache_tick = None
+        self.hits = 0
+        self.misses = 0
+
+    def handle(self, conn, ltm):
+        """See PollScheduler.handle().  Polls of identical messages share a
+        phase so that they can share replies."""
+        if ltm.get_type() == PollStart.get_type():
+            self.scheduler.add(conn, ltm.xid, ltm.interval, ltm.lm, ltm.max_interval,
+                               PollEngine.poll_key(ltm.lm))
+            return True
+        return self.scheduler.handle(conn, ltm)
+
+    def remove_conn(self, conn):
+        self.scheduler.remove_conn(conn)
+
+    @staticmethod
+    def poll_key(msg):
+        """Returns a key identifying msg apart from its xid."""
+        return (msg.get_type(), msg.pack()[OFGMessage.SIZE:])
+
+    def reply_for(self, msg, key):
+        """Returns the PackedMessage reply (with msg's xid) to msg this tick,
+        or None if there is none.  The reply is computed and packed once per
+        key; pollers whose message has another xid get a copy with just the
+        xid patched, which is also shared by every poller using that xid
+        (along with its compressed frames, if any)."""
+        if self.cache_tick != self.scheduler.now:
+            self.cache_tick = self.scheduler.now
+            self.cache.clear()
+        replies = self.cache.get(key)
+        if replies is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            reply = self.compute(msg)
+            if reply is None:
+                replies = self.cache[key] = {}
+            else:
+                pm = self.server.pack(reply)
+                replies = self.cache[key] = {pm.ltm.xid : pm}
+        if not replies:
+            return None  # compute() had no reply
+
+        pm = replies.get(msg.xid)
+        if pm is None:
+            pm = replies[msg.xid] = self.server.with_xid(replies.itervalues().next(), msg.xid)
+        return pm
+
+    def poll(self, interval, polls):
+        """Sends each due poll the (possibly cached) reply to its message."""
+        for p in polls:
+            if p.key is None:
+                p.key = PollEngine.poll_key(p.msg)
+            pm = self.reply_for(p.msg, p.key)
+            if pm is not None:
+                self.server.send_msg_to_client(p.conn, pm)
+
+    def load(self):
+        """Returns the clients' total send backlog relative to max_backlog_bytes."""
+        return float(self.server.backlog_bytes()) / self.max_backlog_bytes
+
+    def report_intervals(self, polls):
+        """Tells each poll's client the interval it is now polled at."""
+        for p in polls:
+            self.server.send_msg_to_client(p.conn, PollInterval(p.xid, p.period))
+
+    def stats(self):
+        """Returns the scheduler's stats() with the reply cache's hits, misses
+        and hit ratio."""
+        ret = self.scheduler.stats()
+        total = self.hits + self.misses
+        ret.update({'cache_hits' : self.hits,
+                    'cache_misses' : self.misses,
+                    'cache_hit_ratio' : (float(self.hits) / total) if total else 0.0})
+        return ret
@@ -0,0 +1,190 @@
+"""Profiling a running OFG server without restarting it.
+
+Profiler can, at any time,
+  - start and stop cProfile, dumping the stats (for pstats) to a file;
+  - start and stop a sampling profiler, which records the stack every
+    interval seconds of CPU time (with SIGPROF) and dumps the stacks in the
+    collapsed format flamegraph.pl reads (much cheaper than cProfile);
+  - write a memory snapshot: the number of live objects of each type, and
+    how that changed since the previous snapshot.  (tracemalloc does not
+    exist for Python 2, so this counts what the garbage collector tracks.)
+
+Each of these can be triggered by a signal (see install_signals()) or by a
+POST to the admin resource (see AdminResource and OFGMetrics.serve_metrics()).
+Files are written to the profiler's directory and named after the kind of
+output, the process, the time and a sequence number.
+"""
+
+import cProfile
+import gc
+import os
+import signal
+import time
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+
+from OFGMessage import OFG_LOG
+
+class Profiler:
+    """Starts and stops profiling and writes memory snapshots (see the module
+    documentation), writing the results to out_dir."""
+    SAMPLE_INTERVAL = 0.005  # seconds of CPU time between samples
+
+    def __init__(self, out_dir='.'):
+        self.out_dir = out_dir
+        self.profile = None  # the running cProfile.Profile, if any
+        self.samples = None  # collapsed stack -> number of samples, while sampling
+        self.last_census = {}  # type name -> number of objects at the last snapshot
+        self.files_written = 0
+
+    def path(self, kind, ext):
+        """Returns the path of a new output file of the specified kind."""
+        self.files_written += 1
+        name = 'ofg-%s-%u-%s-%u.%s' % (kind, os.getpid(), time.strftime('%Y%m%d-%H%M%S'),
+                                       self.files_written, ext)
+        return os.path.join(self.out_dir, name)
+
+    def start_profile(self):
+        """Starts cProfile.  Returns False if it was already running."""
+        if self.profile is not None:
+            return False
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return True
+
+    def stop_profile(self):
+        """Stops cProfile and returns the file its stats were dumped to (or
+        None if it was not running)."""
+        if self.profile is None:
+            return None
+        self.profile.disable()
+        path = self.path('profile', 'pstats')
+        self.profile.dump_stats(path)
+        self.profile = None
+        return path
+
+    def start_sampling(self, interval=SAMPLE_INTERVAL):
+        """Starts sampling the stack every interval seconds of CPU time.
+        Returns False if it was already sampling."""
+        if self.samples is not None:
+            return False
+        self.samples = {}
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+        return True
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%u)' % (code.co_name, os.path.basename(code.co_filename),
+                                         code.co_firstlineno))
+            frame = frame.f_back
+        stack.reverse()
+        key = ';'.join(stack)
+        self.samples[key] = self.samples.get(key, 0) + 1
+
+    def stop_sampling(self):
+        """Stops sampling and returns the file the collapsed stacks were
+        written to (or None if it was not sampling)."""
+        if self.samples is None:
+            return None
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        samples = self.samples
+        self.samples = None
+        path = self.path('samples', 'folded')
+        f = open(path, 'w')
+        try:
+            for stack, n in sorted(samples.iteritems(), key=lambda x: -x[1]):
+                f.write('%s %u\n' % (stack, n))
+        finally:
+            f.close()
+        return path
+
+    def census(self):
+        """Returns a dictionary mapping each type name to the number of live
+        objects of that type tracked by the garbage collector."""
+        gc.collect()
+        counts = {}
+        for obj in gc.get_objects():
+            name = type(obj).__name__
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def memory_snapshot(self):
+        """Writes the number of objects of each type (and the change since
+        the previous snapshot) to a file, largest first, and returns it."""
+        counts = self.census()
+        last = self.last_census
+        self.last_census = counts
+        path = self.path('memory', 'txt')
+        f = open(path, 'w')
+        try:
+            f.write('%10s %10s  %s\n' % ('objects', 'change', 'type'))
+            for name, n in sorted(counts.iteritems(), key=lambda x: -x[1]):
+                f.write('%10u %+10d  %s\n' % (n, n - last.get(name, 0), name))
+        finally:
+            f.close()
+        return path
+
+    def toggle_profile(self):
+        """Starts cProfile, or stops it if it is running.  Returns the file
+        the stats were dumped to, if it was stopped."""
+        if not self.start_profile():
+            return self.stop_profile()
+
+    def toggle_sampling(self):
+        """Starts sampling, or stops it if it is sampling.  Returns the file
+        the stacks were written to, if it was stopped."""
+        if not self.start_sampling():
+            return self.stop_sampling()
+
+    def install_signals(self, profile_signal=signal.SIGUSR1, memory_signal=signal.SIGUSR2):
+        """Makes profile_signal toggle cProfile and memory_signal write a
+        memory snapshot, logging what was done (and the file written, if
+        any).  The work is done from the reactor rather than in the signal
+        handler."""
+        signal.signal(profile_signal, lambda signum, frame: reactor.callFromThread(self._signalled_profile))
+        signal.signal(memory_signal, lambda signum, frame: reactor.callFromThread(self._signalled_memory))
+
+    def _signalled_profile(self):
+        path = self.toggle_profile()
+        if path is None:
+            OFG_LOG.info('profiler: cProfile started')
+        else:
+            OFG_LOG.info('profiler: cProfile stopped; stats written to %s' % path)
+
+    def _signalled_memory(self):
+        OFG_LOG.info('profiler: memory snapshot written to %s' % self.memory_snapshot())
+
+class AdminResource(Resource):
+    """Lets local clients control a Profiler by POSTing to the paths in
+    COMMANDS (e.g. .../profile/start).  The response names the file
+    written, if any."""
+    isLeaf = True
+    COMMANDS = {'profile/start' : 'start_profile',
+                'profile/stop' : 'stop_profile',
+                'sample/start' : 'start_sampling',
+                'sample/stop' : 'stop_sampling',
+                'memory' : 'memory_snapshot'}
+
+    def __init__(self, profiler):
+        Resource.__init__(self)
+        self.profiler = profiler
+
+    def render_POST(self, request):
+        request.setHeader('Content-Type', 'text/plain')
+        method = AdminResource.COMMANDS.get('/'.join(request.postpath).strip('/'))
+        if method is None:
+            request.setResponseCode(404)
+            return 'commands: %s\n' % ', '.join(sorted(AdminResource.COMMANDS.keys()))
+        ret = getattr(self.profiler, method)()
+        if ret is True:
+            return 'started\n'
+        elif ret is False:
+            return 'already running\n'
+        elif ret is None:
+            return 'not running\n'
+        return '%s\n' % ret
@@ -0,0 +1,497 @@
+"""Twisted server and client for the OpenFlow GUI protocol (see
+create_ofg_server())."""
+
+import copy
+import time
+
+from twisted.internet import reactor
+from ltprotocol.ltprotocol import LTTwistedClient, LTTwistedProtocol, \
+                                  LTTwistedServer, LTTwistedServerProtocol
+
+from OFGEcho import EchoMonitor, LatencyHistogram
+from OFGMetrics import Metrics
+from OFGMessage import DECODE_ERRORS, OFG_LOG, Batch, Compressed, FlowsAdd, FlowsDel, LinksAdd, \
+                       LinksDel, NodesAdd, NodesDel, log_msg
+
+COMPRESSED_TYPE = Compressed.get_type()
+ENVELOPE_TYPES = (Batch.get_type(), COMPRESSED_TYPE)
+
+class OFGFraming:
+    """Replaces LTTwistedProtocol.dataReceived() with one which also accepts
+    extended frames (see OFGProtocol) and walks the received bytes by offset
+    rather than re-slicing the buffer after every message.  If the factory
+    has enabled Metrics, each frame's size and the time taken to unpack and
+    handle it are recorded.
+
+    Batch and Compressed envelopes are unrolled: each message inside is
+    passed to the receive callback in turn.  Frames of unknown types are
+    skipped (see OFGProtocol.unpack_received_msg()), so one stray message
+    from a newer peer does not cost it the connection.  So are malformed
+    frames (e.g. a truncated Batch or corrupt compressed data), which are
+    logged and counted in bad_frames (and by Metrics).  Only a frame whose
+    length is invalid drops the connection, since the frames after it
+    cannot be found.  Receiving a Compressed envelope also notes that the
+    peer can decode them (peer_compression).
+    """
+    peer_compression = False
+    bad_frames = 0
+
+    def dataReceived(self, data):
+        """Called when data is received on a connection."""
+        lt_protocol = self.factory.lt_protocol
+        recv_callback = self.factory.recv_callback
+        metrics = getattr(self.factory, 'metrics', None)
+        if metrics is not None and not metrics.enabled:
+            metrics = None
+        buf = self.packet + data if self.packet else data
+        off = 0
+        frames = lt_protocol.iter_frames(buf)
+        while True:
+            try:
+                type_val, body, end = next(frames)
+            except StopIteration:
+                break
+            except ValueError as e:
+                self.bad_frame(None, len(buf) - off, e, metrics)
+                self.packet = ''
+                self.plen = 0
+                self.transport.loseConnection()
+                return
+
+            if metrics is not None:
+                start = time.time()
+            try:
+                ltm = lt_protocol.unpack_received_msg(type_val, body)
+                if ltm is not None and type_val in ENVELOPE_TYPES:
+                    msgs = self.unroll(ltm)
+                else:
+                    msgs = (ltm,) if ltm is not None else ()  # unknown types are already counted and logged
+            except DECODE_ERRORS as e:
+                self.bad_frame(type_val, end - off, e, metrics)
+                off = end
+                continue
+            if metrics is not None:
+                unpacked = time.time()
+            for ltm in msgs:
+                recv_callback(self, ltm)
+            if metrics is not None:
+                metrics.received(type_val, end - off, unpacked - start, time.time() - unpacked)
+            off = end
+
+        self.packet = buf[off:]
+        self.plen = len(self.packet)
+
+    def unroll(self, env):
+        """Returns a list of the messages in env (recursively unrolled)."""
+        if env.get_type() == COMPRESSED_TYPE:
+            self.peer_compression = True
+        ret = []
+        for inner in env.messages():
+            if inner.get_type() in ENVELOPE_TYPES:
+                ret.extend(self.unroll(inner))
+            else:
+                ret.append(inner)
+        return ret
+
+    def bad_frame(self, type_val, num_bytes, err, metrics):
+        """Logs and counts a malformed frame of type type_val (None if the
+        frame's length was invalid)."""
+        self.bad_frames += 1
+        what = 'frame' if type_val is None else 'frame of type 0x%02x' % type_val
+        OFG_LOG.warning('dropping a malformed OFG %s (%uB): %s' % (what, num_bytes, err))
+        if metrics is not None:
+            metrics.bad(type_val, num_bytes)
+
+class OFGServerProtocol(OFGFraming, LTTwistedServerProtocol):
+    """A server connection which is also a streaming producer for its own
+    transport: the transport pauses it when its send buffer fills, and
+    messages sent while it is paused wait in a bounded backlog (see
+    OFGServer) until the transport resumes it."""
+    def __init__(self, verbose=True):
+        LTTwistedServerProtocol.__init__(self, verbose)
+        self.pending = []    # frames waiting for the next coalesced write
+        self.pending_len = 0
+        self.paused = False
+        self.backlog = []    # PackedMessages sent while paused
+        self.backlog_len = 0
+        self.peak_backlog_len = 0
+        self.need_snapshot = False  # whether the backlog was replaced by a snapshot
+        self.echoes = {}  # xid -> when each unanswered EchoRequest was sent
+        self.rtt = LatencyHistogram()  # round-trip times of answered EchoRequests
+
+    def connectionMade(self):
+        self.transport.registerProducer(self, True)
+        LTTwistedServerProtocol.connectionMade(self)
+
+    def connectionLost(self, reason):
+        self.backlog = []
+        self.backlog_len = 0
+        LTTwistedServerProtocol.connectionLost(self, reason)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.factory.drain(self)
+
+    def stopProducing(self):
+        self.paused = True
+
+    def transport_buffered(self):
+        """Returns the number of bytes buffered by the transport (if known)."""
+        t = self.transport
+        return len(getattr(t, 'dataBuffer', '')) - getattr(t, 'offset', 0) + getattr(t, '_tempDataLen', 0)
+
+class OFGClientProtocol(OFGFraming, LTTwistedProtocol):
+    pass
+
+class PackedMessage(object):
+    """A message packed once (see OFGServer.pack()) so that the same frames
+    can be written to any number of clients.  Its compressed frames are also
+    built at most once, when first needed."""
+    __slots__ = ('ltm', 'frames', 'length', 'compressed')
+
+    def __init__(self, ltm, frames):
+        self.ltm = ltm
+        self.frames = frames
+        self.length = sum([len(f) for f in frames])
+        self.compressed = None
+
+# what an OFGServer does when a client's backlog exceeds max_queue_bytes
+POLICY_DROP = 'drop'          # disconnect the client
+POLICY_COALESCE = 'coalesce'  # merge adjacent topology deltas of the same type
+POLICY_SNAPSHOT = 'snapshot'  # discard the backlog and later send a fresh snapshot
+SLOW_CLIENT_POLICIES = (POLICY_DROP, POLICY_COALESCE, POLICY_SNAPSHOT)
+
+# maps the type of each topology delta which POLICY_COALESCE may merge to the
+# types of the messages it can be moved ahead of without changing the result
+_NA, _ND = NodesAdd.get_type(), NodesDel.get_type()
+_LA, _LD = LinksAdd.get_type(), LinksDel.get_type()
+_FA, _FD = FlowsAdd.get_type(), FlowsDel.get_type()
+MOVABLE_PAST = {_NA : (_LA, _LD, _FA, _FD),
+                _ND : (),
+                _LA : (_FA, _FD),
+                _LD : (_NA, _ND, _FA, _FD),
+                _FA : (),
+                _FD : (_NA, _ND, _LA, _LD)}
+
+class OFGServer(LTTwistedServer):
+    """An LTTwistedServer for OFG messages.
+
+    Unlike LTTwistedServer, sent messages are only rendered as text when the
+    OFG logger is going to emit them (see log_msg()), rather than eagerly for
+    every connection whenever the server is verbose.  Messages too long for a
+    single frame are split or sent as an extended frame (see
+    OFGProtocol.pack_frames()).
+
+    If compress_threshold is not None, then messages at least that many
+    bytes long are sent in Compressed envelopes to clients which have said
+    they support them.  compression_stats() reports how well that works.
+
+    Each message is packed once however many clients it is sent to; send()
+    and send_msg_to_client() also accept a PackedMessage from pack() so that
+    e.g. a snapshot can be sent to each new client without repacking it.
+    fanout_stats() compares the number of messages packed to the number of
+    writes.
+
+    Messages sent to a client whose transport has paused (because its send
+    buffer is full) are held in a per-client backlog and written when the
+    transport resumes.  If max_queue_bytes is not None, a backlog which
+    grows beyond it is handled according to slow_policy: POLICY_DROP
+    disconnects the client; POLICY_COALESCE merges adjacent deltas of the
+    same type (and disconnects the client if that is not enough);
+    POLICY_SNAPSHOT discards the backlog and, once the client catches up,
+    sends it the messages returned by snapshot_callback(conn) instead.
+    queue_stats() reports each client's backlog and buffered bytes.
+
+    If coalesce_max_delay is not None, then frames are not written as each
+    message is sent.  Instead they are queued per client and written with a
+    single write once coalesce_max_delay seconds have passed (0 flushes on
+    the next reactor iteration, i.e. everything sent during one iteration
+    goes out together), or as soon as a client has coalesce_max_bytes
+    queued.
+
+    If echo_interval is not None, then an EchoMonitor (echo) measures the
+    round-trip time to each client every echo_interval seconds and
+    disconnects clients which leave echo_max_missed echoes in a row
+    unanswered.  Echo messages are then not passed to recv_callback.
+
+    metrics holds per message type counters and timings (see OFGMetrics),
+    collected while metrics.enabled is set (initially metrics_enabled).
+    Its snapshots include the stats reported by the methods below.
+    """
+    protocol = OFGServerProtocol
+
+    def __init__(self, lt_protocol, recv_callback,
+                 new_conn_callback=None, lost_conn_callback=None,
+                 verbose=True, extended_frames=False, compress_threshold=None,
+                 coalesce_max_delay=None, coalesce_max_bytes=65536,
+                 max_queue_bytes=None, slow_policy=POLICY_DROP, snapshot_callback=None,
+                 echo_interval=None, echo_max_missed=3, metrics_enabled=True):
+        LTTwistedServer.__init__(self, lt_protocol, recv_callback,
+                                 new_conn_callback, lost_conn_callback, verbose)
+        self.extended_frames = extended_frames
+        self.compress_threshold = compress_threshold
+        self.bytes_before_compression = 0
+        self.bytes_after_compression = 0
+        self.compression_time = 0.0
+        self.coalesce_max_delay = coalesce_max_delay
+        self.coalesce_max_bytes = coalesce_max_bytes
+        self.flush_call = None  # the pending flush() call, if any
+        self.encodes = 0
+        self.writes = 0
+        self.bytes_written = 0
+
+        if slow_policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError('unknown slow client policy: %s' % slow_policy)
+        if slow_policy == POLICY_SNAPSHOT and snapshot_callback is None:
+            raise ValueError('the snapshot policy requires a snapshot_callback')
+        self.max_queue_bytes = max_queue_bytes
+        self.slow_policy = slow_policy
+        self.snapshot_callback = snapshot_callback
+        self.overflows = 0
+        self.clients_dropped = 0
+
+        self.echo = None
+        if echo_interval is not None:
+            self.echo = EchoMonitor(self, echo_interval, echo_max_missed)
+            self.recv_callback = self.echo.wrap(recv_callback)
+
+        self.listening_port = None  # set by listen()
+        self.profiler = None  # an OFGProfiler.Profiler, if create_ofg_server() made one
+        self.metrics = Metrics(lt_protocol, metrics_enabled)
+        self.metrics.add_source('fanout', self.fanout_stats)
+        self.metrics.add_source('compression', self.compression_stats)
+        self.metrics.add_source('queues', self.queue_stats)
+        if self.echo is not None:
+            self.metrics.add_source('echo', self.echo.stats)
+
+    def listen(self, port):
+        """Starts listening on the specified port (0 picks a free one) and
+        returns the listening port, which is also kept as listening_port
+        (e.g. to find its number or to stop listening)."""
+        self.listening_port = reactor.listenTCP(port, self)
+        return self.listening_port
+
+    def pack(self, ltm):
+        """Returns a PackedMessage holding ltm's frames (or ltm itself if it
+        is already a PackedMessage)."""
+        if isinstance(ltm, PackedMessage):
+            return ltm
+        self.encodes += 1
+        if not self.metrics.enabled:
+            return PackedMessage(ltm, tuple(self.lt_protocol.pack_frames(ltm, self.extended_frames)))
+        start = time.time()
+        pm = PackedMessage(ltm, tuple(self.lt_protocol.pack_frames(ltm, self.extended_frames)))
+        self.metrics.packed(ltm.get_type(), time.time() - start)
+        return pm
+
+    def with_xid(self, pm, xid):
+        """Returns a PackedMessage like pm but with xid as its message's xid.
+        The frames are copied with just the xid patched (rather than packed
+        again), and the new PackedMessage's ltm is a copy of pm's with the
+        same xid.  Compressed frames cannot be patched, so they are built
+        again for the copy if needed."""
+        if pm.ltm.xid == xid:
+            return pm
+        ltm = copy.copy(pm.ltm)
+        ltm.xid = xid
+        set_frame_xid = self.lt_protocol.set_frame_xid
+        return PackedMessage(ltm, tuple([set_frame_xid(f, xid) for f in pm.frames]))
+
+    def frames_for(self, conn, pm):
+        """Returns the frames to send the PackedMessage pm to conn."""
+        if self.compress_threshold is None or not conn.peer_compression \
+           or pm.length < self.compress_threshold:
+            return pm.frames
+        if pm.compressed is None:
+            start = time.time()
+            pm.compressed = tuple(self.lt_protocol.compress_frames(pm.frames, self.extended_frames))
+            self.compression_time += time.time() - start
+            self.bytes_before_compression += pm.length
+            self.bytes_after_compression += sum([len(f) for f in pm.compressed])
+        return pm.compressed
+
+    def send(self, ltm):
+        """Sends a message (or PackedMessage) to all connected clients."""
+        pm = self.pack(ltm)
+        for conn in self.connections:
+            self.send_packed(conn, pm)
+        if self.metrics.enabled:
+            n = len(self.connections)
+            self.metrics.sent(pm.ltm.get_type(), n, n * pm.length)
+        if self.verbose:
+            log_msg('sent:', pm.ltm)
+
+    def send_msg_to_client(self, conn, ltm):
+        """Sends a message (or PackedMessage) to the specified client connection."""
+        pm = self.pack(ltm)
+        self.send_packed(conn, pm)
+        if self.metrics.enabled:
+            self.metrics.sent(pm.ltm.get_type(), 1, pm.length)
+
+    def send_packed(self, conn, pm):
+        """Sends the PackedMessage pm to conn, or adds it to conn's backlog if
+        conn's transport is paused."""
+        if not conn.paused:
+            self.write_frames(conn, self.frames_for(conn, pm))
+        elif not conn.need_snapshot:
+            conn.backlog.append(pm)
+            conn.backlog_len += pm.length
+            conn.peak_backlog_len = max(conn.peak_backlog_len, conn.backlog_len)
+            if self.max_queue_bytes is not None and conn.backlog_len > self.max_queue_bytes:
+                self.overflow(conn)
+
+    def overflow(self, conn):
+        """Applies the slow client policy to conn, whose backlog is too long."""
+        self.overflows += 1
+        if self.slow_policy == POLICY_COALESCE:
+            conn.backlog = self.coalesce_backlog(conn.backlog)
+            conn.backlog_len = sum([pm.length for pm in conn.backlog])
+            if conn.backlog_len <= self.max_queue_bytes:
+                return
+        elif self.slow_policy == POLICY_SNAPSHOT:
+            conn.backlog = []
+            conn.backlog_len = 0
+            conn.need_snapshot = True
+            return
+
+        conn.backlog = []
+        conn.backlog_len = 0
+        self.clients_dropped += 1
+        abort = getattr(conn.transport, 'abortConnection', conn.transport.loseConnection)
+        abort()
+
+    def coalesce_backlog(self, backlog):
+        """Returns backlog with messages of the same type merged (see
+        NodesList.merge()).  A message is only merged into an earlier one if
+        it may be moved ahead of every message in between (see
+        MOVABLE_PAST), e.g. so that links are never added before the nodes
+        they refer to."""
+        groups = []  # lists of PackedMessages to merge into one
+        for pm in backlog:
+            if getattr(pm.ltm, 'merge', None) is None:
+                groups.append([pm])
+                continue
+            movable_past = MOVABLE_PAST.get(pm.ltm.get_type(), ())
+            for g in reversed(groups):
+                if g[0].ltm.__class__ is pm.ltm.__class__:
+                    g.append(pm)
+                    break
+                elif g[0].ltm.get_type() not in movable_past:
+                    groups.append([pm])
+                    break
+            else:
+                groups.append([pm])
+
+        ret = []
+        for g in groups:
+            if len(g) == 1:
+                ret.append(g[0])
+            else:
+                ltm = g[0].ltm
+                for pm in g[1:]:
+                    ltm = ltm.merge(pm.ltm)
+                ret.append(self.pack(ltm))
+        return ret
+
+    def drain(self, conn):
+        """Sends conn its snapshot (if its backlog was replaced by one) and its
+        backlog, stopping if the transport pauses again."""
+        if conn.need_snapshot:
+            conn.need_snapshot = False
+            for ltm in self.snapshot_callback(conn):
+                self.send_packed(conn, self.pack(ltm))
+
+        backlog = conn.backlog
+        i = 0
+        while i < len(backlog) and not conn.paused:
+            pm = backlog[i]
+            i += 1
+            conn.backlog_len -= pm.length
+            self.write_frames(conn, self.frames_for(conn, pm))
+        del backlog[:i]
+
+    def write_frames(self, conn, frames):
+        """Writes frames to conn now or, if coalescing, queues them.  Frames
+        written immediately are handed to the transport as they are rather
+        than copied, so every client shares the same buffers."""
+        n = sum([len(f) for f in frames])
+        if self.coalesce_max_delay is None or (not conn.pending and n >= self.coalesce_max_bytes):
+            conn.transport.writeSequence(frames)
+            self.writes += 1
+            self.bytes_written += n
+            if self.metrics.enabled:
+                self.metrics.wrote(n)
+            return
+
+        conn.pending.extend(frames)
+        conn.pending_len += n
+        if conn.pending_len >= self.coalesce_max_bytes:
+            self.flush_conn(conn)
+        elif self.flush_call is None:
+            self.flush_call = reactor.callLater(self.coalesce_max_delay, self.flush)
+
+    def flush_conn(self, conn):
+        """Writes the frames queued for conn as one buffer."""
+        if len(conn.pending) == 1:
+            conn.transport.write(conn.pending[0])
+        else:
+            conn.transport.write(''.join(conn.pending))
+        self.writes += 1
+        self.bytes_written += conn.pending_len
+        if self.metrics.enabled:
+            self.metrics.wrote(conn.pending_len)
+        conn.pending = []
+        conn.pending_len = 0
+
+    def flush(self):
+        """Writes the frames queued for every client."""
+        if self.flush_call is not None and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        for conn in self.connections:
+            if conn.pending:
+                self.flush_conn(conn)
+
+    def compression_stats(self):
+        """Returns a dictionary describing the bytes compressed so far, the
+        resulting compression ratio, and the time spent compressing."""
+        before = self.bytes_before_compression
+        after = self.bytes_after_compression
+        return {'bytes_in' : before,
+                'bytes_out' : after,
+                'ratio' : (float(before) / after) if after else 1.0,
+                'seconds' : self.compression_time}
+
+    def fanout_stats(self):
+        """Returns a dictionary with the number of messages packed, the number
+        of writes to clients, and the number of bytes written."""
+        return {'encodes' : self.encodes,
+                'writes' : self.writes,
+                'bytes_written' : self.bytes_written}
+
+    def backlog_bytes(self):
+        """Returns the total number of bytes in clients' backlogs."""
+        return sum([conn.backlog_len for conn in self.connections])
+
+    def queue_stats(self):
+        """Returns a dictionary with the number of backlog overflows, the number
+        of clients dropped, and for each client (keyed by its peer address) the
+        state of its backlog, coalescing queue and transport send buffer."""
+        clients = {}
+        for conn in self.connections:
+            clients[str(conn)] = {'paused' : conn.paused,
+                                  'queued_msgs' : len(conn.backlog),
+                                  'queued_bytes' : conn.backlog_len,
+                                  'peak_queued_bytes' : conn.peak_backlog_len,
+                                  'pending_bytes' : conn.pending_len,
+                                  'transport_bytes' : conn.transport_buffered()}
+        return {'overflows' : self.overflows,
+                'clients_dropped' : self.clients_dropped,
+                'clients' : clients}
+
+class OFGClient(LTTwistedClient):
+    """An LTTwistedClient which understands extended OFG frames."""
+    protocol = OFGClientProtocol
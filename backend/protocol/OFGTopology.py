@@ -0,0 +1,445 @@
+"""An indexed, in-memory store of a network topology which can answer OFG
+requests for its nodes, links and flows.
+
+Nodes are keyed by (node_type, id).  Links are keyed by their endpoints
+(see link_key()) and indexed by source node, destination node and link type.
+Flows are indexed by flow_id (several flows, e.g. the paths of a bicast flow,
+may share one) and by flow type.  Requests are answered from these indexes,
+so e.g. the links from one node are found without scanning every link.
+The nodes which the stored links and flows refer to are interned (see
+OFGMessage.Node.intern()), so each node is one object however many links
+and flow hops refer to it.
+
+A TopologyStore can instead keep its nodes and links only in an
+OFGArrays.TopologyColumns (which needs NumPy), which takes a fraction of the
+memory of the objects and indexes.  Requests are then answered with array
+messages packed straight from the columns, found by scanning the columns
+rather than through per-node indexes.
+
+SubscriptionManager tracks TYPE_SUBSCRIBE requests and pushes each change
+to the topology to just the subscribers whose requests it matches.
+"""
+
+from OFGMessage import NODE_TABLE, Flow, FlowHop, FlowsAdd, FlowsDel, FlowsRequest, Link, LinksAdd, \
+                       LinksDel, LinkSpec, LinksRequest, Node, NodesAdd, NodesDel, NodesRequest, Request
+
+# the key of the node in a LinksRequest which asks for links from any node
+ANY_NODE_KEY = (Request.ANY_TYPE, 0)
+
+def node_key(n):
+    return (n.node_type, n.id)
+
+def link_key(l):
+    """Returns the key which identifies a link: its endpoints and ports."""
+    return (l.src_node.node_type, l.src_node.id, l.src_port,
+            l.dst_node.node_type, l.dst_node.id, l.dst_port)
+
+def as_link(l):
+    """Returns a Link (without a capacity, e.g. for a LinksDel) for a Link or LinkSpec."""
+    if l.__class__ is Link:
+        return l
+    return Link(l.link_type, l.src_node, l.src_port, l.dst_node, l.dst_port)
+
+def intern_link(l):
+    """Returns a LinkSpec like l whose endpoints are interned nodes: l itself
+    if it is a LinkSpec which already refers to them."""
+    src = Node.intern(l.src_node.node_type, l.src_node.id)
+    dst = Node.intern(l.dst_node.node_type, l.dst_node.id)
+    if src is l.src_node and dst is l.dst_node and hasattr(l, 'capacity_bps'):
+        return l
+    return LinkSpec(l.link_type, src, l.src_port, dst, l.dst_port, getattr(l, 'capacity_bps', 0))
+
+def intern_flow(f):
+    """Returns a Flow like f whose endpoints and hops refer to interned nodes."""
+    intern = Node.intern
+    path = [FlowHop(h.inport, intern(h.node.node_type, h.node.id), h.outport) for h in f.path]
+    return Flow(f.flow_type, f.flow_id, intern(f.src_node.node_type, f.src_node.id), f.src_port,
+                intern(f.dst_node.node_type, f.dst_node.id), f.dst_port, path)
+
+def _index_add(index, k, item_key, item):
+    d = index.get(k)
+    if d is None:
+        d = index[k] = {}
+    d[item_key] = item
+
+def _index_remove(index, k, item_key):
+    d = index.get(k)
+    if d is not None:
+        d.pop(item_key, None)
+        if not d:
+            del index[k]
+
+class TopologyStore:
+    """Nodes, links and flows with the indexes needed to answer requests.
+    If columns is True, the nodes and links are kept in a TopologyColumns
+    instead of as objects (see the module documentation), and the methods
+    which return them build Node and LinkSpec objects on demand."""
+    def __init__(self, columns=False):
+        self.nodes = {}           # node_key -> Node
+        self.nodes_by_type = {}   # node_type -> {node_key -> Node}
+
+        self.links = {}           # link_key -> LinkSpec
+        self.links_by_src = {}    # node_key -> {link_key -> LinkSpec}
+        self.links_by_dst = {}    # node_key -> {link_key -> LinkSpec}
+        self.links_by_type = {}   # link_type -> {link_key -> LinkSpec}
+
+        self.flows = {}           # flow_id -> [Flow]
+        self.flows_by_type = {}   # flow_type -> {flow_id -> [Flow]}
+
+        self.columns = None
+        if columns:
+            from OFGArrays import TopologyColumns
+            self.columns = TopologyColumns()
+
+    def add_node(self, n):
+        """Adds a node.  Returns False if it was already present."""
+        cols = self.columns
+        if cols is not None:
+            i = cols.node_row(n.node_type, n.id)
+            if i is not None and cols.listed[i]:
+                return False
+            cols.add_node(n.node_type, n.id)
+            return True
+
+        k = node_key(n)
+        if k in self.nodes:
+            return False
+        n = self.nodes[k] = Node.intern(n.node_type, n.id)
+        _index_add(self.nodes_by_type, n.node_type, k, n)
+        return True
+
+    def remove_node(self, n):
+        """Removes a node (if present) and returns a list of the links to or
+        from it, which are removed too."""
+        cols = self.columns
+        if cols is not None:
+            i = cols.node_row(n.node_type, n.id)
+            if i is None or not cols.listed[i]:
+                return []
+            links = cols.linkspecs(cols.attached_rows(i))
+            cols.remove_node(n.node_type, n.id)
+            return links
+
+        k = node_key(n)
+        n = self.nodes.pop(k, None)
+        if n is None:
+            return []
+        _index_remove(self.nodes_by_type, n.node_type, k)
+        attached = self.links_by_src.get(k, {}).copy()
+        attached.update(self.links_by_dst.get(k, {}))  # by link_key, so a self-loop is listed once
+        links = attached.values()
+        for l in links:
+            self.remove_link(l)
+        NODE_TABLE.release(n.node_type, n.id)
+        return links
+
+    def add_link(self, l):
+        """Adds or replaces a link.  A Link without a capacity is stored as a
+        LinkSpec with a capacity of 0.  Returns False if a link between the
+        same ports was already present."""
+        if not hasattr(l, 'capacity_bps'):
+            l = LinkSpec(l.link_type, l.src_node, l.src_port, l.dst_node, l.dst_port, 0)
+        cols = self.columns
+        if cols is not None:
+            n = cols.num_links
+            cols.add_linkspec(l)
+            return cols.num_links > n
+
+        l = intern_link(l)
+        k = link_key(l)
+        old = self.links.get(k)
+        if old is not None:
+            _index_remove(self.links_by_type, old.link_type, k)
+        self.links[k] = l
+        _index_add(self.links_by_src, node_key(l.src_node), k, l)
+        _index_add(self.links_by_dst, node_key(l.dst_node), k, l)
+        _index_add(self.links_by_type, l.link_type, k, l)
+        return old is None
+
+    def remove_link(self, l):
+        """Removes the link between l's ports and returns it (or None)."""
+        cols = self.columns
+        if cols is not None:
+            i = cols.link_row(l)
+            if i is None:
+                return None
+            l = cols.linkspecs([i])[0]
+            cols.remove_link(l)
+            return l
+
+        k = link_key(l)
+        l = self.links.pop(k, None)
+        if l is not None:
+            _index_remove(self.links_by_src, node_key(l.src_node), k)
+            _index_remove(self.links_by_dst, node_key(l.dst_node), k)
+            _index_remove(self.links_by_type, l.link_type, k)
+        return l
+
+    def add_flow(self, f):
+        """Adds a flow (alongside any others with the same flow_id)."""
+        f = intern_flow(f)
+        paths = self.flows.get(f.flow_id)
+        if paths is None:
+            paths = self.flows[f.flow_id] = []
+            _index_add(self.flows_by_type, f.flow_type, f.flow_id, paths)
+        paths.append(f)
+
+    def remove_flow(self, flow_id):
+        """Removes and returns the list of flows with the specified flow_id."""
+        paths = self.flows.pop(flow_id, [])
+        if paths:
+            _index_remove(self.flows_by_type, paths[0].flow_type, flow_id)
+        return paths
+
+    def get_nodes(self, node_type=Request.ANY_TYPE):
+        """Returns a list of the nodes of the specified type (default: all)."""
+        if self.columns is not None:
+            return self.columns.nodes(self.columns.node_rows(node_type))
+        if node_type == Request.ANY_TYPE:
+            return self.nodes.values()
+        return self.nodes_by_type.get(node_type, {}).values()
+
+    def links_from(self, n):
+        cols = self.columns
+        if cols is not None:
+            i = cols.node_row(n.node_type, n.id)
+            return cols.linkspecs(cols.link_rows(src=i)) if i is not None else []
+        return self.links_by_src.get(node_key(n), {}).values()
+
+    def links_to(self, n):
+        cols = self.columns
+        if cols is not None:
+            i = cols.node_row(n.node_type, n.id)
+            return cols.linkspecs(cols.link_rows(dst=i)) if i is not None else []
+        return self.links_by_dst.get(node_key(n), {}).values()
+
+    def _column_link_rows(self, link_type=Request.ANY_TYPE, src_node=None):
+        """Returns the rows of the columns' links of the specified type from
+        src_node (default: any node)."""
+        cols = self.columns
+        if src_node is None or node_key(src_node) == ANY_NODE_KEY:
+            return cols.link_rows(link_type)
+        i = cols.node_row(src_node.node_type, src_node.id)
+        if i is None:
+            return []
+        return cols.link_rows(link_type, src=i)
+
+    def get_links(self, link_type=Request.ANY_TYPE, src_node=None):
+        """Returns a list of the links of the specified type (default: all)
+        from src_node (default: any node)."""
+        if self.columns is not None:
+            return self.columns.linkspecs(self._column_link_rows(link_type, src_node))
+        if src_node is not None and node_key(src_node) != ANY_NODE_KEY:
+            links = self.links_from(src_node)
+            if link_type == Request.ANY_TYPE:
+                return links
+            return [l for l in links if l.link_type == link_type]
+        elif link_type == Request.ANY_TYPE:
+            return self.links.values()
+        return self.links_by_type.get(link_type, {}).values()
+
+    def get_flows(self, flow_type=Request.ANY_TYPE):
+        """Returns a list of the flows of the specified type (default: all)."""
+        if flow_type == Request.ANY_TYPE:
+            groups = self.flows.itervalues()
+        else:
+            groups = self.flows_by_type.get(flow_type, {}).itervalues()
+        return [f for paths in groups for f in paths]
+
+    def apply(self, ltm):
+        """Updates the store with a NodesAdd, NodesDel, LinksAdd, LinksDel,
+        FlowsAdd or FlowsDel message.  Returns False for other messages."""
+        t = ltm.get_type()
+        if t == NodesAdd.get_type():
+            for n in ltm.nodes:
+                self.add_node(n)
+        elif t == NodesDel.get_type():
+            for n in ltm.nodes:
+                self.remove_node(n)
+        elif t == LinksAdd.get_type():
+            for l in ltm.links:
+                self.add_link(l)
+        elif t == LinksDel.get_type():
+            for l in ltm.links:
+                self.remove_link(l)
+        elif t == FlowsAdd.get_type():
+            for f in ltm.flows:
+                self.add_flow(f)
+        elif t == FlowsDel.get_type():
+            for f in ltm.flows:
+                self.remove_flow(f.flow_id)
+        else:
+            return False
+        return True
+
+    def answer(self, req):
+        """Returns the reply (a NodesAdd, LinksAdd or FlowsAdd with the
+        request's xid) to a NodesRequest, LinksRequest or FlowsRequest, or
+        None if req is not one of those."""
+        t = req.get_type()
+        cols = self.columns
+        if t == NodesRequest.get_type():
+            if cols is not None:
+                return cols.nodes_add(req.xid, cols.node_rows(req.type))
+            return NodesAdd(self.get_nodes(req.type), req.xid)
+        elif t == LinksRequest.get_type():
+            if cols is not None:
+                return cols.links_add(req.xid, self._column_link_rows(req.type, req.src_node))
+            return LinksAdd(self.get_links(req.type, req.src_node), req.xid)
+        elif t == FlowsRequest.get_type():
+            return FlowsAdd(self.get_flows(req.type), req.xid)
+        return None
+
+# the message class used to send each kind of delta to a subset of subscribers
+DELTA_CLASSES = dict((c.get_type(), c) for c in (NodesAdd, NodesDel, LinksAdd, LinksDel,
+                                                  FlowsAdd, FlowsDel))
+
+class SubscriptionManager:
+    """Tracks the clients which have subscribed (with a NodesRequest,
+    LinksRequest or FlowsRequest of TYPE_SUBSCRIBE) to changes in the
+    topology and pushes each change only to the subscribers it matches.
+    Each subscriber is sent its changes with the xid of its subscribe
+    request (if several of its subscriptions match, with one of theirs).
+
+    Subscriptions are indexed by the request type and its filter (the node,
+    link or flow type, and for links the source node), so finding the
+    subscribers interested in a node, link or flow takes a few dictionary
+    lookups whatever the number of subscriptions.
+    """
+    def __init__(self, server, store=None):
+        """server is used to send the updates.  If store is not None, then
+        update() applies each change to it before pushing it."""
+        self.server = server
+        self.store = store
+        self.subs = {}     # subscription key -> {conn -> xid of its request}
+        self.by_conn = {}  # conn -> set of its subscription keys
+
+    @staticmethod
+    def sub_key(req):
+        """Returns the key for the subscription req asks for."""
+        t = req.get_type()
+        if t == LinksRequest.get_type():
+            return (t, req.type, node_key(req.src_node))
+        return (t, req.type)
+
+    def handle_request(self, conn, req):
+        """Subscribes or unsubscribes conn as req asks.  Returns False if req
+        is not a subscribe or unsubscribe request."""
+        if req.get_type() not in (NodesRequest.get_type(), LinksRequest.get_type(),
+                                  FlowsRequest.get_type()):
+            return False
+        k = SubscriptionManager.sub_key(req)
+        if req.request_type == Request.TYPE_SUBSCRIBE:
+            _index_add(self.subs, k, conn, req.xid)
+            self.by_conn.setdefault(conn, set()).add(k)
+        elif req.request_type == Request.TYPE_UNSUBSCRIBE:
+            _index_remove(self.subs, k, conn)
+            keys = self.by_conn.get(conn)
+            if keys is not None:
+                keys.discard(k)
+                if not keys:
+                    del self.by_conn[conn]
+        else:
+            return False
+        return True
+
+    def remove_conn(self, conn):
+        """Removes all of conn's subscriptions (e.g. when it disconnects)."""
+        for k in self.by_conn.pop(conn, ()):
+            _index_remove(self.subs, k, conn)
+
+    def num_subscriptions(self):
+        return sum([len(keys) for keys in self.by_conn.itervalues()])
+
+    def _subscribers(self, keys):
+        """Returns a dictionary mapping each conn subscribed to any of keys to
+        the xid of its subscription."""
+        found = [self.subs[k] for k in keys if k in self.subs]
+        if len(found) == 1:
+            return found[0]
+        ret = {}
+        for d in found:
+            ret.update(d)
+        return ret
+
+    def node_subscribers(self, n):
+        t = NodesRequest.get_type()
+        return self._subscribers(((t, n.node_type), (t, Request.ANY_TYPE)))
+
+    def link_subscribers(self, l):
+        t = LinksRequest.get_type()
+        src = node_key(l.src_node)
+        return self._subscribers(((t, l.link_type, src), (t, Request.ANY_TYPE, src),
+                                  (t, l.link_type, ANY_NODE_KEY), (t, Request.ANY_TYPE, ANY_NODE_KEY)))
+
+    def flow_subscribers(self, f):
+        t = FlowsRequest.get_type()
+        return self._subscribers(((t, f.flow_type), (t, Request.ANY_TYPE)))
+
+    def publish(self, ltm):
+        """Sends each subscriber the part of a topology delta message (e.g. a
+        NodesAdd) which matches its subscriptions.  Subscribers which match
+        the same elements share one packed message, and those subscribed to
+        every element of the message's kind get the message itself without
+        checking each element.  Returns the number of subscribers sent
+        something."""
+        t = ltm.get_type()
+        if t in (NodesAdd.get_type(), NodesDel.get_type()):
+            elems, match = ltm.nodes, self.node_subscribers
+            any_key = (NodesRequest.get_type(), Request.ANY_TYPE)
+        elif t in (LinksAdd.get_type(), LinksDel.get_type()):
+            elems, match = ltm.links, self.link_subscribers
+            any_key = (LinksRequest.get_type(), Request.ANY_TYPE, ANY_NODE_KEY)
+        elif t in (FlowsAdd.get_type(), FlowsDel.get_type()):
+            elems, match = ltm.flows, self.flow_subscribers
+            any_key = (FlowsRequest.get_type(), Request.ANY_TYPE)
+        else:
+            return 0
+        if not self.subs or not len(elems):
+            return 0
+
+        everything = self.subs.get(any_key, {})
+        if everything:
+            whole = {}  # xid -> PackedMessage of the whole message
+            pm = self.server.pack(ltm)
+            for conn, xid in everything.iteritems():
+                xpm = whole.get(xid)
+                if xpm is None:
+                    xpm = whole[xid] = self.server.with_xid(pm, xid)
+                self.server.send_msg_to_client(conn, xpm)
+
+        per_conn = {}  # conn -> (xid, indices of the elements it subscribed to)
+        if len(everything) < len(self.by_conn):
+            for i, e in enumerate(elems):
+                for conn, xid in match(e).iteritems():
+                    if conn not in everything:
+                        per_conn.setdefault(conn, (xid, []))[1].append(i)
+
+        packed = {}  # (xid, tuple of element indices) -> PackedMessage
+        for conn, (xid, indices) in per_conn.iteritems():
+            key = (xid, tuple(indices))
+            pm = packed.get(key)
+            if pm is None:
+                msg = DELTA_CLASSES[t]([elems[i] for i in indices], xid)
+                pm = packed[key] = self.server.pack(msg)
+            self.server.send_msg_to_client(conn, pm)
+        return len(everything) + len(per_conn)
+
+    def update(self, ltm):
+        """Applies a topology delta message to the store (if any) and pushes
+        it to the matching subscribers.  Removing nodes from the store also
+        removes their links, so link subscribers are first sent a LinksDel
+        for those."""
+        if self.store is None:
+            return self.publish(ltm)
+        if ltm.get_type() != NodesDel.get_type():
+            self.store.apply(ltm)
+            return self.publish(ltm)
+
+        links = []
+        for n in ltm.nodes:
+            links.extend(self.store.remove_node(n))
+        n = 0
+        if links:
+            n = self.publish(LinksDel([as_link(l) for l in links], ltm.xid))
+        return n + self.publish(ltm)
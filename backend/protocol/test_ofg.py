@@ -0,0 +1,404 @@
+"""Tests for the OFG protocol backend.  Run them with trial (from this
+directory): trial test_ofg"""
+
+from twisted.internet import defer, reactor
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from OFGEcho import EchoMonitor, LatencyHistogram
+from OFGLoadGen import LoadClient, LoadGenerator
+from OFGMessage import OFG_MESSAGES, OFG_PROTOCOL, AuthReply, AuthRequest, AuthStatus, Batch, \
+                       Compressed, Disconnect, EchoReply, EchoRequest, Flow, FlowHop, FlowsAdd, \
+                       FlowsDel, FlowsRequest, Link, LinkSpec, LinksAdd, LinksDel, LinksRequest, \
+                       Node, NodesAdd, NodesDel, NodesRequest, PollInterval, PollStart, PollStop, \
+                       Request, StatsHeader, StatsReply, StatsRequest, create_ofg_server, sha1
+from OFGPoll import PollEngine, PollScheduler
+from OFGServer import OFGClient, OFGServer, OFGServerProtocol
+from OFGTopology import SubscriptionManager, TopologyStore, link_key
+
+def make_messages():
+    """Returns a dictionary mapping the name of each class in OFG_MESSAGES to
+    an instance of it."""
+    n1 = Node(Node.TYPE_OPENFLOW_SWITCH, 0x0000001122334455)
+    n2 = Node(Node.TYPE_HOST, 0x0000001122334466)
+    lspec = LinkSpec(Link.TYPE_WIRE, n1, 1, n2, 2, 1000*1000*1000)
+    link = Link(Link.TYPE_WIRE, n1, 1, n2, 2)
+    flow = Flow(Flow.TYPE_UNKNOWN, 44, n1, 0, n2, 1, [FlowHop(1, n2, 2), FlowHop(3, n1, 4)])
+    return {'Disconnect' : Disconnect(1),
+            'EchoRequest' : EchoRequest(2),
+            'EchoReply' : EchoReply(3),
+            'AuthRequest' : AuthRequest('s' * 20, 4),
+            'AuthReply' : AuthReply('dgu', sha1(sha1('envi') + 's' * 20), 4),
+            'AuthStatus' : AuthStatus(True, 'ok', 4),
+            'Compressed' : Compressed.wrap([NodesAdd([n1, n2], 5)], 6),
+            'Batch' : Batch([PollStop(7, 8), EchoRequest(9)], 10),
+            'PollStart' : PollStart(10, NodesRequest(Request.TYPE_ONETIME, Request.ANY_TYPE, 11), 12, 40),
+            'PollInterval' : PollInterval(12, 20, 13),
+            'PollStop' : PollStop(12, 14),
+            'NodesAdd' : NodesAdd([n1, n2], 15),
+            'NodesDel' : NodesDel([n1], 16),
+            'LinksAdd' : LinksAdd([lspec], 17),
+            'LinksDel' : LinksDel([link], 18),
+            'FlowsAdd' : FlowsAdd([flow], 19),
+            'FlowsDel' : FlowsDel([flow], 20),
+            'NodesRequest' : NodesRequest(Request.TYPE_SUBSCRIBE, Node.TYPE_OPENFLOW_SWITCH, 21),
+            'LinksRequest' : LinksRequest(Request.TYPE_ONETIME, Link.TYPE_WIRE, n1, 22),
+            'FlowsRequest' : FlowsRequest(Request.TYPE_ONETIME, Request.ANY_TYPE, 23),
+            'StatsRequest' : StatsRequest(0x1122, StatsHeader.TYPE_DESC, 0, '', 24),
+            'StatsReply' : StatsReply(0x1122, StatsHeader.TYPE_PORT, 1, 'x' * 104, 25)}
+
+def make_nodes(n):
+    return [Node(Node.TYPE_OPENFLOW_SWITCH, i + 1) for i in xrange(n)]
+
+def node_ids(nodes):
+    return [n.id for n in nodes]
+
+class FakeTransport:
+    """Collects what is written to a connection."""
+    def __init__(self):
+        self.frames = []
+        self.lost = False
+
+    def writeSequence(self, frames):
+        self.frames.extend(frames)
+
+    def write(self, data):
+        self.frames.append(data)
+
+    def loseConnection(self):
+        self.lost = True
+
+    def getPeer(self):
+        return 'fake peer'
+
+    def messages(self):
+        buf = ''.join(self.frames)
+        return [OFG_PROTOCOL.unpack_received_msg(t, b) for t, b, _ in OFG_PROTOCOL.iter_frames(buf)]
+
+def make_conn(server):
+    """Returns a connection to server with a FakeTransport."""
+    conn = OFGServerProtocol(False)
+    conn.transport = FakeTransport()
+    conn.factory = server
+    server.connections.append(conn)
+    return conn
+
+def frame(type_val, body):
+    """Returns a frame holding an arbitrary body."""
+    return OFG_PROTOCOL.frame_hdr.pack(OFG_PROTOCOL.frame_hdr.size + len(body), type_val) + body
+
+class CodecTest(unittest.TestCase):
+    def test_every_type_has_a_sample(self):
+        self.assertEqual(sorted(make_messages().keys()), sorted([c.__name__ for c in OFG_MESSAGES]))
+
+    def test_round_trip(self):
+        for name, msg in make_messages().iteritems():
+            body = msg.pack()
+            copy = OFG_PROTOCOL.unpack_received_msg(msg.get_type(), body)
+            self.assertEqual(copy.__class__.__name__, name)
+            self.assertEqual(copy.xid, msg.xid, name)
+            self.assertEqual(copy.pack(), body, name)
+
+    def test_length_matches_pack(self):
+        for name, msg in make_messages().iteritems():
+            self.assertEqual(msg.length(), len(msg.pack()), name)
+
+    def test_records(self):
+        """Records decode in place from any offset into a buffer."""
+        msgs = make_messages()
+        n1, n2 = msgs['NodesAdd'].nodes
+        flow = msgs['FlowsAdd'].flows[0]
+        for rec in (n1, msgs['LinksDel'].links[0], msgs['LinksAdd'].links[0], flow.path[0]):
+            buf = rec.pack()
+            self.assertEqual(len(buf), rec.SIZE)
+            self.assertEqual(rec.__class__.unpack(buf).pack(), buf)
+            self.assertEqual(rec.__class__.unpack_from('pad' + buf, 3).pack(), buf)
+        buf = flow.pack()
+        self.assertEqual(flow.length(), len(buf))
+        self.assertEqual(Flow.unpack(buf).pack(), buf)
+        self.assertEqual(Flow.unpack_from('pad' + buf, 3).pack(), buf)
+
+class ReceiveTest(unittest.TestCase):
+    """Frames of unknown types and malformed frames are skipped rather than
+    costing the peer its connection."""
+    def setUp(self):
+        self.received = []
+        self.server = OFGServer(OFG_PROTOCOL, lambda conn, ltm: self.received.append(ltm), verbose=False)
+        self.conn = make_conn(self.server)
+
+    def receive(self, bad):
+        """Feeds the connection bad between two EchoRequests, one byte at a
+        time, and checks that both EchoRequests arrive."""
+        data = OFG_PROTOCOL.pack_with_header(EchoRequest(1)) + bad + OFG_PROTOCOL.pack_with_header(EchoRequest(2))
+        for i in xrange(len(data)):
+            self.conn.dataReceived(data[i])
+        self.assertEqual([m.xid for m in self.received], [1, 2])
+        self.assertFalse(self.conn.transport.lost)
+
+    def test_unknown_type(self):
+        before = OFG_PROTOCOL.unknown_counts[0x7f]
+        self.receive(frame(0x7f, 'abc'))
+        self.assertEqual(OFG_PROTOCOL.unknown_counts[0x7f], before + 1)
+        self.assertEqual(self.conn.bad_frames, 0)
+
+    def test_truncated_batch(self):
+        body = Batch([EchoRequest(3), NodesAdd(make_nodes(3), 4)], 5).pack()
+        self.receive(frame(Batch.get_type(), body[:-3]))
+        self.assertEqual(self.conn.bad_frames, 1)
+        self.assertEqual(self.server.metrics.snapshot()['types']['Batch']['bad_in'], 1)
+
+    def test_bad_zlib_body(self):
+        body = Compressed.FMT.pack(6, Compressed.CODEC_ZLIB) + 'not zlib data'
+        self.receive(frame(Compressed.get_type(), body))
+        self.assertEqual(self.conn.bad_frames, 1)
+        self.assertEqual(self.server.metrics.snapshot()['types']['Compressed']['bad_in'], 1)
+
+    def test_short_body(self):
+        self.receive(frame(NodesAdd.get_type(), '\x00\x01'))
+        self.assertEqual(self.conn.bad_frames, 1)
+
+    def test_invalid_length_drops_connection(self):
+        self.conn.dataReceived(OFG_PROTOCOL.pack_with_header(EchoRequest(1)) + '\x00\x01\x02abc')
+        self.assertEqual([m.xid for m in self.received], [1])
+        self.assertTrue(self.conn.transport.lost)
+        self.assertEqual(self.server.metrics.snapshot()['bad_frames'], 1)
+
+class LoopbackTest(unittest.TestCase):
+    """Sends a 100k node topology from a server made by create_ofg_server()
+    to a client over a local TCP connection."""
+    NUM_NODES = 100000
+
+    def exchange(self, extended_frames):
+        nodes = make_nodes(LoopbackTest.NUM_NODES)
+        received = []
+        done = defer.Deferred()
+        server_lost = defer.Deferred()
+        client_lost = defer.Deferred()
+
+        server = create_ofg_server(0, lambda conn, ltm: None, extended_frames=extended_frames)
+        server.verbose = False
+        server.new_conn_callback = lambda conn: server.send_msg_to_client(conn, NodesAdd(nodes, 9))
+        server.lost_conn_callback = lambda conn: server_lost.callback(None)
+
+        def recv(conn, ltm):
+            self.assertEqual(ltm.xid, 9)
+            received.extend(ltm.nodes)
+            if len(received) >= len(nodes) and not done.called:
+                done.callback(conn)
+        client = OFGClient(OFG_PROTOCOL, recv, None, lambda conn: client_lost.callback(None),
+                           verbose=False)
+        client.connect('127.0.0.1', server.listening_port.getHost().port)
+
+        def check(conn):
+            self.assertEqual(node_ids(received), node_ids(nodes))
+            client.stopTrying()
+            conn.transport.loseConnection()
+            return defer.gatherResults([server_lost, client_lost])
+        def stop(result):
+            return server.listening_port.stopListening()
+        timeout = reactor.callLater(30, lambda: done.called or done.errback(AssertionError('timed out')))
+        done.addCallback(check)
+        done.addCallback(stop)
+        done.addBoth(lambda r: (timeout.active() and timeout.cancel(), r)[1])
+        return done
+
+    def test_split_frames(self):
+        """The message is split into frames which each fit the 16-bit length."""
+        self.assertTrue(len(OFG_PROTOCOL.pack_frames(NodesAdd(make_nodes(LoopbackTest.NUM_NODES)))) > 1)
+        return self.exchange(False)
+
+    def test_extended_frames(self):
+        return self.exchange(True)
+
+class EnvelopeTest(unittest.TestCase):
+    def test_compressed(self):
+        inner = [NodesAdd(make_nodes(1000), 4), EchoRequest(5)]
+        env = Compressed.wrap(inner, 6)
+        self.assertTrue(env.length() < len(env.frames))
+        copy = Compressed.unpack(env.pack())
+        self.assertEqual([m.pack() for m in copy.messages()], [m.pack() for m in inner])
+
+    def test_batch(self):
+        inner = [PollStop(1, 2), NodesAdd(make_nodes(3), 4)]
+        copy = Batch.unpack(Batch(inner, 5).pack())
+        self.assertEqual(copy.xid, 5)
+        self.assertEqual([m.pack() for m in copy.messages()], [m.pack() for m in inner])
+
+    def test_batch_split(self):
+        batch = Batch([NodesAdd(make_nodes(100), i) for i in xrange(50)], 1)
+        parts = batch.split(4096)
+        self.assertTrue(len(parts) > 1)
+        for p in parts:
+            self.assertTrue(p.length() <= 4096)
+        self.assertEqual([m.xid for p in parts for m in p.messages()], range(50))
+
+    def test_incomplete_frame_waits(self):
+        data = OFG_PROTOCOL.pack_with_header(NodesAdd(make_nodes(3), 7))
+        self.assertEqual(list(OFG_PROTOCOL.iter_frames(data[:-1])), [])
+        self.assertEqual(len(list(OFG_PROTOCOL.iter_frames(data))), 1)
+
+class SubscriptionTest(unittest.TestCase):
+    def check_cascade(self, columns):
+        """Removing a node sends link subscribers one LinksDel with each of
+        its links (a self-loop included) once, with their own xid."""
+        server = OFGServer(OFG_PROTOCOL, None, verbose=False)
+        store = TopologyStore(columns)
+        subs = SubscriptionManager(server, store)
+        conn = make_conn(server)
+        n1, n2 = make_nodes(2)
+        links = [LinkSpec(Link.TYPE_WIRE, n1, 1, n1, 2, 0), LinkSpec(Link.TYPE_WIRE, n1, 3, n2, 1, 0),
+                 LinkSpec(Link.TYPE_WIRE, n2, 2, n1, 4, 0)]
+        store.apply(NodesAdd([n1, n2]))
+        for l in links:
+            store.add_link(l)
+        subs.handle_request(conn, LinksRequest(Request.TYPE_SUBSCRIBE, Request.ANY_TYPE, Node(0, 0), 7))
+
+        subs.update(NodesDel([n1], 9))
+        msgs = conn.transport.messages()
+        self.assertEqual([m.xid for m in msgs], [7])
+        self.assertEqual(sorted(map(link_key, msgs[0].links)), sorted(map(link_key, links)))
+        self.assertEqual(store.get_links(), [])
+
+    def test_cascade(self):
+        self.check_cascade(False)
+
+    def test_cascade_columns(self):
+        self.check_cascade(True)
+
+class PollTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.fired = []
+        self.sched = PollScheduler(lambda period, polls: self.fired.extend([p.xid for p in polls]),
+                                   clock=self.clock)
+
+    def advance(self, ticks):
+        for _ in xrange(ticks):
+            self.clock.advance(PollScheduler.TICK)
+
+    def test_fires_every_interval(self):
+        self.sched.add('c', 1, 5, None)
+        self.advance(50)
+        self.assertEqual(self.fired, [1] * 10)
+
+    def test_poll_stop(self):
+        self.sched.handle('c', PollStart(2, NodesRequest(Request.TYPE_ONETIME, 0, 9), 3))
+        self.advance(10)
+        self.sched.handle('c', PollStop(3))
+        self.advance(10)
+        self.assertEqual(self.fired, [3] * 5)
+        self.assertEqual(self.sched.stats()['active_polls'], 0)
+
+    def test_interval_zero_fires_once(self):
+        self.sched.add('c', 1, 0, None)
+        self.assertEqual(self.fired, [1])
+        self.advance(20)
+        self.assertEqual(self.fired, [1])
+        self.assertEqual(self.sched.stats()['active_polls'], 0)
+
+    def test_remove_conn(self):
+        self.sched.add('a', 1, 1, None)
+        self.sched.add('b', 1, 1, None)
+        self.sched.remove_conn('a')
+        self.advance(3)
+        self.assertEqual(self.fired, [1] * 3)
+
+    def test_phases_spread(self):
+        """Polls with the same interval fire on different ticks."""
+        for xid in xrange(1, 5):
+            self.sched.add('c', xid, 4, None)
+        per_tick = []
+        for _ in xrange(8):
+            del self.fired[:]
+            self.advance(1)
+            per_tick.append(len(self.fired))
+        self.assertEqual(per_tick, [1] * 8)
+
+    def test_stretched_under_load(self):
+        """Polls are stretched up to their max_interval while the backend is
+        overloaded and go back to their interval once it is not."""
+        load = [2.0]
+        self.sched = PollScheduler(lambda period, polls: self.fired.extend([p.xid for p in polls]),
+                                   clock=self.clock, load_callback=lambda: load[0])
+        self.sched.handle('c', PollStart(2, NodesRequest(Request.TYPE_ONETIME, 0, 9), 3, 4))
+        self.advance(40)
+        self.assertEqual(len(self.fired), 10)
+        self.assertEqual(self.sched.stats()['stretched_polls'], 1)
+        load[0] = 0.0
+        self.advance(20)
+        del self.fired[:]
+        self.advance(40)
+        self.assertEqual(len(self.fired), 20)
+        self.assertEqual(self.sched.stats()['stretched_polls'], 0)
+
+    def test_poll_start_without_max_interval(self):
+        msg = PollStart(5, NodesRequest(Request.TYPE_ONETIME, Request.ANY_TYPE, 1), 2)
+        copy = PollStart.unpack(msg.pack())
+        self.assertEqual(copy.max_interval, None)
+        self.assertEqual(copy.lm.xid, 1)
+
+    def test_engine_shares_replies(self):
+        calls = []
+        def compute(msg):
+            calls.append(msg.xid)
+            return NodesAdd(make_nodes(10), msg.xid)
+        server = OFGServer(OFG_PROTOCOL, None, verbose=False)
+        engine = PollEngine(server, compute, clock=self.clock)
+        conns = [make_conn(server) for _ in xrange(3)]
+        for i, conn in enumerate(conns):
+            engine.handle(conn, PollStart(10, NodesRequest(Request.TYPE_ONETIME, 0, 100 + i), i))
+        self.advance(10)
+        self.assertEqual(len(calls), 1)
+        for i, conn in enumerate(conns):
+            self.assertEqual([m.xid for m in conn.transport.messages()], [100 + i])
+
+class EchoTest(unittest.TestCase):
+    def test_reaps_silent_clients(self):
+        clock = Clock()
+        server = OFGServer(OFG_PROTOCOL, None, verbose=False)
+        monitor = EchoMonitor(server, 1.0, max_missed=2, clock=clock)
+        quiet = make_conn(server)
+        chatty = make_conn(server)
+        for _ in xrange(4):
+            clock.advance(1.0)
+            for m in chatty.transport.messages():
+                monitor.handle(chatty, EchoReply(m.xid))
+            chatty.transport.frames = []
+        monitor.stop()
+        self.assertTrue(quiet.transport.lost)
+        self.assertFalse(chatty.transport.lost)
+        self.assertEqual(monitor.reaped, 1)
+        self.assertEqual(chatty.rtt.count, 4)
+
+    def test_histogram_percentiles(self):
+        h = LatencyHistogram()
+        for us in xrange(1, 1001):
+            h.record(us / 1e6)
+        self.assertEqual(h.count, 1000)
+        self.assertTrue(abs(h.percentile(50) - 500e-6) / 500e-6 < 1.0 / LatencyHistogram.SUB_BUCKETS)
+        self.assertEqual(h.percentile(100), h.max)
+
+class LoadClientTest(unittest.TestCase):
+    def test_polls(self):
+        """Poll replies carry the polled request's xid and a PollStop names
+        the PollStart's."""
+        gen = LoadGenerator('127.0.0.1', 0, 1, auth=None, polls_per_client=2)
+        client = LoadClient(gen)
+        client.connect_started = 0.0
+        conn = OFGServerProtocol(False)
+        conn.transport = FakeTransport()
+        client.connected(conn)
+        self.assertEqual(gen.ready, [client])
+        starts = conn.transport.messages()
+        self.assertEqual([m.get_type() for m in starts], [PollStart.get_type()] * 2)
+
+        client.recv(conn, NodesAdd(make_nodes(1), starts[0].lm.xid))
+        client.recv(conn, NodesAdd(make_nodes(1), starts[0].xid))
+        self.assertEqual(gen.stats.counts['poll_replies'], 1)
+        self.assertEqual(gen.stats.counts['unmatched'], 1)
+
+        conn.transport.frames = []
+        client.stop_polls()
+        stops = conn.transport.messages()
+        self.assertEqual(sorted([m.xid_to_stop_polling for m in stops]), sorted([m.xid for m in starts]))
+        self.assertEqual(client.polls, {})
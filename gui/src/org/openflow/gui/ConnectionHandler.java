@@ -11,6 +11,8 @@ import org.openflow.gui.drawables.NodeWithPorts;
 import org.openflow.gui.drawables.OpenFlowSwitch;
 import org.openflow.gui.net.BackendConnection;
 import org.openflow.gui.net.MessageProcessor;
+import org.openflow.gui.net.protocol.Batch;
+import org.openflow.gui.net.protocol.Compressed;
 import org.openflow.gui.net.protocol.FlowsAdd;
 import org.openflow.gui.net.protocol.FlowsDel;
 import org.openflow.gui.net.protocol.LinksAdd;
@@ -18,6 +20,7 @@ import org.openflow.gui.net.protocol.LinksDel;
 import org.openflow.gui.net.protocol.NodeType;
 import org.openflow.gui.net.protocol.OFGMessage;
 import org.openflow.gui.net.protocol.OFGMessageType;
+import org.openflow.gui.net.protocol.PollInterval;
 import org.openflow.gui.net.protocol.Request;
 import org.openflow.gui.net.protocol.RequestLinks;
 import org.openflow.gui.net.protocol.RequestType;
@@ -107,6 +110,9 @@ public class ConnectionHandler implements MessageProcessor<OFGMessage>,
         else {
             // ask the backend for a list of switches and links
             try {
+                // tell the backend we can decode compressed messages
+                connection.sendMessage(new Compressed());
+
                 if(isSubscribeToSwitchChanges()) {
                     connection.sendMessage(new Request(OFGMessageType.NODES_REQUEST, RequestType.ONETIME));
                     connection.sendMessage(new Request(OFGMessageType.NODES_REQUEST, RequestType.SUBSCRIBE));
@@ -145,6 +151,20 @@ public class ConnectionHandler implements MessageProcessor<OFGMessage>,
         case AUTH_STATUS:
             processAuthStatus((AuthStatus)msg);
             break;
+
+        case COMPRESSED:
+            for(OFGMessage m : ((Compressed)msg).messages)
+                process(m);
+            break;
+
+        case BATCH:
+            for(OFGMessage m : ((Batch)msg).messages)
+                process(m);
+            break;
+            
+        case POLL_INTERVAL:
+            processPollInterval((PollInterval)msg);
+            break;
             
         case ECHO_REQUEST:
             processEchoRequest(msg.xid);
@@ -241,6 +261,14 @@ public class ConnectionHandler implements MessageProcessor<OFGMessage>,
         }
     }
     
+    /** 
+     * Records the interval the backend is actually polling one of our polls at
+     * so that rates computed from polled replies use the right interval.
+     */
+    protected void processPollInterval(PollInterval msg) {
+        getConnection().setPollInterval(msg.xid_polled, msg.pollInterval);
+    }
+    
     /** 
      * Handles the echo reply by simply printing a message to stdout.
      */
@@ -3,6 +3,7 @@ package org.openflow.gui.net;
 import org.openflow.gui.net.protocol.OFGMessage;
 import org.openflow.gui.net.protocol.OFGMessageType;
 import org.openflow.gui.net.protocol.PollStart;
+import org.openflow.gui.net.protocol.PollStop;
 
 import java.io.IOException;
 import java.net.Socket;
@@ -259,14 +260,21 @@ public class BackendConnection<MSG_TYPE extends Message> extends Thread {
         
         long bytesReadBefore = in.getBytesRead();
 
-        // determine how long the message is
-        int len = in.readShort();
+        // determine how long the message is; a length of zero marks an 
+        // extended frame whose real length (including the extra 4 bytes of 
+        // header) follows as an unsigned 32-bit integer
+        int len = in.readUnsignedShort();
+        int extHeaderLen = 0;
+        if(len == 0) {
+            extHeaderLen = 4;
+            len = in.readInt() - extHeaderLen;
+        }
 
         // decode the message
         MSG_TYPE msg = msgProcessor.decode(len, in);
 
         // make sure we consume exactly the specified number of bytes or problems have
-        long bytesRead = in.getBytesRead() - bytesReadBefore;
+        long bytesRead = in.getBytesRead() - bytesReadBefore - extHeaderLen;
         if(bytesRead < len) {
             int bytesLeftover = (int)(len - bytesRead);
             if(in.skipBytes(bytesLeftover) != bytesLeftover)
@@ -291,6 +299,9 @@ public class BackendConnection<MSG_TYPE extends Message> extends Thread {
     /** stateful messages which are being polled by the backend for us */
     protected ConcurrentHashMap<Integer, OFGMessage> outstandingStatefulPollRequests = new ConcurrentHashMap<Integer, OFGMessage>();
     
+    /** interval (in 100ms units) each of our polls is actually being polled at, keyed by the PollStart's xid */
+    protected ConcurrentHashMap<Integer, Short> pollIntervals = new ConcurrentHashMap<Integer, Short>();
+    
     /** 
      * Tries to send a message and sets the transaction ID of the message
      * to the next available transaction ID.  If m is a POLL_REQUEST message, 
@@ -321,10 +332,15 @@ public class BackendConnection<MSG_TYPE extends Message> extends Thread {
         
         if(m.isStatefulRequest())
             outstandingStatefulRequests.put(m.xid, m);
+        else if(m.type == OFGMessageType.POLL_STOP)
+            pollIntervals.remove(((PollStop)m).xid_to_stop_polling);
         else if(m.type == OFGMessageType.POLL_START) {
             // store stateful poll requests in a different map since they do 
             // not expire when a reply comes in
             PollStart pollMsg = (PollStart)m;
+            if(pollMsg.pollInterval != 0)
+                pollIntervals.put(pollMsg.xid, pollMsg.pollInterval);
+            
             if(pollMsg.msg.isStatefulRequest()) {
                 if(pollMsg.pollInterval != 0) {
                     pollMsg.msg.xid = nextXID++;
@@ -347,6 +363,23 @@ public class BackendConnection<MSG_TYPE extends Message> extends Thread {
         return (m != null) ? m : outstandingStatefulRequests.remove(xid);
     }
     
+    /** 
+     * Returns the interval (in 100ms units) the backend is actually polling 
+     * the PollStart with the specified transaction ID at, or 0 if it is not 
+     * polling it.  This may differ from the requested interval if the backend
+     * stretched the poll.
+     */
+    public short getPollInterval(int pollXID) {
+        Short interval = pollIntervals.get(pollXID);
+        return (interval == null) ? 0 : interval;
+    }
+    
+    /** records the interval the backend reports it is polling a PollStart at */
+    public void setPollInterval(int pollXID, short interval) {
+        if(pollIntervals.containsKey(pollXID))
+            pollIntervals.put(pollXID, interval);
+    }
+    
     /** Remove cached stateful requests which have been cached for longer than getRequestLifetime() */
     protected void scrubExpiredStatefulRequests() {
         long now = System.currentTimeMillis();
@@ -365,6 +398,7 @@ public class BackendConnection<MSG_TYPE extends Message> extends Thread {
         stats.disconnected();
         outstandingStatefulRequests.clear();
         outstandingStatefulPollRequests.clear();
+        pollIntervals.clear();
         msgProcessor.connectionStateChange(false);
     }
     
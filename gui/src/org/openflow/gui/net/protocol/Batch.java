@@ -0,0 +1,73 @@
+package org.openflow.gui.net.protocol;
+
+import java.io.ByteArrayInputStream;
+import java.io.DataInput;
+import java.io.DataInputStream;
+import java.io.DataOutput;
+import java.io.EOFException;
+import java.io.IOException;
+import java.util.ArrayList;
+
+/**
+ * A sequence of messages carried in one frame.  Each message is framed within
+ * the body just as PollStart frames its inner message.
+ */
+public class Batch extends OFGMessage {
+    /** the messages in this batch */
+    public final OFGMessage[] messages;
+
+    /** creates a batch holding the specified messages */
+    public Batch(OFGMessage... msgs) {
+        super(OFGMessageType.BATCH, 0);
+        messages = msgs;
+    }
+
+    public Batch(final int len, final int xid, final DataInput in) throws IOException {
+        super(OFGMessageType.BATCH, xid);
+        byte[] frames = new byte[len - super.length()];
+        in.readFully(frames);
+        messages = decodeFrames(frames);
+    }
+
+    /**
+     * Decodes a sequence of frames (standard or extended) into the messages
+     * they hold.
+     */
+    public static OFGMessage[] decodeFrames(byte[] frames) throws IOException {
+        DataInputStream in = new DataInputStream(new ByteArrayInputStream(frames));
+        ArrayList<OFGMessage> msgs = new ArrayList<OFGMessage>();
+        while(true) {
+            int len;
+            try {
+                len = in.readUnsignedShort();
+            }
+            catch(EOFException e) {
+                break;
+            }
+            if(len == 0)
+                len = in.readInt() - 4; // extended frame: discount its extra header bytes
+
+            byte[] frame = new byte[len - 2];
+            in.readFully(frame);
+            msgs.add(OFGMessageType.decode(len, new DataInputStream(new ByteArrayInputStream(frame))));
+        }
+        return msgs.toArray(new OFGMessage[msgs.size()]);
+    }
+
+    public int length() {
+        int len = super.length();
+        for(OFGMessage m : messages)
+            len += m.length();
+        return len;
+    }
+
+    public void write(DataOutput out) throws IOException {
+        super.write(out);
+        for(OFGMessage m : messages)
+            m.write(out);
+    }
+
+    public String toString() {
+        return super.toString() + TSSEP + messages.length + " messages";
+    }
+}
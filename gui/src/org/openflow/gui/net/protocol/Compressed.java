@@ -0,0 +1,97 @@
+package org.openflow.gui.net.protocol;
+
+import java.io.ByteArrayOutputStream;
+import java.io.DataInput;
+import java.io.DataOutput;
+import java.io.DataOutputStream;
+import java.io.IOException;
+import java.util.zip.DataFormatException;
+import java.util.zip.Deflater;
+import java.util.zip.Inflater;
+
+/**
+ * An envelope holding the frames of one or more messages compressed together.
+ * Sending one (even an empty one) tells the backend that this client can
+ * decode them.
+ */
+public class Compressed extends OFGMessage {
+    /** the codec used to compress the frames: zlib */
+    public static final byte CODEC_ZLIB = 0;
+
+    /** the codec used to compress the frames */
+    public final byte codec;
+
+    /** the messages in this envelope */
+    public final OFGMessage[] messages;
+
+    /** the compressed frames of the messages in this envelope */
+    private final byte[] compressed;
+
+    /** creates an envelope holding the specified messages */
+    public Compressed(OFGMessage... msgs) throws IOException {
+        super(OFGMessageType.COMPRESSED, 0);
+        codec = CODEC_ZLIB;
+        messages = msgs;
+
+        ByteArrayOutputStream frames = new ByteArrayOutputStream();
+        DataOutputStream out = new DataOutputStream(frames);
+        for(OFGMessage m : msgs)
+            m.write(out);
+        out.flush();
+
+        Deflater deflater = new Deflater();
+        deflater.setInput(frames.toByteArray());
+        deflater.finish();
+        ByteArrayOutputStream zout = new ByteArrayOutputStream();
+        byte[] buf = new byte[4096];
+        while(!deflater.finished())
+            zout.write(buf, 0, deflater.deflate(buf));
+        deflater.end();
+        compressed = zout.toByteArray();
+    }
+
+    public Compressed(final int len, final int xid, final DataInput in) throws IOException {
+        super(OFGMessageType.COMPRESSED, xid);
+        codec = in.readByte();
+        if(codec != CODEC_ZLIB)
+            throw new IOException("Unknown compression codec: " + codec);
+
+        compressed = new byte[len - super.length() - 1];
+        in.readFully(compressed);
+
+        Inflater inflater = new Inflater();
+        inflater.setInput(compressed);
+        ByteArrayOutputStream frames = new ByteArrayOutputStream();
+        byte[] buf = new byte[4096];
+        try {
+            while(!inflater.finished()) {
+                int n = inflater.inflate(buf);
+                if(n == 0 && (inflater.needsInput() || inflater.needsDictionary()))
+                    throw new IOException("Truncated compressed message");
+                frames.write(buf, 0, n);
+            }
+        }
+        catch(DataFormatException e) {
+            throw new IOException("Invalid compressed message: " + e.getMessage());
+        }
+        finally {
+            inflater.end();
+        }
+
+        messages = Batch.decodeFrames(frames.toByteArray());
+    }
+
+    public int length() {
+        return super.length() + 1 + compressed.length;
+    }
+
+    public void write(DataOutput out) throws IOException {
+        super.write(out);
+        out.writeByte(codec);
+        out.write(compressed);
+    }
+
+    public String toString() {
+        return super.toString() + TSSEP + messages.length + " messages in " + compressed.length + "B";
+    }
+}
@@ -29,6 +29,15 @@ public enum OFGMessageType {
     
     /** Information about whether a user has been authenticated */
     AUTH_STATUS((byte)0x05),
+
+    /** Envelope holding other messages compressed together */
+    COMPRESSED((byte)0x06),
+
+    /** Sequence of messages carried in one frame */
+    BATCH((byte)0x07),
+    
+    /** The interval the backend is actually polling a message at */
+    POLL_INTERVAL((byte)0x0D),
     
     /** Tell the backend to start polling a message */
     POLL_START((byte)0x0E),
@@ -131,6 +140,15 @@ public enum OFGMessageType {
             
             case AUTH_STATUS:
                 return new AuthStatus(len, xid, in);
+
+            case COMPRESSED:
+                return new Compressed(len, xid, in);
+
+            case BATCH:
+                return new Batch(len, xid, in);
+            
+            case POLL_INTERVAL:
+                return new PollInterval(len, xid, in);
             
             case NODES_ADD:
                 return new NodesAdd(len, xid, in);
@@ -0,0 +1,31 @@
+package org.openflow.gui.net.protocol;
+
+import java.io.DataInput;
+import java.io.IOException;
+
+/**
+ * Tells us the interval the backend is actually polling one of our 
+ * PollStart messages at (e.g. because it stretched the poll while loaded).
+ */
+public class PollInterval extends OFGMessage {
+    /** the transaction ID of the PollStart being polled */
+    public final int xid_polled;
+    
+    /** time between copies of the polled message being sent out (in units of 100ms) */
+    public final short pollInterval;
+    
+    public PollInterval(final int len, final int xid, final DataInput in) throws IOException {
+        super(OFGMessageType.POLL_INTERVAL, xid);
+        xid_polled = in.readInt();
+        pollInterval = in.readShort();
+    }
+    
+    public int length() {
+        return super.length() + 6;
+    }
+    
+    public String toString() {
+        return super.toString() + TSSEP + "polling xid=" + xid_polled + 
+               " every " + (pollInterval*100) + "ms";
+    }
+}
@@ -15,6 +15,13 @@ public class PollStart extends OFGMessage {
      * */
     public final short pollInterval;
     
+    /** 
+     * the longest interval the backend may stretch this poll to while it is 
+     * loaded (in units of 100ms); if no more than pollInterval, then it will 
+     * not be stretched
+     */
+    public final short maxPollInterval;
+    
     /** the message to poll */
     public final OFGMessage msg;
     
@@ -26,21 +33,48 @@ public class PollStart extends OFGMessage {
      * @param msg           the message to send
      */
     public PollStart(short pollInterval, OFGMessage msg) {
+        this(pollInterval, pollInterval, msg);
+    }
+    
+    /**
+     * Construct a PollStart message which the backend may poll less often 
+     * while it is loaded.  The backend sends a PollInterval whenever the 
+     * interval it is actually polling at changes.
+     * 
+     * @param pollInterval     how often (in 100ms units) for the backend to 
+     *                         send this message; if 0, then it will be sent 
+     *                         only once 
+     * @param maxPollInterval  the least often (in 100ms units) the backend 
+     *                         may send this message
+     * @param msg              the message to send
+     */
+    public PollStart(short pollInterval, short maxPollInterval, OFGMessage msg) {
         super(OFGMessageType.POLL_START, 0);
         this.pollInterval = pollInterval;
+        this.maxPollInterval = maxPollInterval;
         this.msg = msg;
     }
     
+    /** whether the backend may stretch this poll */
+    private boolean isStretchable() {
+        return maxPollInterval > pollInterval;
+    }
+    
     /** This returns the maximum length of LinkSubscribe */
     public int length() {
-        return super.length() + 2 + msg.length();
+        return super.length() + 2 + msg.length() + (isStretchable() ? 2 : 0);
     }
     
-    /** Writes the header (via super.write()), the poll interval, and poll message */
+    /** 
+     * Writes the header (via super.write()), the poll interval, poll message, 
+     * and the maximum poll interval (if the poll may be stretched)
+     */
     public void write(DataOutput out) throws IOException {
         super.write(out);
         out.writeShort(pollInterval);
         msg.write(out);
+        if(isStretchable())
+            out.writeShort(maxPollInterval);
     }
     
     public String toString() {